@@ -0,0 +1,68 @@
+import os
+import time
+import random
+import tempfile
+import argparse
+from osgeo import gdal
+from tif_convert import convert_one
+from bench_pds_label import write_synthetic, terrain
+
+# Compare the legacy striped BIGTIFF against COG output:
+# file size, random windowed-read latency and a decimated whole-image read.
+
+gdal.UseExceptions()
+
+
+def window_latency(path, reads, size, seed=1):
+    ds = gdal.Open(path)
+    w, h = ds.RasterXSize, ds.RasterYSize
+    ds = None
+    rng = random.Random(seed)
+    times = []
+    for _ in range(reads):
+        x, y = rng.randrange(0, max(1, w - size)), rng.randrange(0, max(1, h - size))
+        start = time.perf_counter()
+        ds = gdal.Open(path)  # fresh handle: no warm GDAL block cache between reads
+        ds.GetRasterBand(1).ReadAsArray(x, y, min(size, w), min(size, h))
+        ds = None
+        times.append(time.perf_counter() - start)
+    times.sort()
+    return sum(times) / len(times), times[int(0.95 * (len(times) - 1))]
+
+
+def overview_latency(path, max_dim=1024):
+    start = time.perf_counter()
+    ds = gdal.Open(path)
+    w, h = ds.RasterXSize, ds.RasterYSize
+    scale = max(w, h) / max_dim
+    ds.GetRasterBand(1).ReadAsArray(buf_xsize=max(1, int(w / scale)), buf_ysize=max(1, int(h / scale)))
+    ds = None
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark striped GeoTIFF vs COG output")
+    parser.add_argument("img", nargs="?", help=".IMG to convert (default: synthetic product)")
+    parser.add_argument("--lines", type=int, default=20000)
+    parser.add_argument("--samples", type=int, default=5056)
+    parser.add_argument("--reads", type=int, default=200)
+    parser.add_argument("--window", type=int, default=512)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        img = args.img
+        if img is None:
+            img = write_synthetic(tmp, 1, lines=args.lines, record_bytes=args.samples,
+                                  pixels=lambda i: terrain(args.lines, args.samples))[0]
+        print(f"Input: {img} ({os.path.getsize(img) / 1e6:.1f} MB)")
+
+        for mode, compress in [("gtiff", None), ("cog", "DEFLATE"), ("cog", "ZSTD"), ("cog", "LZW")]:
+            out_dir = os.path.join(tmp, f"{mode}_{compress}")
+            os.makedirs(out_dir)
+            start = time.perf_counter()
+            out = convert_one(img, out_dir, mode=mode, compress=compress or "NONE")
+            convert_s = time.perf_counter() - start
+            mean, p95 = window_latency(out, args.reads, args.window)
+            print(f"{mode:5s} {str(compress or '-'):7s} size {os.path.getsize(out) / 1e6:8.1f} MB  "
+                  f"convert {convert_s:6.2f}s  {args.window}px read mean {mean * 1e3:6.2f} ms "
+                  f"p95 {p95 * 1e3:6.2f} ms  overview read {overview_latency(out) * 1e3:7.1f} ms")
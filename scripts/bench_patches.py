@@ -0,0 +1,105 @@
+import os
+import time
+import tempfile
+import argparse
+import multiprocessing as mp
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from bench_pds_label import terrain
+from scrape_and_process import tile_tifs
+from patches import export_patches, raster_paths, PatchDataset, _LONGLAT
+
+# Random-sample throughput of a training data loader: the per-file GeoTIFF
+# tiles of tile_tifs() against the memory-mapped store of patches.py, on the
+# same synthetic products. N loader processes each draw random batches; the
+# per-file loader opens and reads one tile per sample, the memmap loader
+# gathers the batch from patches.npy into a reused buffer. Both stores were
+# just written, so this measures the page-cache case (disk speed aside).
+
+
+def make_products(src_dir, count, lines, samples):
+    os.makedirs(src_dir, exist_ok=True)
+    for i in range(count):
+        img = terrain(lines, samples, seed=i)
+        img[:, :samples // 10] = 0  # nodata margin, like CTX strips
+        profile = {"driver": "GTiff", "width": samples, "height": lines, "count": 1, "dtype": "uint8",
+                   "nodata": 0, "crs": CRS.from_proj4(_LONGLAT), "tiled": True,
+                   "transform": from_origin(10.0 + i, 5.0, 1e-4, 1e-4)}
+        with rasterio.open(os.path.join(src_dir, f"P{i:03d}.tif"), "w", **profile) as dst:
+            dst.write(img, 1)
+
+
+def _files_loader(files, batches, batch, seed, size, conn):
+    rng = np.random.default_rng(seed)
+    start = time.perf_counter()
+    n = nbytes = 0
+    for _ in range(batches):
+        for i in rng.integers(0, len(files), batch):
+            with rasterio.open(files[i]) as src:
+                nbytes += src.read(1).nbytes
+            n += 1
+    conn.send((n, nbytes, time.perf_counter() - start))
+
+
+def _memmap_loader(ds, batches, batch, seed, size, conn):
+    rng = np.random.default_rng(seed)
+    out = np.empty((batch, size, size), dtype=ds.patches.dtype)
+    start = time.perf_counter()
+    n = nbytes = 0
+    for _ in range(batches):
+        ds.batch(np.sort(rng.integers(0, len(ds), batch)), out=out)
+        n += batch
+        nbytes += out.nbytes
+    conn.send((n, nbytes, time.perf_counter() - start))
+
+
+def run(loader, source, workers, batches, batch, size):
+    pipes, procs = [], []
+    for w in range(workers):
+        parent, child = mp.Pipe(duplex=False)
+        proc = mp.Process(target=loader, args=(source, batches, batch, w, size, child))
+        proc.start()
+        pipes.append(parent)
+        procs.append(proc)
+    results = [p.recv() for p in pipes]
+    for proc in procs:
+        proc.join()
+    # Slowest loader's own time: process start-up is not part of the read path
+    return sum(r[0] for r in results), sum(r[1] for r in results), max(r[2] for r in results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark random patch reads: per-file tiles vs memmap store")
+    parser.add_argument("-n", "--count", type=int, default=4, help="number of synthetic products")
+    parser.add_argument("--lines", type=int, default=8192)
+    parser.add_argument("--samples", type=int, default=5056)
+    parser.add_argument("--size", type=int, default=256, help="patch / tile size")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 4])
+    parser.add_argument("--batches", type=int, default=20, help="batches per loader process")
+    parser.add_argument("--batch", type=int, default=64)
+    parser.add_argument("--work-dir", help="keep the generated data here instead of a temp dir")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        work = args.work_dir or tmp
+        src_dir = os.path.join(work, "products")
+        if not os.path.isdir(src_dir):
+            make_products(src_dir, args.count, args.lines, args.samples)
+
+        t = time.perf_counter()
+        tile_tifs(src_dir, os.path.join(work, "tif_tiles"), args.size)
+        tiles_s = time.perf_counter() - t
+        t = time.perf_counter()
+        export_patches(raster_paths(src_dir), os.path.join(work, "patches"), args.size, min_valid=1e-9)
+        export_s = time.perf_counter() - t
+        print(f"tile_tifs {tiles_s:.1f}s, export_patches {export_s:.1f}s")
+
+        files = raster_paths(os.path.join(work, "tif_tiles"))
+        ds = PatchDataset(os.path.join(work, "patches"))
+        for name, loader, source in (("per-file tiles", _files_loader, files), ("memmap store", _memmap_loader, ds)):
+            for n in args.workers:
+                samples, nbytes, elapsed = run(loader, source, n, args.batches, args.batch, args.size)
+                print(f"{name:15s} {n:3d} workers: {samples / elapsed:9.0f} samples/s  "
+                      f"{nbytes / 1e6 / elapsed:8.1f} MB/s")
@@ -0,0 +1,103 @@
+import os
+import time
+import tempfile
+import argparse
+import numpy as np
+from pds_label import read_label
+
+# Benchmark pds_label.read_label against pvl.load.
+# Uses the .IMG files in a directory if given, otherwise writes synthetic CTX-style products.
+
+LABEL_TEMPLATE = """PDS_VERSION_ID                = PDS3
+FILE_NAME                     = "{name}.IMG"
+RECORD_TYPE                   = FIXED_LENGTH
+RECORD_BYTES                  = {record_bytes}
+FILE_RECORDS                  = {file_records}
+LABEL_RECORDS                 = 1
+^IMAGE                        = 2
+SPACECRAFT_NAME               = MARS_RECONNAISSANCE_ORBITER
+INSTRUMENT_NAME               = "CONTEXT CAMERA"
+PRODUCT_ID                    = "{name}"
+START_TIME                    = 2006-11-23T06:41:35.588
+STOP_TIME                     = 2006-11-23T06:41:49.045
+TARGET_NAME                   = MARS
+MISSION_PHASE_NAME            = "PRIMARY SCIENCE PHASE"
+LINE_EXPOSURE_DURATION        = 1.877 <MSEC>
+FOCAL_PLANE_TEMPERATURE       = 294.2 <K>
+OBJECT                        = IMAGE
+  LINES                       = {lines}
+  LINE_SAMPLES                = {record_bytes}
+  LINE_PREFIX_BYTES           = 0
+  LINE_SUFFIX_BYTES           = 0
+  SAMPLE_TYPE                 = UNSIGNED_INTEGER
+  SAMPLE_BITS                 = 8
+  SAMPLE_BIT_MASK             = 2#11111111#
+END_OBJECT                    = IMAGE
+END
+"""
+
+
+def terrain(lines, samples, seed=0):
+    """Smooth-ish synthetic 8-bit terrain so compression ratios are meaningful."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.random((lines // 64 + 2, samples // 64 + 2)).astype(np.float32)
+    rows = np.linspace(0, coarse.shape[0] - 1.001, lines)
+    cols = np.linspace(0, coarse.shape[1] - 1.001, samples)
+    r0, c0 = rows.astype(int), cols.astype(int)
+    fr, fc = (rows - r0)[:, None], (cols - c0)[None, :]
+    img = (coarse[r0][:, c0] * (1 - fr) * (1 - fc) + coarse[r0 + 1][:, c0] * fr * (1 - fc) +
+           coarse[r0][:, c0 + 1] * (1 - fr) * fc + coarse[r0 + 1][:, c0 + 1] * fr * fc)
+    img = img * 200 + rng.normal(0, 6, (lines, samples))
+    return np.clip(img, 0, 255).astype(np.uint8)
+
+
+def write_synthetic(out_dir, count, lines=64, record_bytes=5056, pixels=None):
+    """Write `count` 8-bit CTX-style products. pixels(i) may return a (lines, record_bytes) uint8 array."""
+    paths = []
+    for i in range(count):
+        name = f"B{i:05d}_000000_0000_XI_00N000W"
+        label = LABEL_TEMPLATE.format(name=name, record_bytes=record_bytes,
+                                      file_records=lines + 1, lines=lines)
+        path = os.path.join(out_dir, name + ".IMG")
+        with open(path, "wb") as f:
+            f.write(label.encode().ljust(record_bytes, b" "))
+            f.write(pixels(i).tobytes() if pixels else bytes(record_bytes * lines))
+        paths.append(path)
+    return paths
+
+
+def bench(fn, paths):
+    start = time.perf_counter()
+    for p in paths:
+        fn(p)
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare pds_label against pvl")
+    parser.add_argument("img_dir", nargs="?", help="directory of .IMG files (default: synthetic)")
+    parser.add_argument("-n", "--count", type=int, default=2000)
+    args = parser.parse_args()
+
+    tmp = None
+    if args.img_dir:
+        paths = [os.path.join(args.img_dir, f) for f in sorted(os.listdir(args.img_dir))
+                 if f.upper().endswith(".IMG")][:args.count]
+    else:
+        tmp = tempfile.TemporaryDirectory()
+        paths = write_synthetic(tmp.name, args.count)
+
+    results = {"pds_label": bench(read_label, paths)}
+    try:
+        import pvl
+        results["pvl"] = bench(pvl.load, paths)
+    except ImportError:
+        print("pvl not installed, skipping it")
+
+    for name, secs in results.items():
+        print(f"{name:10s} {len(paths)} labels in {secs:.2f}s "
+              f"({len(paths) / secs:.0f} labels/s, {secs / len(paths) * 1e6:.0f} us/label)")
+    if "pvl" in results:
+        print(f"speedup: {results['pvl'] / results['pds_label']:.1f}x")
+    if tmp:
+        tmp.cleanup()
@@ -0,0 +1,206 @@
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import platform
+import tempfile
+import argparse
+import subprocess
+import multiprocessing as mp
+import numpy as np
+from bench_pds_label import write_synthetic, terrain
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# End-to-end benchmark of the ingest hot paths on synthetic CTX-style products:
+# label extraction, .IMG → GeoTIFF conversion, pyramid tiling, tile_tifs and the
+# mosaic. Each step runs in a fresh process so its peak RSS is its own, and the
+# results (seconds, MB/s, tiles/s, peak RSS) are written as JSON so runs from
+# different commits can be compared with --compare.
+
+STEPS = ["labels", "convert", "tiles", "tile_tifs", "mosaic"]
+NEEDS_TIFS = {"tiles", "tile_tifs", "mosaic"}
+
+
+def dir_bytes(path, exts=None):
+    total = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            if exts is None or f.lower().endswith(exts):
+                total += os.path.getsize(os.path.join(root, f))
+    return total
+
+
+def count_tiles(path):
+    count = 0
+    for root, _, files in os.walk(path):
+        for f in files:
+            if f.endswith(".mbtiles"):
+                conn = sqlite3.connect(os.path.join(root, f))
+                count += conn.execute("SELECT COUNT(*) FROM map").fetchone()[0]
+                conn.close()
+            elif f.endswith((".jpg", ".png", ".tif")):
+                count += 1
+    return count
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process and its finished children, in MB (None on Windows)."""
+    if resource is None:
+        return None
+    peak = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss)
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+# ----------------------------
+# Steps (run in a child process; heavy imports happen there)
+# ----------------------------
+def step_labels(d, cfg):
+    from labels import extract_lbl_from_img
+    extract_lbl_from_img(d["raw"], d["metadata"])
+    return {"input_bytes": dir_bytes(d["raw"], (".img",)), "files": cfg["count"]}
+
+
+def step_convert(d, cfg):
+    from tif_convert import convert_img_to_tif
+    out = convert_img_to_tif(d["raw"], d["processed"], mode=cfg["tif_mode"], workers=cfg["workers"])
+    return {"input_bytes": dir_bytes(d["raw"], (".img",)), "files": len(out),
+            "output_bytes": dir_bytes(d["processed"], (".tif",))}
+
+
+def step_tiles(d, cfg):
+    from pyramid_tiles import create_opencv_tiles
+    create_opencv_tiles(d["processed"], d["web_tiles"], cfg["tile_size"], cfg["workers"], None, cfg["tile_format"])
+    return {"input_bytes": dir_bytes(d["processed"], (".tif",)), "tiles": count_tiles(d["web_tiles"]),
+            "output_bytes": dir_bytes(d["web_tiles"])}
+
+
+def step_tile_tifs(d, cfg):
+    from scrape_and_process import tile_tifs
+    tile_tifs(d["processed"], d["tif_tiles"], 512)
+    return {"input_bytes": dir_bytes(d["processed"], (".tif",)), "tiles": count_tiles(d["tif_tiles"]),
+            "output_bytes": dir_bytes(d["tif_tiles"])}
+
+
+def step_mosaic(d, cfg):
+    from mosaic import footprints_for, mosaic_to_file
+    paths = sorted(os.path.join(d["processed"], f) for f in os.listdir(d["processed"]) if f.endswith(".tif"))
+    footprints, crs = footprints_for(paths, layout="auto")
+    out = os.path.join(d["merged"], "basemap.tif")
+    mosaic_to_file(footprints, out, crs=crs)
+    return {"input_bytes": dir_bytes(d["processed"], (".tif",)), "output_bytes": os.path.getsize(out)}
+
+
+def _child(step, dirs, cfg, conn):
+    try:
+        start = time.perf_counter()
+        result = globals()["step_" + step](dirs, cfg)
+        result["seconds"] = time.perf_counter() - start
+        result["peak_rss_mb"] = peak_rss_mb()
+        conn.send(result)
+    except Exception as e:
+        conn.send({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        conn.close()
+
+
+def run_step(step, dirs, cfg):
+    parent, child = mp.Pipe(duplex=False)
+    proc = mp.Process(target=_child, args=(step, dirs, cfg, child))
+    proc.start()
+    child.close()
+    try:
+        result = parent.recv()
+    except EOFError:
+        result = {"error": f"process exited with code {proc.exitcode}"}
+    proc.join()
+    if "seconds" in result:
+        secs = max(result["seconds"], 1e-9)
+        result["mb_per_s"] = result["input_bytes"] / 1e6 / secs
+        if "tiles" in result:
+            result["tiles_per_s"] = result["tiles"] / secs
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def compare(current, baseline):
+    print(f"\n{'step':10s} {'baseline s':>11s} {'now s':>9s} {'change':>8s}")
+    for step, res in current["results"].items():
+        old = baseline.get("results", {}).get(step, {})
+        if "seconds" in res and "seconds" in old:
+            change = (res["seconds"] / old["seconds"] - 1) * 100
+            print(f"{step:10s} {old['seconds']:11.2f} {res['seconds']:9.2f} {change:+7.1f}%")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark label/convert/tile/mosaic on synthetic products")
+    parser.add_argument("-n", "--count", type=int, default=8, help="number of synthetic products")
+    parser.add_argument("--lines", type=int, default=8192)
+    parser.add_argument("--samples", type=int, default=5056)
+    parser.add_argument("--steps", nargs="+", choices=STEPS, default=STEPS)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--tile-size", type=int, default=256)
+    parser.add_argument("--tile-format", choices=["mbtiles", "files"], default="mbtiles")
+    parser.add_argument("--tif-mode", choices=["cog", "gtiff"], default="cog")
+    parser.add_argument("--work-dir", help="keep the generated data here instead of a temp dir")
+    parser.add_argument("-o", "--out", default="bench_pipeline.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare against")
+    args = parser.parse_args()
+
+    cfg = {"count": args.count, "lines": args.lines, "samples": args.samples, "workers": args.workers,
+           "tile_size": args.tile_size, "tile_format": args.tile_format, "tif_mode": args.tif_mode}
+    work = args.work_dir or tempfile.mkdtemp(prefix="bench_pipeline_")
+    dirs = {k: os.path.join(work, k) for k in ("raw", "processed", "metadata", "web_tiles", "tif_tiles", "merged")}
+    for d in dirs.values():
+        os.makedirs(d, exist_ok=True)
+
+    start = time.perf_counter()
+    write_synthetic(dirs["raw"], args.count, args.lines, args.samples,
+                    pixels=lambda i: np.maximum(terrain(args.lines, args.samples, seed=i), 1))  # 0 = CTX fill
+    print(f"Generated {args.count} products of {args.samples}x{args.lines} "
+          f"({dir_bytes(dirs['raw']) / 1e6:.0f} MB) in {time.perf_counter() - start:.1f}s")
+
+    report = {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+              "python": platform.python_version(), "platform": platform.platform(),
+              "cpus": os.cpu_count(), "config": cfg, "results": {}}
+    try:
+        for step in STEPS:
+            if step == "convert" and step not in args.steps and NEEDS_TIFS & set(args.steps):
+                print("Converting inputs for the later steps (not timed)...")
+                run_step(step, dirs, cfg)
+            if step not in args.steps:
+                continue
+            res = run_step(step, dirs, cfg)
+            report["results"][step] = res
+            if "error" in res:
+                print(f"{step:10s} failed: {res['error']}")
+                continue
+            line = f"{step:10s} {res['seconds']:7.2f}s {res['mb_per_s']:8.1f} MB/s"
+            if "tiles_per_s" in res:
+                line += f" {res['tiles_per_s']:8.0f} tiles/s"
+            if res["peak_rss_mb"] is not None:
+                line += f"  peak RSS {res['peak_rss_mb']:.0f} MB"
+            print(line)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work, ignore_errors=True)
+
+    with open(args.out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Results written to {args.out}")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report, json.load(f))
@@ -0,0 +1,61 @@
+import os
+import time
+import tempfile
+import argparse
+from jobqueue import JobQueue, run_workers, print_status
+
+# Throughput of the job queue with N local worker processes. Every product goes
+# through two simulated stages (sleep = download/convert-like I/O wait); every
+# --bad-every'th product raises in its second stage and must end up dead-lettered
+# after --attempts tries, without holding up the rest.
+
+CHAIN = ["fetch", "work"]
+
+
+def sim_fetch(payload, cfg, state):
+    time.sleep(cfg["seconds"])
+    return payload
+
+
+def sim_work(payload, cfg, state):
+    time.sleep(cfg["seconds"])
+    if payload["bad"]:
+        raise ValueError("corrupt product")
+    return payload
+
+
+HANDLERS = {"fetch": sim_fetch, "work": sim_work}
+
+
+def run(processes, jobs, seconds, bad_every, attempts, work_dir):
+    db = os.path.join(work_dir, f"queue_{processes}.sqlite")
+    if os.path.exists(db):
+        os.remove(db)
+    queue = JobQueue(db, lease_seconds=30, max_attempts=attempts, backoff_base=0.05)
+    queue.enqueue_many([(f"P{i:05d}", {"bad": bool(bad_every) and i % bad_every == 0}) for i in range(jobs)],
+                       "fetch")
+    start = time.perf_counter()
+    done = run_workers(queue, {"seconds": seconds}, processes, HANDLERS, chain=CHAIN)
+    elapsed = time.perf_counter() - start
+    return done, elapsed, queue
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark lease-based job queue scaling")
+    parser.add_argument("-n", "--jobs", type=int, default=200, help="products (each has 2 stages)")
+    parser.add_argument("--seconds", type=float, default=0.02, help="simulated time per stage")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--bad-every", type=int, default=50, help="every Nth product always fails (0 = none)")
+    parser.add_argument("--attempts", type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work:
+        base = None
+        for n in args.workers:
+            done, elapsed, queue = run(n, args.jobs, args.seconds, args.bad_every, args.attempts, work)
+            rate = done / elapsed
+            base = base or rate / n
+            dead = len(queue.dead_letters())
+            print(f"{n:3d} workers: {done} stages in {elapsed:6.2f}s  {rate:7.1f} stages/s  "
+                  f"scaling {rate / base / n:5.0%}  dead-lettered {dead}")
+        print_status(queue)
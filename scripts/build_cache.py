@@ -0,0 +1,118 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from metrics import METRICS
+
+# ----------------------------
+# Incremental build manifest
+# ----------------------------
+# One row per (stage, input file). A stage output is up to date when the input's
+# size/mtime and the stage parameters match what was recorded and every output
+# still exists. If only the mtime moved (copy, touch, re-download), the content
+# hash decides, so unchanged bytes are never rebuilt.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS builds (
+    stage TEXT NOT NULL,
+    input TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    digest TEXT,
+    params TEXT NOT NULL,
+    outputs TEXT NOT NULL,
+    built_at REAL NOT NULL,
+    PRIMARY KEY (stage, input)
+)
+"""
+
+
+def file_digest(path, chunk_size=1024 * 1024):
+    h = hashlib.blake2b(digest_size=20)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def default_cache_path(processed_dir):
+    """Manifest location used by the scripts: next to PROCESSED_DIR."""
+    processed_dir = os.path.normpath(processed_dir)
+    return os.path.join(os.path.dirname(processed_dir), os.path.basename(processed_dir) + "_build.sqlite")
+
+
+class BuildCache:
+    """SQLite manifest shared by threads and worker processes (each opens its own connection)."""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn().execute(SCHEMA)
+
+    def __getstate__(self):
+        return {"db_path": self.db_path}
+
+    def __setstate__(self, state):
+        self.__init__(state["db_path"])
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _params(params):
+        return json.dumps(params or {}, sort_keys=True, default=str)
+
+    def is_fresh(self, stage, input_path, params=None, outputs=()):
+        """True if `stage` already built `outputs` from this exact input with these params."""
+        input_path = os.path.abspath(input_path)
+        row = self._conn().execute(
+            "SELECT size, mtime_ns, digest, params, outputs FROM builds WHERE stage=? AND input=?",
+            (stage, input_path)).fetchone()
+        fresh = False
+        if row is not None and os.path.exists(input_path):
+            size, mtime_ns, digest, stored_params, stored_outputs = row
+            outputs = list(outputs) or json.loads(stored_outputs)
+            st = os.stat(input_path)
+            if (stored_params == self._params(params)
+                    and all(os.path.exists(p) for p in outputs)
+                    and st.st_size == size):
+                if st.st_mtime_ns == mtime_ns:
+                    fresh = True
+                elif digest and file_digest(input_path) == digest:
+                    self._conn().execute("UPDATE builds SET mtime_ns=? WHERE stage=? AND input=?",
+                                         (st.st_mtime_ns, stage, input_path))
+                    fresh = True
+        if fresh:
+            self.hits += 1
+        else:
+            self.misses += 1
+        METRICS.inc("cache_lookups_total", stage=stage, result="hit" if fresh else "miss")
+        return fresh
+
+    def record(self, stage, input_path, params=None, outputs=(), digest=True):
+        """Mark `outputs` as built from `input_path`. digest=False skips content hashing."""
+        input_path = os.path.abspath(input_path)
+        st = os.stat(input_path)
+        self._conn().execute(
+            "INSERT OR REPLACE INTO builds VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (stage, input_path, st.st_size, st.st_mtime_ns,
+             file_digest(input_path) if digest else None,
+             self._params(params), json.dumps([os.path.abspath(p) for p in outputs]), time.time()))
+
+    def invalidate(self, stage, input_path):
+        self._conn().execute("DELETE FROM builds WHERE stage=? AND input=?",
+                             (stage, os.path.abspath(input_path)))
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses}
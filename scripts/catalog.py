@@ -0,0 +1,338 @@
+import os
+import re
+import json
+import math
+import sqlite3
+import argparse
+from pds_label import read_label, find_key, value_of, to_jsonable
+
+# ----------------------------
+# Spatial footprint catalog
+# ----------------------------
+# Footprints, center lat/lon, resolution and times extracted from PDS labels go
+# into SQLite: a products table plus an R*Tree over (lon, lat) bounding boxes,
+# so "which products cover this box / time range" is an index lookup.
+# Longitudes are stored east-positive in [0, 360). A footprint (or a query box)
+# that crosses 0/360 is split into two boxes, [lon, 360] and [0, lon]; box ids
+# are 2 * product id + part.
+
+MARS_RADIUS_M = 3396190.0
+CTX_RESOLUTION_M = 6.0  # nominal CTX pixel scale, used when a label carries none
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    id INTEGER PRIMARY KEY,
+    product_id TEXT UNIQUE NOT NULL,
+    file_name TEXT,
+    path TEXT,
+    tif_path TEXT,
+    center_lat REAL,
+    center_lon REAL,
+    resolution REAL,
+    start_time TEXT,
+    stop_time TEXT,
+    footprint_source TEXT,
+    corners TEXT,
+    meta TEXT
+);
+CREATE INDEX IF NOT EXISTS products_start ON products(start_time);
+CREATE VIRTUAL TABLE IF NOT EXISTS footprint_boxes USING rtree(id, min_lon, max_lon, min_lat, max_lat);
+"""
+
+_CTX_NAME = re.compile(r"_(\d{2})([NS])(\d{3})([EW])$")
+_CORNERS = ["UPPER_LEFT", "UPPER_RIGHT", "LOWER_RIGHT", "LOWER_LEFT"]
+
+
+def east_lon(lon):
+    return lon % 360.0
+
+
+def lon_ranges(lons):
+    """
+    East-positive [(min_lon, max_lon)] covering `lons` (corner longitudes of one footprint):
+    one range, or two when the footprint crosses 0/360.
+    """
+    first = lons[0]
+    unwrapped = [first + ((lon - first + 180.0) % 360.0 - 180.0) for lon in lons]
+    lo, hi = min(unwrapped), max(unwrapped)
+    if hi - lo >= 360.0:
+        return [(0.0, 360.0)]
+    shift = math.floor(lo / 360.0) * 360.0
+    lo, hi = lo - shift, hi - shift
+    if hi <= 360.0:
+        return [(lo, hi)]
+    return [(lo, 360.0), (0.0, hi - 360.0)]
+
+
+def _num(label, *keys):
+    for key in keys:
+        v = find_key(label, key)
+        if v is not None:
+            v = value_of(v)
+            if isinstance(v, (int, float)):
+                return float(v)
+    return None
+
+
+def _box_around(lat, lon, lines, samples, resolution):
+    """Approximate lat/lon corners of a lines x samples strip centred on (lat, lon)."""
+    deg_per_m = 180.0 / (math.pi * MARS_RADIUS_M)
+    half_h = lines * resolution * deg_per_m / 2
+    half_w = samples * resolution * deg_per_m / 2 / max(math.cos(math.radians(lat)), 0.01)
+    return [(lat + half_h, lon - half_w), (lat + half_h, lon + half_w),
+            (lat - half_h, lon + half_w), (lat - half_h, lon - half_w)]
+
+
+def footprint_from_label(label, file_name=None):
+    """
+    Best available footprint for a label. Tries, in order: explicit corner coordinates,
+    map-projection bounds, center lat/lon, and finally the lat/lon encoded in the CTX
+    product name (e.g. ..._44S280W). Returns a dict or None.
+    """
+    lines = _num(label, "LINES") or 0
+    samples = _num(label, "LINE_SAMPLES") or 0
+    resolution = _num(label, "MAP_RESOLUTION_METERS", "MAP_SCALE", "SCALED_PIXEL_WIDTH",
+                      "PIXEL_WIDTH") or CTX_RESOLUTION_M
+    if resolution < 1:  # km/pixel
+        resolution *= 1000.0
+
+    corners = []
+    for c in _CORNERS:
+        lat, lon = _num(label, f"{c}_LATITUDE"), _num(label, f"{c}_LONGITUDE")
+        if lat is not None and lon is not None:
+            corners.append((lat, lon))
+    source = "corners" if len(corners) == 4 else None
+
+    if source is None:
+        north, south = _num(label, "MAXIMUM_LATITUDE"), _num(label, "MINIMUM_LATITUDE")
+        east, west = _num(label, "EASTERNMOST_LONGITUDE"), _num(label, "WESTERNMOST_LONGITUDE")
+        if None not in (north, south, east, west):
+            corners = [(north, west), (north, east), (south, east), (south, west)]
+            source = "map_projection"
+
+    center_lat = _num(label, "CENTER_LATITUDE", "IMAGE_CENTER_LATITUDE")
+    center_lon = _num(label, "CENTER_LONGITUDE", "IMAGE_CENTER_LONGITUDE")
+    if source is None and center_lat is not None and center_lon is not None:
+        corners = _box_around(center_lat, center_lon, lines, samples, resolution)
+        source = "center"
+
+    if source is None:
+        name = os.path.splitext(file_name or str(find_key(label, "PRODUCT_ID") or ""))[0]
+        m = _CTX_NAME.search(name)
+        if not m:
+            return None
+        lat = int(m.group(1)) * (1 if m.group(2) == "N" else -1)
+        lon = int(m.group(3)) * (1 if m.group(4) == "E" else -1)
+        # The name is rounded to whole degrees; pad the box by half a degree
+        corners = _box_around(lat, lon, lines, samples, resolution)
+        corners = [(a + (0.5 if a > lat else -0.5), b + (0.5 if b > lon else -0.5)) for a, b in corners]
+        center_lat, center_lon = lat, lon
+        source = "product_name"
+
+    if center_lat is None:
+        center_lat = sum(c[0] for c in corners) / 4
+        center_lon = sum(c[1] for c in corners) / 4
+    corners = [(lat, east_lon(lon)) for lat, lon in corners]
+    return {
+        "center_lat": center_lat,
+        "center_lon": east_lon(center_lon),
+        "resolution": resolution,
+        "corners": corners,
+        "source": source,
+    }
+
+
+class Catalog:
+    def __init__(self, db_path):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        self.conn.executescript(SCHEMA)
+        if self.conn.execute("SELECT 1 FROM sqlite_master WHERE name='footprints'").fetchone():
+            self._migrate()
+
+    def _migrate(self):
+        """Rebuild the boxes of a catalog written before footprints were split at 0/360."""
+        with self.conn:
+            for pid, corners in self.conn.execute("SELECT id, corners FROM products").fetchall():
+                self._add_boxes(pid, json.loads(corners))
+            self.conn.execute("DROP TABLE footprints")
+
+    def _add_boxes(self, pid, corners):
+        lats = [c[0] for c in corners]
+        self.conn.execute("DELETE FROM footprint_boxes WHERE id IN (?, ?)", (2 * pid, 2 * pid + 1))
+        for part, (lo, hi) in enumerate(lon_ranges([c[1] for c in corners])):
+            self.conn.execute("INSERT INTO footprint_boxes VALUES (?, ?, ?, ?, ?)",
+                              (2 * pid + part, lo, hi, min(lats), max(lats)))
+
+    def close(self):
+        self.conn.close()
+
+    def add(self, product_id, footprint, file_name=None, path=None, tif_path=None,
+            start_time=None, stop_time=None, meta=None):
+        row = self.conn.execute("SELECT id FROM products WHERE product_id=?", (product_id,)).fetchone()
+        values = (product_id, file_name, path, tif_path, footprint["center_lat"], footprint["center_lon"],
+                  footprint["resolution"], start_time, stop_time, footprint["source"],
+                  json.dumps(footprint["corners"]), json.dumps(meta or {}))
+        if row:
+            pid = row[0]
+            self.conn.execute("""UPDATE products SET product_id=?, file_name=?, path=?, tif_path=?,
+                center_lat=?, center_lon=?, resolution=?, start_time=?, stop_time=?,
+                footprint_source=?, corners=?, meta=? WHERE id=?""", values + (pid,))
+        else:
+            pid = self.conn.execute("""INSERT INTO products (product_id, file_name, path, tif_path,
+                center_lat, center_lon, resolution, start_time, stop_time, footprint_source, corners, meta)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""", values).lastrowid
+        self._add_boxes(pid, footprint["corners"])
+        return pid
+
+    def add_label(self, label_path, tif_path=None):
+        label = read_label(label_path)
+        file_name = os.path.basename(label_path)
+        fp = footprint_from_label(label, file_name)
+        if fp is None:
+            return None
+        product_id = str(find_key(label, "PRODUCT_ID") or os.path.splitext(file_name)[0])
+        meta = {k: to_jsonable(find_key(label, k)) for k in
+                ("LINES", "LINE_SAMPLES", "SAMPLE_TYPE", "SAMPLE_BITS", "MISSION_PHASE_NAME", "TARGET_NAME")}
+        return self.add(product_id, fp, file_name, os.path.abspath(label_path),
+                        os.path.abspath(tif_path) if tif_path else None,
+                        _time(find_key(label, "START_TIME")), _time(find_key(label, "STOP_TIME")), meta)
+
+    def add_metadata(self, json_path, tif_path=None):
+        """Index a label JSON from labels.py (its FOOTPRINT), for products whose raw file is gone."""
+        with open(json_path) as f:
+            data = json.load(f)
+        fp = data.get("FOOTPRINT")
+        if not fp:
+            return None
+        file_name = data.get("FILE_NAME") or os.path.basename(json_path)
+        meta = {k: data.get(k) for k in
+                ("LINES", "LINE_SAMPLES", "SAMPLE_TYPE", "SAMPLE_BITS", "MISSION_PHASE_NAME", "TARGET_NAME")}
+        return self.add(str(data.get("PRODUCT_ID") or os.path.splitext(file_name)[0]), fp, file_name, None,
+                        os.path.abspath(tif_path) if tif_path else None,
+                        _time(data.get("START_TIME")), _time(data.get("STOP_TIME")), meta)
+
+    def query(self, bbox=None, start=None, end=None, limit=None):
+        """
+        Products whose footprint intersects bbox=(min_lon, min_lat, max_lon, max_lat)
+        (east-positive degrees) and whose time span overlaps [start, end] (ISO strings).
+        """
+        sql = "SELECT p.* FROM products p"
+        where, args = [], []
+        if bbox is not None:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            if max_lon - min_lon >= 360:
+                ranges = [(0.0, 360.0)]
+            else:
+                lo, hi = east_lon(min_lon), east_lon(max_lon)
+                ranges = [(lo, hi if hi > lo or max_lon == min_lon else hi + 360.0)]
+                if ranges[0][1] > 360.0:
+                    ranges = [(lo, 360.0), (0.0, hi)]  # box crosses 0/360
+            lon_sql = " OR ".join("(b.max_lon >= ? AND b.min_lon <= ?)" for _ in ranges)
+            sql += (" WHERE p.id IN (SELECT b.id / 2 FROM footprint_boxes b"
+                    f" WHERE ({lon_sql}) AND b.max_lat >= ? AND b.min_lat <= ?)")
+            args += [v for r in ranges for v in r] + [min_lat, max_lat]
+        if start is not None:
+            where.append("COALESCE(p.stop_time, p.start_time) >= ?")
+            args.append(start)
+        if end is not None:
+            where.append("p.start_time <= ?")
+            args.append(end)
+        if where:
+            sql += (" AND " if bbox is not None else " WHERE ") + " AND ".join(where)
+        sql += " ORDER BY p.start_time, p.id"
+        if limit:
+            sql += f" LIMIT {int(limit)}"
+        cur = self.conn.execute(sql, args)
+        cols = [d[0] for d in cur.description]
+        rows = []
+        for r in cur:
+            row = dict(zip(cols, r))
+            row["corners"] = json.loads(row["corners"])
+            row["meta"] = json.loads(row["meta"])
+            rows.append(row)
+        return rows
+
+    def __len__(self):
+        return self.conn.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+
+def _time(v):
+    return str(v) if v is not None else None
+
+
+def build_catalog(raw_dir, db_path, processed_dir=None, metadata_dir=None):
+    """
+    Add every .IMG / .LBL label in raw_dir to the catalog, and every label JSON in metadata_dir
+    whose raw file is not there (deleted after conversion). Returns the number indexed.
+    """
+    catalog = Catalog(db_path)
+    count = 0
+    names = sorted(os.listdir(raw_dir)) if raw_dir and os.path.isdir(raw_dir) else []
+    imgs = {os.path.splitext(n)[0].upper() for n in names if n.upper().endswith(".IMG")}
+    with catalog.conn:
+        for fname in names:
+            stem, ext = os.path.splitext(fname)
+            if ext.upper() not in (".IMG", ".LBL"):
+                continue
+            if ext.upper() == ".LBL" and stem.upper() in imgs:
+                continue  # attached label already covers it
+            tif_path = None
+            if processed_dir:
+                candidate = os.path.join(processed_dir, stem + ".tif")
+                tif_path = candidate if os.path.exists(candidate) else None
+            try:
+                if catalog.add_label(os.path.join(raw_dir, fname), tif_path) is not None:
+                    count += 1
+                else:
+                    print(f"No footprint for {fname}")
+            except Exception as e:
+                print(f"Failed to index {fname}: {e}")
+        stems = {os.path.splitext(n)[0].upper() for n in names}
+        meta_names = sorted(os.listdir(metadata_dir)) if metadata_dir and os.path.isdir(metadata_dir) else []
+        for fname in meta_names:
+            stem, ext = os.path.splitext(fname)
+            if ext != ".json" or stem.upper() in stems or fname == "combined_metadata.json":
+                continue
+            tif_path = os.path.join(processed_dir, stem + ".tif") if processed_dir else None
+            try:
+                if catalog.add_metadata(os.path.join(metadata_dir, fname),
+                                        tif_path if tif_path and os.path.exists(tif_path) else None) is not None:
+                    count += 1
+            except Exception as e:
+                print(f"Failed to index {fname}: {e}")
+    catalog.close()
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CTX footprint catalog")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("build", help="index the labels in a raw directory")
+    b.add_argument("raw_dir")
+    b.add_argument("--db", required=True)
+    b.add_argument("--processed-dir")
+    b.add_argument("--metadata-dir", help="label JSON of products whose raw files were deleted")
+    q = sub.add_parser("query", help="find products by lon/lat box and time range")
+    q.add_argument("--db", required=True)
+    q.add_argument("--bbox", nargs=4, type=float, metavar=("MIN_LON", "MIN_LAT", "MAX_LON", "MAX_LAT"))
+    q.add_argument("--start")
+    q.add_argument("--end")
+    q.add_argument("--limit", type=int)
+    q.add_argument("--json", action="store_true", help="print full rows as JSON")
+    args = parser.parse_args()
+
+    if args.cmd == "build":
+        n = build_catalog(args.raw_dir, args.db, args.processed_dir, args.metadata_dir)
+        print(f"✅ Indexed {n} products into {args.db}")
+    else:
+        catalog = Catalog(args.db)
+        rows = catalog.query(tuple(args.bbox) if args.bbox else None, args.start, args.end, args.limit)
+        if args.json:
+            print(json.dumps(rows, indent=2))
+        else:
+            for r in rows:
+                print(f"{r['product_id']}  lat {r['center_lat']:.3f}  lon {r['center_lon']:.3f}  "
+                      f"{r['start_time']}  {r['tif_path'] or r['path']}")
+            print(f"{len(rows)} products")
@@ -1,8 +1,15 @@
 import os
-import rasterio
+import argparse
 import matplotlib.pyplot as plt
+from config import load_config
+from preview import preview_array, to_8bit
 
-processed_dir = r"C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/raw/ctx/mrox_4099"
+parser = argparse.ArgumentParser(description="Show a decimated view of the first .tif in a folder")
+parser.add_argument("folder", nargs="?", help="default: processed_dir")
+parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+args = parser.parse_args()
+
+processed_dir = args.folder or load_config(args.config)["processed_dir"]
 
 # Get list of .tif files
 tif_files = [f for f in os.listdir(processed_dir) if f.lower().endswith(".tif")]
@@ -14,10 +21,10 @@ if not tif_files:
 # Use the first available file
 tif_path = os.path.join(processed_dir, tif_files[0])
 
-with rasterio.open(tif_path) as src:
-    img = src.read(1)
-    plt.figure(figsize=(10, 10))
-    plt.imshow(img, cmap='gray')
-    plt.title(f"Preview: {tif_files[0]}")
-    plt.axis('off')
-    plt.show()
+# Screen-sized decimated read instead of the full band
+img, nodata = preview_array(tif_path, max_size=1500)
+plt.figure(figsize=(10, 10))
+plt.imshow(to_8bit(tif_path, img, nodata), cmap='gray')
+plt.title(f"Preview: {tif_files[0]}")
+plt.axis('off')
+plt.show()
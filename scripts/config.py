@@ -0,0 +1,133 @@
+import os
+import json
+
+# ----------------------------
+# Pipeline configuration
+# ----------------------------
+# Settings are layered: the defaults below, then a JSON file (--config, or the
+# path in CTX_CONFIG, or ./ctx.json if present), then CTX_<KEY> environment
+# variables, e.g. CTX_DATA_DIR=/data/ctx or CTX_TILE_WORKERS=8. Directories left
+# unset are derived from data_dir and volume. The result is a plain dict, so it
+# can be handed to process-pool workers as is; load_config() also exports the
+# file path so workers that call it themselves see the same settings.
+
+ENV_FILE = "CTX_CONFIG"
+ENV_PREFIX = "CTX_"
+DEFAULT_FILE = "ctx.json"
+ROOT_URL = "https://planetarydata.jpl.nasa.gov/img/data/mro/ctx/"
+
+DEFAULTS = {
+    "data_dir": "data",
+    "volume": "mrox_3866",
+    "volume_url": None,  # default: ROOT_URL + volume
+    "raw_dir": None,  # default: <data_dir>/raw/<volume>
+    "processed_dir": None,
+    "metadata_dir": None,
+    "web_tiles_dir": None,
+    "preview_dir": None,
+    "projected_dir": None,  # map-projected products (reproject.py)
+    "merged_path": None,  # default: <data_dir>/merged/<volume>_basemap.tif
+    "basemap_tiles": None,  # default: merged_path with .mbtiles, "" = don't tile the basemap
+    "crawl_db": "",  # catalog from the volume index (crawler.py), e.g. data/metadata/crawl.sqlite; "" = scrape data/
+    "catalog_db": None,  # default: <metadata_dir>/catalog.sqlite, "" = skip
+    "stretch_dir": None,  # cached 8-bit stretch stats (stretch.py), default: <metadata_dir>/stretch
+    "build_cache": True,  # False = always rebuild everything
+    "queue_db": None,  # default: <data_dir>/metadata/queue.sqlite, shared by every worker host
+    "lease_seconds": 300,  # a claimed job returns to the queue this long after its last heartbeat
+    "max_attempts": 5,  # claims before a product/stage is dead-lettered
+    "download_limit": 10,  # 0 = download all
+    "download_delay": 1.0,
+    "download_workers": 4,
+    "md5_manifest": None,  # md5sum-style file of the volume (URL or relative path), None = look for one, "" = off
+    "tif_mode": "gtiff",  # "gtiff" = striped BIGTIFF, "cog" = tiled, compressed, with overviews
+    "tif_compress": "DEFLATE",
+    "convert_workers": 2,
+    "convert_to_tif": True,
+    "keep_raw": True,
+    "reproject": False,  # warp products onto the map grid in the phased workflow (needs label geometry)
+    "map_projection": "auto",  # "auto", "eqc" (equirectangular) or "polar" (stereographic)
+    "map_resolution": 6.0,  # metres per pixel of the shared map grid
+    "tile_size": 256,
+    "tile_format": "files",  # "files" = level_N/{x}_{y}.jpg, "mbtiles" = one packed <product>.mbtiles per product
+    "tile_workers": os.cpu_count(),
+    "preview_size": 1024,
+    "patches_dir": None,  # ML training patches (patches.py), default: <data_dir>/patches/<volume>
+    "patch_size": 256,
+    "patch_stride": 0,  # 0 = patch_size (no overlap)
+    "patch_min_valid": 0.5,  # patches with a smaller fraction of valid pixels are dropped
+    "metrics_file": "",  # one JSON line per stage item (metrics.py), e.g. data/metadata/metrics.jsonl; "" = off
+    "metrics_port": 0,  # 0 = no /metrics endpoint
+    "profile_stages": [],
+}
+
+_DERIVED_DIRS = {"raw_dir": "raw", "processed_dir": "processed", "metadata_dir": "metadata",
+                 "web_tiles_dir": "web_tiles", "preview_dir": "previews", "projected_dir": "projected",
+                 "patches_dir": "patches"}
+
+
+def _coerce(key, text):
+    """Parse an environment value using the type of its default."""
+    default = DEFAULTS.get(key)
+    if isinstance(default, bool):
+        return text.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(text)
+    if isinstance(default, float):
+        return float(text)
+    if isinstance(default, list):
+        return [v.strip() for v in text.split(",") if v.strip()]
+    return text
+
+
+def config_file(path=None):
+    """The config file in use: `path`, then $CTX_CONFIG, then ./ctx.json if it exists."""
+    path = path or os.environ.get(ENV_FILE)
+    if path:
+        return path
+    return DEFAULT_FILE if os.path.exists(DEFAULT_FILE) else None
+
+
+def load_config(path=None, **overrides):
+    """Return the merged settings dict (defaults < file < environment < overrides)."""
+    cfg = dict(DEFAULTS)
+    path = config_file(path)
+    if path:
+        with open(path) as f:
+            data = json.load(f)
+        unknown = set(data) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"{path}: unknown settings {sorted(unknown)}")
+        cfg.update(data)
+        os.environ[ENV_FILE] = os.path.abspath(path)
+    for key in DEFAULTS:
+        value = os.environ.get(ENV_PREFIX + key.upper())
+        if value is not None:
+            cfg[key] = _coerce(key, value)
+    cfg.update({k: v for k, v in overrides.items() if v is not None})
+
+    volume = cfg["volume"]
+    data_dir = cfg["data_dir"]
+    if not cfg["volume_url"]:
+        cfg["volume_url"] = ROOT_URL + volume + "/"
+    for key, sub in _DERIVED_DIRS.items():
+        if not cfg[key]:
+            cfg[key] = os.path.join(data_dir, sub, volume)
+    if not cfg["merged_path"]:
+        cfg["merged_path"] = os.path.join(data_dir, "merged", f"{volume}_basemap.tif")
+    if cfg["basemap_tiles"] is None:
+        cfg["basemap_tiles"] = os.path.splitext(cfg["merged_path"])[0] + ".mbtiles"
+    if cfg["queue_db"] is None:
+        cfg["queue_db"] = os.path.join(data_dir, "metadata", "queue.sqlite")
+    for key, name in (("catalog_db", "catalog.sqlite"), ("stretch_dir", "stretch")):
+        if cfg[key] is None:
+            cfg[key] = os.path.join(cfg["metadata_dir"], name)
+    return cfg
+
+
+def parse_setting(text):
+    """'key=value' from the command line → (key, value), typed like the default."""
+    key, sep, value = text.partition("=")
+    key = key.strip().replace("-", "_")
+    if not sep or key not in DEFAULTS:
+        raise ValueError(f"expected key=value with key in {sorted(DEFAULTS)}, got {text!r}")
+    return key, _coerce(key, value)
@@ -0,0 +1,346 @@
+import os
+import re
+import csv
+import time
+import fnmatch
+import asyncio
+import sqlite3
+import hashlib
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from downloader import make_session, remote_size, TIMEOUT, CHUNK_SIZE
+from pds_label import parse_label, value_of
+from config import ROOT_URL, load_config
+
+# ----------------------------
+# PDS volume crawler
+# ----------------------------
+# Enumerates mrox_* volumes concurrently and builds a local catalog of product
+# URLs and sizes. The volume's PDS index table (INDEX/CUMINDEX.TAB, laid out by
+# its .LBL) is preferred over scraping HTML listings; the cumulative index of the
+# newest volume usually covers every older volume, so one download replaces
+# hundreds of directory pages. Every fetched listing/index is kept on disk with
+# its ETag / Last-Modified and revalidated with a conditional GET next time.
+
+CONFIG = load_config()
+VOLUME_GLOB = "mrox_*"
+CRAWL_DB = CONFIG["crawl_db"] or os.path.join(CONFIG["data_dir"], "metadata", "crawl.sqlite")
+CONCURRENCY = 8
+INDEX_NAMES = ("index/cumindex.tab", "INDEX/CUMINDEX.TAB", "index/index.tab", "INDEX/INDEX.TAB")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS listings (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    body_path TEXT,
+    fetched_at REAL
+);
+CREATE TABLE IF NOT EXISTS products (
+    url TEXT PRIMARY KEY,
+    volume TEXT,
+    product_id TEXT,
+    file_name TEXT,
+    size INTEGER,
+    lines INTEGER,
+    line_samples INTEGER,
+    start_time TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS products_volume ON products(volume);
+"""
+
+_HREF = re.compile(r'href="([^"?#]+)"', re.I)
+_INDEX_FIELDS = {
+    "volume": ("VOLUME_ID",),
+    "file": ("FILE_SPECIFICATION_NAME", "FILE_NAME"),
+    "product_id": ("PRODUCT_ID",),
+    "lines": ("LINES",),
+    "line_samples": ("LINE_SAMPLES",),
+    "start_time": ("START_TIME", "IMAGE_TIME"),
+}
+
+
+def volume_number(name):
+    m = re.search(r"(\d+)", name)
+    return int(m.group(1)) if m else -1
+
+
+def product_url(root_url, volume, file_spec):
+    """
+    URL of a product named in an index. The imaging node serves volume directories
+    in lower case and keeps the upper-case file names.
+    """
+    parts = file_spec.replace("\\", "/").strip("/").split("/")
+    path = "/".join([p.lower() for p in parts[:-1]] + parts[-1:])
+    return f"{root_url.rstrip('/')}/{volume.lower()}/{path}"
+
+
+def index_columns(label_text):
+    """{column name: (start offset, bytes)} of the table described by an index .LBL."""
+    label = parse_label(label_text)
+    for node in label.values():
+        for table in (node if isinstance(node, list) else [node]):
+            if isinstance(table, dict) and "COLUMN" in table:
+                columns = table["COLUMN"] if isinstance(table["COLUMN"], list) else [table["COLUMN"]]
+                return {c["NAME"]: (value_of(c["START_BYTE"]) - 1, value_of(c["BYTES"])) for c in columns}
+    return None
+
+
+def parse_index(tab_path, columns=None):
+    """
+    Yield {volume, file, product_id, lines, line_samples, start_time} per index row.
+    With the label's column layout each field is a fixed-width slice of the line;
+    without it the row is split as CSV and the .IMG path is picked out.
+    """
+    fields = {}
+    for key, names in _INDEX_FIELDS.items():
+        for name in names:
+            if columns and name in columns:
+                fields[key] = columns[name]
+                break
+    with open(tab_path, encoding="latin-1", newline="") as f:
+        if "file" in fields:
+            for line in f:
+                row = {k: line[s:s + n].strip().strip('"').strip() for k, (s, n) in fields.items()}
+                if row["file"]:
+                    yield row
+            return
+        for values in csv.reader(f, skipinitialspace=True):
+            values = [v.strip() for v in values]
+            spec = next((v for v in values if v.upper().endswith(".IMG")), None)
+            if spec:
+                yield {"volume": values[0], "file": spec,
+                       "product_id": os.path.splitext(os.path.basename(spec))[0]}
+
+
+def _volume(row, default):
+    """Lower-cased volume of an index row; tables without a VOLUME_ID column list `default`'s own products."""
+    return (row.get("volume") or default).lower()
+
+
+def _int(v):
+    try:
+        return int(v)
+    except (TypeError, ValueError):
+        return None
+
+
+class Crawler:
+    def __init__(self, db_path=CRAWL_DB, concurrency=CONCURRENCY):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.cache_dir = os.path.splitext(db_path)[0] + "_listings"
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db = sqlite3.connect(db_path)
+        self.db.executescript(SCHEMA)
+        self.session = make_session(pool_size=concurrency)
+        self.pool = ThreadPoolExecutor(max_workers=concurrency)
+        self.concurrency = concurrency
+        self.sem = None
+        self.fetched = 0
+        self.not_modified = 0
+
+    def close(self):
+        self.pool.shutdown()
+        self.session.close()
+        self.db.close()
+
+    def _get(self, url, headers, body_path):
+        """Blocking conditional GET streamed to body_path. Returns the response (body consumed)."""
+        resp = self.session.get(url, headers=headers, timeout=TIMEOUT, stream=True)
+        if resp.status_code == 200:
+            tmp = body_path + ".part"
+            with open(tmp, "wb") as f:
+                for chunk in resp.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+            os.replace(tmp, body_path)
+        resp.close()
+        return resp
+
+    async def fetch(self, url):
+        """Local path of the body of `url` (revalidated with ETag/Last-Modified), or None if missing."""
+        row = self.db.execute("SELECT etag, last_modified, body_path FROM listings WHERE url=?",
+                              (url,)).fetchone()
+        body_path = os.path.join(self.cache_dir, hashlib.blake2b(url.encode(), digest_size=16).hexdigest())
+        headers = {}
+        if row and os.path.exists(row[2]):
+            if row[0]:
+                headers["If-None-Match"] = row[0]
+            if row[1]:
+                headers["If-Modified-Since"] = row[1]
+        loop = asyncio.get_running_loop()
+        async with self.sem:
+            resp = await loop.run_in_executor(self.pool, self._get, url, headers, body_path)
+        if resp.status_code == 304:
+            self.not_modified += 1
+            return row[2]
+        if resp.status_code in (403, 404):
+            return None
+        resp.raise_for_status()
+        self.fetched += 1
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO listings VALUES (?, ?, ?, ?, ?)",
+                            (url, resp.headers.get("ETag"), resp.headers.get("Last-Modified"),
+                             body_path, time.time()))
+        return body_path
+
+    async def fetch_text(self, url):
+        path = await self.fetch(url)
+        if path is None:
+            return None
+        with open(path, encoding="latin-1") as f:
+            return f.read()
+
+    async def list_volumes(self, root_url=ROOT_URL, pattern=VOLUME_GLOB):
+        html = await self.fetch_text(root_url.rstrip("/") + "/")
+        if html is None:
+            raise RuntimeError(f"cannot list {root_url}")
+        names = {h.rstrip("/").rsplit("/", 1)[-1] for h in _HREF.findall(html)}
+        return sorted((n for n in names if fnmatch.fnmatch(n.lower(), pattern.lower())), key=volume_number)
+
+    async def index_rows(self, root_url, volume):
+        """Rows of the first index table found in `volume`, or (None, None)."""
+        base = f"{root_url.rstrip('/')}/{volume}/"
+        for name in INDEX_NAMES:
+            tab = await self.fetch(base + name)
+            if tab is None:
+                continue
+            label = await self.fetch_text(base + name[:-4] + (".lbl" if name.islower() else ".LBL"))
+            columns = index_columns(label) if label else None
+            return base + name, list(parse_index(tab, columns))
+        return None, None
+
+    async def html_rows(self, root_url, volume):
+        data_url = f"{root_url.rstrip('/')}/{volume}/data/"
+        html = await self.fetch_text(data_url)
+        if html is None:
+            return []
+        rows = []
+        for href in _HREF.findall(html):
+            if href.upper().endswith(".IMG"):
+                name = href.rsplit("/", 1)[-1]
+                rows.append({"url": data_url + name, "volume": volume, "file": name,
+                             "product_id": os.path.splitext(name)[0]})
+        return rows
+
+    def store(self, root_url, volume, rows, source):
+        with self.db:
+            for r in rows:
+                url = r.get("url") or product_url(root_url, _volume(r, volume), r["file"])
+                self.db.execute("""INSERT INTO products (url, volume, product_id, file_name, lines, line_samples,
+                        start_time, source) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(url) DO UPDATE SET volume=excluded.volume, product_id=excluded.product_id,
+                        file_name=excluded.file_name, lines=excluded.lines, line_samples=excluded.line_samples,
+                        start_time=excluded.start_time, source=excluded.source""",
+                                (url, _volume(r, volume),
+                                 r.get("product_id") or os.path.splitext(os.path.basename(r["file"]))[0],
+                                 os.path.basename(r["file"]), _int(r.get("lines")), _int(r.get("line_samples")),
+                                 r.get("start_time"), source))
+
+    async def crawl_volume(self, root_url, volume):
+        """Index table first, HTML listing of data/ as a fallback."""
+        index_url, rows = await self.index_rows(root_url, volume)
+        if rows is not None:
+            own = [r for r in rows if _volume(r, volume) == volume.lower()] or rows
+            self.store(root_url, volume, own, "index")
+            return len(own)
+        rows = await self.html_rows(root_url, volume)
+        self.store(root_url, volume, rows, "html")
+        return len(rows)
+
+    async def fill_sizes(self, volumes):
+        """HEAD every product of `volumes` whose size is still unknown."""
+        marks = ",".join("?" * len(volumes))
+        urls = [r[0] for r in self.db.execute(
+            f"SELECT url FROM products WHERE size IS NULL AND volume IN ({marks})", [v.lower() for v in volumes])]
+        loop = asyncio.get_running_loop()
+
+        async def head(url):
+            async with self.sem:
+                return url, await loop.run_in_executor(self.pool, remote_size, self.session, url)
+
+        for i in range(0, len(urls), 1000):
+            results = await asyncio.gather(*(head(u) for u in urls[i:i + 1000]))
+            with self.db:
+                self.db.executemany("UPDATE products SET size=? WHERE url=?",
+                                    [(size, url) for url, size in results if size is not None])
+        return len(urls)
+
+    async def crawl(self, root_url=ROOT_URL, volumes=None, pattern=VOLUME_GLOB, sizes=True):
+        """Catalog `volumes` (names under root_url; all matching `pattern` if None). Returns the volume names."""
+        self.sem = asyncio.Semaphore(self.concurrency)
+        if volumes is None:
+            volumes = await self.list_volumes(root_url, pattern)
+        volumes = sorted(volumes, key=volume_number)
+        remaining = {v.lower(): v for v in volumes}
+        if not remaining:
+            return []
+
+        # The newest volume's cumulative index normally lists every older volume too
+        newest = volumes[-1]
+        index_url, rows = await self.index_rows(root_url, newest)
+        if rows is not None and any(r.get("volume") for r in rows):
+            covered = [r for r in rows if _volume(r, newest) in remaining]
+            for vol in {_volume(r, newest) for r in covered}:
+                self.store(root_url, remaining.pop(vol), [r for r in covered if _volume(r, newest) == vol],
+                           "index")
+            print(f"{index_url}: {len(covered)} products in {len(volumes) - len(remaining)} volumes")
+
+        counts = await asyncio.gather(*(self.crawl_volume(root_url, v) for v in remaining.values()))
+        for v, n in zip(remaining.values(), counts):
+            print(f"{v}: {n} products")
+        if sizes:
+            print(f"Sized {await self.fill_sizes(volumes)} products")
+        return volumes
+
+
+def crawl_volumes(volume_urls=None, db_path=CRAWL_DB, root_url=ROOT_URL, pattern=VOLUME_GLOB, sizes=True,
+                  concurrency=CONCURRENCY):
+    """
+    Synchronous entry point. volume_urls are full volume URLs (their parent is used as the root);
+    None crawls every volume under root_url matching pattern. Returns (links, sizes) like product_links.
+    """
+    volumes = None
+    if volume_urls:
+        root_url = volume_urls[0].rstrip("/").rsplit("/", 1)[0] + "/"
+        volumes = [u.rstrip("/").rsplit("/", 1)[-1] for u in volume_urls]
+    crawler = Crawler(db_path, concurrency)
+    start = time.perf_counter()
+    try:
+        volumes = asyncio.run(crawler.crawl(root_url, volumes, pattern, sizes))
+    finally:
+        crawler.close()
+    print(f"Crawled {len(volumes)} volumes in {time.perf_counter() - start:.1f}s "
+          f"({crawler.fetched} fetched, {crawler.not_modified} not modified)")
+    return product_links(db_path, volumes)
+
+
+def product_links(db_path=CRAWL_DB, volumes=None):
+    """
+    (urls, sizes) from the catalog, sizes keyed by upper-cased basename as download_files expects.
+    """
+    conn = sqlite3.connect(db_path)
+    sql, args = "SELECT url, file_name, size FROM products", []
+    if volumes:
+        sql += f" WHERE volume IN ({','.join('?' * len(volumes))})"
+        args = [v.lower() for v in volumes]
+    rows = conn.execute(sql + " ORDER BY volume, url", args).fetchall()
+    conn.close()
+    return [r[0] for r in rows], {r[1].upper(): r[2] for r in rows if r[2] is not None}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Catalog PDS volumes from their index tables")
+    parser.add_argument("volumes", nargs="*", help="volume URLs (default: every volume under --root)")
+    parser.add_argument("--root", default=ROOT_URL)
+    parser.add_argument("--match", default=VOLUME_GLOB, help="volume name pattern, e.g. 'mrox_38*'")
+    parser.add_argument("--db", default=CRAWL_DB)
+    parser.add_argument("--concurrency", type=int, default=CONCURRENCY)
+    parser.add_argument("--no-sizes", action="store_true", help="skip the HEAD requests for file sizes")
+    args = parser.parse_args()
+
+    links, sizes = crawl_volumes(args.volumes or None, args.db, args.root, args.match,
+                                 not args.no_sizes, args.concurrency)
+    print(f"✅ {len(links)} products ({len(sizes)} with sizes, "
+          f"{sum(sizes.values()) / 1e9:.1f} GB) in {args.db}")
@@ -0,0 +1,229 @@
+import os
+import sys
+import time
+import argparse
+from config import ENV_PREFIX, load_config, parse_setting
+from metrics import configure as configure_metrics
+
+# ----------------------------
+# Command line
+# ----------------------------
+# One entry point for the pipeline stages (crawl, download, convert, label,
+# project, tile, mosaic, preview, patches) and the shared job queue (queue):
+#
+#   python ctx.py [--config ctx.json] [--set key=value ...] <command> [options]
+#
+# Settings come from config.py. Each command imports its backend when it runs,
+# so `crawl` and `label` never load GDAL, OpenCV or rasterio and start at once.
+# The stage functions are the same ones extract_data.py chains together.
+
+
+def _cache(cfg):
+    if not cfg["build_cache"]:
+        return None
+    from build_cache import BuildCache, default_cache_path
+    return BuildCache(default_cache_path(cfg["processed_dir"]))
+
+
+def _links(cfg):
+    """(links, sizes) for the configured volume: crawl catalog if there is one, else the HTML listing."""
+    if cfg["crawl_db"]:
+        from crawler import crawl_volumes
+        return crawl_volumes([cfg["volume_url"]], cfg["crawl_db"])
+    from downloader import get_img_links
+    return get_img_links(cfg["volume_url"]), None
+
+
+def _checksums(cfg):
+    """{basename: md5} published with the volume, {} if there are none or md5_manifest is ""."""
+    if cfg["md5_manifest"] == "":
+        return {}
+    from downloader import fetch_checksums
+    return fetch_checksums(cfg["volume_url"], cfg["md5_manifest"])
+
+
+def cmd_crawl(cfg, args):
+    from crawler import crawl_volumes
+    db = cfg["crawl_db"] or os.path.join(cfg["data_dir"], "metadata", "crawl.sqlite")
+    os.makedirs(os.path.dirname(os.path.abspath(db)), exist_ok=True)
+    volumes = None if args.all else (args.volumes or [cfg["volume_url"]])
+    links, sizes = crawl_volumes(volumes, db, pattern=args.match, sizes=not args.no_sizes)
+    print(f"✅ {len(links)} products ({len(sizes)} with sizes, {sum(sizes.values()) / 1e9:.1f} GB) in {db}")
+
+
+def cmd_download(cfg, args):
+    from downloader import download_files
+    links, sizes = _links(cfg)
+    limit = args.limit if args.limit is not None else cfg["download_limit"]
+    done = download_files(links, cfg["raw_dir"], limit=limit or None, delay=cfg["download_delay"],
+                          workers=cfg["download_workers"], sizes=sizes, checksums=_checksums(cfg),
+                          cache=_cache(cfg))
+    print(f"✅ {len(done)} files in {cfg['raw_dir']}")
+
+
+def cmd_convert(cfg, args):
+    from tif_convert import convert_img_to_tif
+    out = convert_img_to_tif(cfg["raw_dir"], cfg["processed_dir"], _cache(cfg), cfg["tif_mode"],
+                             cfg["tif_compress"], cfg["convert_workers"])
+    print(f"✅ Converted {len(out)} files into {cfg['processed_dir']}")
+
+
+def cmd_label(cfg, args):
+    from labels import extract_lbl_from_img
+    extract_lbl_from_img(cfg["raw_dir"], cfg["metadata_dir"], _cache(cfg))
+    if cfg["catalog_db"]:
+        from catalog import build_catalog
+        n = build_catalog(cfg["raw_dir"], cfg["catalog_db"], cfg["processed_dir"],
+                          cfg["metadata_dir"])
+        print(f"Indexed {n} products in {cfg['catalog_db']}")
+
+
+def cmd_project(cfg, args):
+    from reproject import reproject_dir
+    out = reproject_dir(cfg["raw_dir"], cfg["projected_dir"], cfg["processed_dir"], cfg["map_projection"],
+                        cfg["map_resolution"], args.workers, _cache(cfg))
+    print(f"✅ {len(out)} products projected into {cfg['projected_dir']}")
+
+
+def cmd_tile(cfg, args):
+    source = cfg["processed_dir"] if cfg["convert_to_tif"] else cfg["raw_dir"]
+    if args.geotiff:
+        from scrape_and_process import tile_tifs
+        tile_tifs(source, os.path.join(cfg["data_dir"], "tiles", cfg["volume"]), cfg["tile_size"],
+                  tile_format=cfg["tile_format"])
+        return
+    from pyramid_tiles import create_opencv_tiles
+    create_opencv_tiles(source, cfg["web_tiles_dir"], cfg["tile_size"], cfg["tile_workers"], _cache(cfg),
+                        cfg["tile_format"])
+
+
+def cmd_mosaic(cfg, args):
+    from mosaic import footprints_for
+    from merge_ctx_basemap import load_metadata, open_rasters, needs_flip, update_basemap
+    metadata = load_metadata(cfg["metadata_dir"])
+    # Map-projected products mosaic for real; unprojected ones are stacked side by side
+    paths = open_rasters(cfg["projected_dir"], metadata) if os.path.isdir(cfg["projected_dir"]) else []
+    paths = paths or open_rasters(cfg["processed_dir"], metadata)
+    if not paths:
+        print("No labelled rasters to merge.")
+        return
+    out = args.output or cfg["merged_path"]
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    footprints, crs = footprints_for(paths, layout="auto", flip=needs_flip)
+    tiles = os.path.splitext(out)[0] + ".mbtiles" if args.output and cfg["basemap_tiles"] else cfg["basemap_tiles"]
+    update_basemap(footprints, crs, out, tiles, cfg["tile_size"], full=args.full)
+
+
+def cmd_preview(cfg, args):
+    from preview import make_previews, write_preview
+    if args.input and not os.path.isdir(args.input):
+        out = os.path.join(cfg["preview_dir"], os.path.splitext(os.path.basename(args.input))[0] + ".png")
+        w, h = write_preview(args.input, out, cfg["preview_size"])
+        print(f"✅ Preview saved to {out} ({w}x{h})")
+    else:
+        make_previews(args.input or cfg["processed_dir"], cfg["preview_dir"], cfg["preview_size"])
+
+
+def cmd_patches(cfg, args):
+    from patches import export_patches, raster_paths
+    source = args.input or (cfg["projected_dir"] if os.path.isdir(cfg["projected_dir"]) and
+                            os.listdir(cfg["projected_dir"]) else cfg["processed_dir"])
+    export_patches(raster_paths(source), args.output or cfg["patches_dir"], cfg["patch_size"],
+                   cfg["patch_stride"] or None, cfg["patch_min_valid"], label_dir=cfg["raw_dir"])
+
+
+def cmd_queue(cfg, args):
+    from jobqueue import JobQueue, enqueue_volume, run_workers, print_status
+    queue = JobQueue(cfg["queue_db"], cfg["lease_seconds"], cfg["max_attempts"], shared=args.shared)
+    if args.action == "enqueue":
+        links, sizes = _links(cfg)
+        print(f"✅ {enqueue_volume(queue, links, sizes, _checksums(cfg))} new products queued in {cfg['queue_db']}")
+    elif args.action == "work":
+        run_workers(queue, cfg, args.processes, stages=args.stages, idle_exit=not args.forever)
+    elif args.action == "retry-dead":
+        print(f"Requeued {queue.retry_dead()} jobs")
+    else:
+        print_status(queue)
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="ctx", description="CTX download / processing pipeline")
+    parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+    parser.add_argument("--set", action="append", default=[], metavar="KEY=VALUE",
+                        help="override one setting, e.g. --set tile_size=512 (repeatable)")
+    parser.add_argument("--metrics-file", help="append one JSON line per stage item here (metrics_file setting)")
+    parser.add_argument("--show-config", action="store_true", help="print the merged settings and exit")
+    sub = parser.add_subparsers(dest="cmd")
+
+    c = sub.add_parser("crawl", help="catalog product URLs and sizes from the volume index")
+    c.add_argument("volumes", nargs="*", help="volume URLs (default: the configured volume)")
+    c.add_argument("--all", action="store_true", help="every volume under the CTX root matching --match")
+    c.add_argument("--match", default="mrox_*")
+    c.add_argument("--no-sizes", action="store_true", help="skip the HEAD requests for file sizes")
+
+    d = sub.add_parser("download", help="fetch the volume's products into raw_dir")
+    d.add_argument("--limit", type=int, help="number of files (0 = all)")
+
+    sub.add_parser("convert", help="raw .IMG → GeoTIFF/COG in processed_dir")
+    sub.add_parser("label", help="extract label JSON into metadata_dir (and the footprint catalog)")
+
+    r = sub.add_parser("project", help="warp products onto the shared map grid in projected_dir")
+    r.add_argument("--workers", type=int, default=os.cpu_count())
+
+    t = sub.add_parser("tile", help="web tile pyramids into web_tiles_dir")
+    t.add_argument("--geotiff", action="store_true", help="cut georeferenced GeoTIFF tiles instead")
+
+    m = sub.add_parser("mosaic", help="merge processed rasters into one basemap (and tile it)")
+    m.add_argument("-o", "--output", help="default: merged_path")
+    m.add_argument("--full", action="store_true", help="rebuild everything instead of only what new products touch")
+
+    e = sub.add_parser("patches", help="fixed-size ML training patches into one memory-mapped array")
+    e.add_argument("input", nargs="?", help="a raster or a directory (default: projected_dir, else processed_dir)")
+    e.add_argument("-o", "--output", help="default: patches_dir")
+
+    q = sub.add_parser("queue", help="shared per-product job queue: several hosts/processes split a volume")
+    q.add_argument("action", choices=["enqueue", "work", "status", "retry-dead"])
+    q.add_argument("-p", "--processes", type=int, default=2, help="worker processes on this host (work)")
+    q.add_argument("--stages", nargs="+", choices=["download", "label", "convert", "tile"],
+                   help="only claim these stages (work)")
+    q.add_argument("--forever", action="store_true", help="keep polling once the queue is drained (work)")
+    q.add_argument("--shared", action="store_true", help="queue file is on a network filesystem (no WAL)")
+
+    p = sub.add_parser("preview", help="PNG quicklooks into preview_dir")
+    p.add_argument("input", nargs="?", help="a raster or a directory (default: processed_dir)")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        overrides = dict(parse_setting(s) for s in args.set)
+        if args.metrics_file:
+            overrides["metrics_file"] = args.metrics_file
+        cfg = load_config(args.config, **overrides)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    for s in args.set:
+        # Exported so pool workers that load the config themselves get the same overrides
+        key, _, value = s.partition("=")
+        os.environ[ENV_PREFIX + key.strip().replace("-", "_").upper()] = value
+
+    if args.show_config:
+        for key, value in cfg.items():
+            print(f"{key:18s} {value}")
+        return 0
+    if not args.cmd:
+        parser.print_help()
+        return 2
+
+    profile_dir = os.path.join(cfg["metadata_dir"], "profiles") if cfg["profile_stages"] else None
+    configure_metrics(cfg["metrics_file"] or None, profile_dir, cfg["profile_stages"])
+    start = time.perf_counter()
+    globals()["cmd_" + args.cmd](cfg, args)
+    print(f"{args.cmd} finished in {time.perf_counter() - start:.1f}s")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,67 +1,37 @@
-import os
-import time
-import requests
-from bs4 import BeautifulSoup
-from tqdm import tqdm
+import argparse
+from config import load_config
+from downloader import download_files, get_img_links, fetch_checksums
 
 # ----------------------------
 # User Config
 # ----------------------------
-VOLUME_URL = "https://planetarydata.jpl.nasa.gov/img/data/mro/ctx/mrox_4099/"
-RAW_DIR = "C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/raw/ctx/mrox_4099"
-DOWNLOAD_LIMIT = 5  # only first 5 files
-DOWNLOAD_DELAY = 1   # seconds between downloads
-
-# ----------------------------
-# Functions
-# ----------------------------
-def get_img_links(volume_url):
-    if not volume_url.endswith('/'):
-        volume_url += '/'
-    data_url = volume_url + "data/"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    try:
-        resp = requests.get(data_url, headers=headers, timeout=30)
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"Error accessing {data_url}: {e}")
-        return []
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    links = [data_url + a['href'] for a in soup.find_all('a', href=True)
-             if a['href'].upper().endswith(".IMG")]
-    return links
-
-def download_files(links, dest_folder, limit=5, delay=1):
-    os.makedirs(dest_folder, exist_ok=True)
-    links = links[:limit]
-    for link in tqdm(links, desc="Downloading .IMG files"):
-        fname = os.path.join(dest_folder, os.path.basename(link))
-        if os.path.exists(fname):
-            continue
-        try:
-            headers = {"User-Agent": "Mozilla/5.0"}
-            resp = requests.get(link, stream=True, headers=headers, timeout=30)
-            with open(fname, 'wb') as f:
-                for chunk in resp.iter_content(1024):
-                    if chunk:
-                        f.write(chunk)
-            time.sleep(delay)
-        except Exception as e:
-            print(f"Error downloading {link}: {e}")
+# Volume, raw_dir and the download settings come from config.py (ctx.json / CTX_* variables);
+# the flags below override them for one run.
 
 # ----------------------------
 # Main
 # ----------------------------
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Download a volume's .IMG files into raw_dir")
+    parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+    parser.add_argument("--volume", help="volume name, e.g. mrox_4099")
+    parser.add_argument("--raw-dir")
+    parser.add_argument("--limit", type=int, help="number of files (0 = all)")
+    args = parser.parse_args()
+    cfg = load_config(args.config, volume=args.volume, raw_dir=args.raw_dir, download_limit=args.limit)
+    limit = cfg["download_limit"] or None
+
     print("1️⃣ Getting .IMG file links...")
-    links = get_img_links(VOLUME_URL)
+    links = get_img_links(cfg["volume_url"], exts=(".IMG",))
     print(f"Found {len(links)} .IMG files.")
     
     if not links:
         print("No .IMG files found. Exiting.")
         exit()
 
-    print(f"2️⃣ Downloading first {DOWNLOAD_LIMIT} .IMG files...")
-    download_files(links, RAW_DIR, limit=DOWNLOAD_LIMIT, delay=DOWNLOAD_DELAY)
+    print(f"2️⃣ Downloading {f'first {limit}' if limit else 'all'} .IMG files...")
+    checksums = fetch_checksums(cfg["volume_url"], cfg["md5_manifest"]) if cfg["md5_manifest"] != "" else {}
+    download_files(links, cfg["raw_dir"], limit=limit, delay=cfg["download_delay"],
+                   workers=cfg["download_workers"], checksums=checksums)
 
     print("\n✅ Download complete!")
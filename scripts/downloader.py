@@ -0,0 +1,294 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from urllib.parse import urlparse
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from tqdm import tqdm
+
+from metrics import track
+
+# ----------------------------
+# Defaults
+# ----------------------------
+USER_AGENT = "Mozilla/5.0"
+CHUNK_SIZE = 1024 * 1024  # 1 MiB writes
+DOWNLOAD_WORKERS = 4
+PER_HOST_LIMIT = 4  # concurrent connections per host
+TIMEOUT = 30
+PART_SUFFIX = ".part"
+MD5_MANIFESTS = ("md5sums.txt", "MD5SUMS", "checksums.md5")  # looked for under the volume root
+
+
+# ----------------------------
+# Listing
+# ----------------------------
+def get_img_links(volume_url, exts=(".IMG", ".LBL")):
+    """Links to the products in a volume's data/ directory, scraped from its HTML listing."""
+    from bs4 import BeautifulSoup  # only needed when there is no crawl catalog
+
+    if not volume_url.endswith('/'):
+        volume_url += '/'
+    data_url = volume_url + "data/"
+    try:
+        resp = requests.get(data_url, headers={"User-Agent": USER_AGENT}, timeout=TIMEOUT)
+        resp.raise_for_status()
+    except Exception as e:
+        print(f"Error accessing {data_url}: {e}")
+        return []
+
+    soup = BeautifulSoup(resp.text, 'html.parser')
+    return [data_url + a['href'] for a in soup.find_all('a', href=True)
+            if a['href'].upper().endswith(exts)]
+
+
+# ----------------------------
+# Session / Rate limiting
+# ----------------------------
+def make_session(pool_size=DOWNLOAD_WORKERS, retries=3):
+    """Create a requests session with a keep-alive connection pool."""
+    session = requests.Session()
+    session.headers.update({"User-Agent": USER_AGENT})
+    retry = Retry(total=retries, backoff_factor=1,
+                  status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=("HEAD", "GET"))
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+class HostLimiter:
+    """Caps concurrent requests per host and spaces request starts by `delay` seconds."""
+
+    def __init__(self, per_host=PER_HOST_LIMIT, delay=0):
+        self.per_host = per_host
+        self.delay = delay
+        self._lock = threading.Lock()
+        self._slots = {}
+        self._next_start = {}
+
+    def _slot(self, host):
+        with self._lock:
+            if host not in self._slots:
+                self._slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self._slots[host]
+
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        self._slot(host).acquire()
+        if self.delay:
+            with self._lock:
+                now = time.monotonic()
+                start = max(now, self._next_start.get(host, now))
+                self._next_start[host] = start + self.delay
+            if start > now:
+                time.sleep(start - now)
+        return host
+
+    def release(self, host):
+        self._slot(host).release()
+
+
+# ----------------------------
+# Checksums / Index
+# ----------------------------
+def parse_md5_manifest(text):
+    """Parse `md5sum`-style lines ("<hex>  <path>") into {basename: md5}."""
+    checksums = {}
+    for line in text.splitlines():
+        m = re.match(r"^([0-9a-fA-F]{32})\s+\*?(.+?)\s*$", line)
+        if m:
+            checksums[os.path.basename(m.group(2)).upper()] = m.group(1).lower()
+    return checksums
+
+
+def fetch_checksums(volume_url, manifest=None, session=None):
+    """
+    {basename: md5} from the volume's md5sum-style manifest: `manifest` (URL, or path relative to
+    the volume), else the first of MD5_MANIFESTS that exists. {} if the volume publishes none.
+    """
+    if not volume_url.endswith("/"):
+        volume_url += "/"
+    names = [manifest] if manifest else MD5_MANIFESTS
+    session = session or make_session(pool_size=1, retries=1)
+    for name in names:
+        url = name if "://" in name else volume_url + name
+        try:
+            resp = session.get(url, timeout=TIMEOUT)
+        except requests.RequestException as e:
+            print(f"Error fetching {url}: {e}")
+            continue
+        if resp.ok:
+            checksums = parse_md5_manifest(resp.text)
+            if checksums:
+                print(f"{len(checksums)} md5 checksums from {url}")
+                return checksums
+    return {}
+
+
+def file_md5(path, chunk_size=CHUNK_SIZE):
+    h = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def remote_size(session, url):
+    """Content-Length from a HEAD request, or None if the server does not say (or fails)."""
+    try:
+        resp = session.head(url, allow_redirects=True, timeout=TIMEOUT)
+        resp.raise_for_status()
+        size = resp.headers.get("Content-Length")
+        return int(size) if size is not None else None
+    except Exception:
+        return None
+
+
+def _total_size(resp, offset):
+    """Full object size from a GET response, honouring Content-Range on 206."""
+    content_range = resp.headers.get("Content-Range")
+    if content_range and "/" in content_range:
+        total = content_range.rsplit("/", 1)[1]
+        if total.isdigit():
+            return int(total)
+    length = resp.headers.get("Content-Length")
+    if length is None:
+        return None
+    return int(length) + (offset if resp.status_code == 206 else 0)
+
+
+# ----------------------------
+# Download
+# ----------------------------
+def download_file(session, url, dest_path, expected_size=None, expected_md5=None,
+                  chunk_size=CHUNK_SIZE, limiter=None):
+    """
+    Download `url` to `dest_path`, resuming a partial `.part` file with an HTTP Range request.
+    The file is only renamed into place once its size (and md5, if given) checks out.
+    Returns the number of bytes transferred.
+    """
+    with track("download", url) as rec:
+        start = time.perf_counter()
+        host = limiter.acquire(url) if limiter else None
+        rec["wait_s"] = round(time.perf_counter() - start, 6)  # per-host limiter
+        try:
+            rec["bytes_in"] = _download(session, url, dest_path, expected_size, expected_md5, chunk_size)
+            return rec["bytes_in"]
+        finally:
+            if limiter:
+                limiter.release(host)
+
+
+def _download(session, url, dest_path, expected_size, expected_md5, chunk_size):
+    """Body of download_file without the limiter; returns the number of bytes transferred."""
+    part_path = dest_path + PART_SUFFIX
+    if os.path.exists(dest_path):
+        size = os.path.getsize(dest_path)
+        if expected_size is None:
+            expected_size = remote_size(session, url)
+        if expected_size is None or size == expected_size:
+            if expected_md5 is None or file_md5(dest_path) == expected_md5:
+                return 0
+            os.remove(dest_path)
+        elif size < expected_size:
+            # Truncated by an earlier crash - resume it
+            os.replace(dest_path, part_path)
+        else:
+            os.remove(dest_path)
+
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    if expected_size is not None and offset > expected_size:
+        os.remove(part_path)  # longer than the file can be: no Range on it would ever be satisfied
+        offset = 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+    with session.get(url, stream=True, headers=headers, timeout=TIMEOUT) as resp:
+        if resp.status_code == 416 and offset:
+            # Range not satisfiable: the .part is the whole file, or it is longer than the file
+            total = _total_size(resp, offset) if "/" in resp.headers.get("Content-Range", "") else None
+            if total is None:
+                total = expected_size if expected_size is not None else offset
+            if total != offset:
+                resp.close()
+                os.remove(part_path)
+                return _download(session, url, dest_path, expected_size, expected_md5, chunk_size)
+        else:
+            resp.raise_for_status()
+            if offset and resp.status_code != 206:
+                offset = 0  # server ignored Range, start over
+            total = _total_size(resp, offset)
+            mode = "ab" if offset else "wb"
+            with open(part_path, mode) as f:
+                for chunk in resp.iter_content(chunk_size):
+                    if chunk:
+                        f.write(chunk)
+
+    size = os.path.getsize(part_path)
+    if expected_size is not None and total is not None and total != expected_size:
+        raise IOError(f"server size {total} does not match index size {expected_size}")
+    if total is not None and size != total:
+        raise IOError(f"incomplete download: {size} of {total} bytes")
+    if expected_md5 is not None and file_md5(part_path) != expected_md5:
+        os.remove(part_path)
+        raise IOError("md5 mismatch")
+    os.replace(part_path, dest_path)
+    return size - offset
+
+
+def _download_cached(cache, session, url, dest_path, *args):
+    params = {"url": url}
+    if cache and os.path.exists(dest_path) and cache.is_fresh("download", dest_path, params):
+        return 0
+    n = download_file(session, url, dest_path, *args)
+    if cache:
+        cache.record("download", dest_path, params, digest=False)
+    return n
+
+
+def download_files(links, dest_folder, limit=None, delay=0, workers=DOWNLOAD_WORKERS,
+                   per_host=PER_HOST_LIMIT, sizes=None, checksums=None, session=None, cache=None):
+    """
+    Download `links` into `dest_folder` with a pooled session and a bounded worker pool.
+    `sizes` / `checksums` map upper-cased basenames to the expected byte size / md5 from the index.
+    With a BuildCache, files verified in an earlier run are skipped without touching the server.
+    Returns the list of local paths that are complete on disk.
+    """
+    os.makedirs(dest_folder, exist_ok=True)
+    if limit:
+        links = links[:limit]
+    sizes = sizes or {}
+    checksums = checksums or {}
+    session = session or make_session(pool_size=max(workers, per_host))
+    limiter = HostLimiter(per_host=per_host, delay=delay)
+
+    done = []
+    transferred = 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {}
+        for link in links:
+            name = os.path.basename(link)
+            fname = os.path.join(dest_folder, name)
+            fut = pool.submit(_download_cached, cache, session, link, fname,
+                              sizes.get(name.upper()), checksums.get(name.upper()),
+                              CHUNK_SIZE, limiter)
+            futures[fut] = (link, fname)
+        for fut in tqdm(as_completed(futures), total=len(futures), desc="Downloading files"):
+            link, fname = futures[fut]
+            try:
+                transferred += fut.result()
+                done.append(fname)
+            except Exception as e:
+                print(f"Error downloading {link}: {e}")
+
+    elapsed = time.perf_counter() - start
+    if transferred:
+        print(f"Downloaded {transferred / 1e6:.1f} MB in {elapsed:.1f}s "
+              f"({transferred / 1e6 / max(elapsed, 1e-9):.1f} MB/s)")
+    return done
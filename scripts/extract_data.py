@@ -1,191 +1,188 @@
 import os
-import time
-import requests
-from bs4 import BeautifulSoup
-from tqdm import tqdm
-from osgeo import gdal
-import cv2
-import re
 import json
-import math
+from functools import partial
+from config import load_config
+from downloader import download_files, download_file, make_session, HostLimiter, get_img_links, fetch_checksums
+from pipeline import Stage, run_pipeline
+from pyramid_tiles import tile_params, tile_one, create_opencv_tiles
+from build_cache import BuildCache, default_cache_path
+from tif_convert import convert_one, convert_img_to_tif, gdal_threads
+from catalog import build_catalog
+from crawler import crawl_volumes
+from reproject import reproject_dir
+from labels import LABEL_KEYS, extract_label_one, write_combined_metadata, extract_lbl_from_img
+from metrics import METRICS, configure as configure_metrics, serve_metrics
 
 # ----------------------------
 # User Config
 # ----------------------------
-VOLUME_URL = "https://planetarydata.jpl.nasa.gov/img/data/mro/ctx/mrox_3866/"
-RAW_DIR = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\raw\ctx_mrox_3886"
-PROCESSED_DIR = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\processed\ctx_mrox_3886"
-METADATA_DIR = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\metadata\ctx_mrox_3886"
-WEB_TILES_DIR = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\web_tiles\ctx_mrox_3886"
-
-DOWNLOAD_LIMIT = 10  # None = download all
-DOWNLOAD_DELAY = 1  # seconds between downloads
-TILE_SIZE = 256
-
-# Enable GDAL exceptions
-gdal.UseExceptions()
+# Paths and settings come from config.py: defaults < ctx.json / $CTX_CONFIG < CTX_* variables
+CONFIG = load_config()
+VOLUME_URL = CONFIG["volume_url"]
+RAW_DIR = CONFIG["raw_dir"]
+PROCESSED_DIR = CONFIG["processed_dir"]
+METADATA_DIR = CONFIG["metadata_dir"]
+WEB_TILES_DIR = CONFIG["web_tiles_dir"]
+PROJECTED_DIR = CONFIG["projected_dir"]
+
+DOWNLOAD_LIMIT = CONFIG["download_limit"] or None  # None = download all
+DOWNLOAD_DELAY = CONFIG["download_delay"]  # min seconds between request starts per host
+MD5_MANIFEST = CONFIG["md5_manifest"]  # md5sum file of the volume, None = look for one, "" = no checks
+DOWNLOAD_WORKERS = CONFIG["download_workers"]  # parallel downloads (pooled connections)
+TILE_SIZE = CONFIG["tile_size"]
+TILE_WORKERS = CONFIG["tile_workers"]  # processes encoding tiles in the non-streaming workflow
+TILE_FORMAT = CONFIG["tile_format"]  # "files" = level_N/{x}_{y}.jpg, "mbtiles" = one packed <product>.mbtiles per product
+
+STREAMING = True  # overlap download → label → convert → tile per product
+STAGE_WORKERS = {"download": 4, "label": 1, "convert": 2, "tile": 2}
+STAGE_QUEUE_SIZE = 4  # max products waiting in front of each stage
+KEEP_RAW = CONFIG["keep_raw"]  # False = delete each .IMG once it has been converted
+CONVERT_TO_TIF = CONFIG["convert_to_tif"]  # False = tile straight from the memory-mapped .IMG, no GeoTIFF copy
+BUILD_CACHE = default_cache_path(PROCESSED_DIR) if CONFIG["build_cache"] else None  # None = always rebuild
+CATALOG_DB = CONFIG["catalog_db"] or None  # footprint index, None = skip
+CRAWL_DB = CONFIG["crawl_db"] or None  # product URL/size catalog from the volume index, None = scrape data/
+TIF_MODE = CONFIG["tif_mode"]  # "gtiff" = legacy striped BIGTIFF, "cog" = 512px tiles + compression + overviews
+TIF_COMPRESS = CONFIG["tif_compress"]  # DEFLATE, ZSTD or LZW (with predictor)
+CONVERT_WORKERS = CONFIG["convert_workers"]  # files converted at once in the phased workflow
+REPROJECT = CONFIG["reproject"]  # warp onto the shared map grid so the basemap is a real mosaic
+METRICS_FILE = CONFIG["metrics_file"] or None  # one JSON line per stage item, None = off
+METRICS_PORT = CONFIG["metrics_port"] or None  # e.g. 9108 to serve Prometheus text at http://127.0.0.1:9108/metrics
+PROFILE_STAGES = CONFIG["profile_stages"]  # stages to run under cProfile, e.g. ["convert", "tile"] or ["*"]
+PROFILE_DIR = os.path.join(METADATA_DIR, "profiles")
 
 # ----------------------------
 # Helper Functions
 # ----------------------------
 
-def get_img_links(volume_url):
-    if not volume_url.endswith('/'):
-        volume_url += '/'
-    data_url = volume_url + "data/"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    try:
-        resp = requests.get(data_url, headers=headers, timeout=30)
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"Error accessing {data_url}: {e}")
-        return []
-
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    links = [data_url + a['href'] for a in soup.find_all('a', href=True)
-             if a['href'].upper().endswith(('.IMG', '.LBL'))]
-    return links
-
-def download_files(links, dest_folder, limit=None, delay=1):
-    os.makedirs(dest_folder, exist_ok=True)
-    if limit:
-        links = links[:limit]
-
-    for link in tqdm(links, desc="Downloading files"):
-        fname = os.path.join(dest_folder, os.path.basename(link))
-        if os.path.exists(fname):
-            continue
-        try:
-            headers = {"User-Agent": "Mozilla/5.0"}
-            resp = requests.get(link, stream=True, headers=headers, timeout=30)
-            with open(fname, 'wb') as f:
-                for chunk in resp.iter_content(1024):
-                    if chunk:
-                        f.write(chunk)
-            time.sleep(delay)
-        except Exception as e:
-            print(f"Error downloading {link}: {e}")
-
-def convert_img_to_tif(raw_dir, out_dir):
-    os.makedirs(out_dir, exist_ok=True)
-    converted_files = []
-
-    for fname in os.listdir(raw_dir):
-        if fname.upper().endswith(".IMG"):
-            src_path = os.path.join(raw_dir, fname)
-            dst_path = os.path.join(out_dir, fname.replace(".IMG", ".tif"))
-            print(f"Converting {fname} → {dst_path}")
-            try:
-                gdal.Translate(
-                    dst_path,
-                    src_path,
-                    options=gdal.TranslateOptions(format='GTiff', creationOptions=['BIGTIFF=YES'])
-                )
-                converted_files.append(dst_path)
-            except Exception as e:
-                print(f"Failed to convert {fname}: {e}")
-    return converted_files
-
-def extract_lbl_from_img(raw_dir, metadata_dir):
-    os.makedirs(metadata_dir, exist_ok=True)
+def convert_and_cleanup(img_path, out_dir, keep_raw=True, cache=None, mode=TIF_MODE, compress=TIF_COMPRESS,
+                        threads=None):
+    dst_path = convert_one(img_path, out_dir, cache, mode, compress, threads)
+    if not keep_raw:
+        os.remove(img_path)
+    return dst_path
+
+def run_streaming(links, raw_dir, processed_dir, metadata_dir, web_tiles_dir, tile_size=256,
+                  workers=None, queue_size=4, keep_raw=True, delay=0, cache=None, convert=True,
+                  tile_format=TILE_FORMAT, sizes=None, checksums=None):
+    """
+    Push each .IMG product through download → label → convert → tile as soon as the
+    previous stage is done with it. Every stage has its own pool and a bounded input queue.
+    """
+    workers = {**STAGE_WORKERS, **(workers or {})}
+    for d in (raw_dir, processed_dir, metadata_dir, web_tiles_dir):
+        os.makedirs(d, exist_ok=True)
+
+    session = make_session(pool_size=workers["download"])
+    limiter = HostLimiter(per_host=workers["download"], delay=delay)
     metadata_list = []
 
-    for fname in os.listdir(raw_dir):
-        if not fname.upper().endswith(".IMG"):
-            continue
-        img_path = os.path.join(raw_dir, fname)
-        try:
-            header_text = ""
-            with open(img_path, "rb") as f:
-                while True:
-                    line = f.readline().decode(errors="ignore")
-                    header_text += line
-                    if "END" in line:
-                        break
-
-            metadata = {}
-            for key in ["PRODUCT_ID", "IMAGE", "LINES", "LINE_SAMPLES", "SAMPLE_TYPE", "SAMPLE_BITS",
-                        "START_TIME", "STOP_TIME", "SPACECRAFT_NAME", "INSTRUMENT_NAME",
-                        "MISSION_PHASE_NAME", "TARGET_NAME"]:
-                m = re.search(rf"{key}\s*=\s*(.+)", header_text)
-                if m:
-                    metadata[key] = m.group(1).strip()
-            metadata["FILE_NAME"] = fname
-
-            json_path = os.path.join(metadata_dir, fname.replace(".IMG", ".json"))
-            with open(json_path, "w") as jf:
-                json.dump(metadata, jf, indent=4)
-
-            metadata_list.append(metadata)
-
-        except Exception as e:
-            print(f"Failed to extract metadata from {fname}: {e}")
-
-    combined_path = os.path.join(metadata_dir, "combined_metadata.json")
-    with open(combined_path, "w") as cf:
-        json.dump(metadata_list, cf, indent=4)
-    print(f"✅ Metadata extracted for {len(metadata_list)} images.")
-
-def create_opencv_tiles(processed_dir, web_tiles_dir, tile_size=256):
-    """Use OpenCV to generate pyramid tiles for web display."""
-    os.makedirs(web_tiles_dir, exist_ok=True)
-    for tif_file in os.listdir(processed_dir):
-        if not tif_file.lower().endswith(".tif"):
-            continue
-        input_tif = os.path.join(processed_dir, tif_file)
-        output_dir = os.path.join(web_tiles_dir, tif_file[:-4])
-        os.makedirs(output_dir, exist_ok=True)
-
-        img = cv2.imread(input_tif, cv2.IMREAD_UNCHANGED)
-        if img is None:
-            print(f"Failed to read {input_tif}")
-            continue
-
-        h, w = img.shape[:2]
-        max_dim = max(h, w)
-        max_level = math.ceil(math.log2(max_dim))
-
-        print(f"Creating tiles for {tif_file}: {w}x{h}, Pyramid levels {max_level+1}")
-
-        for level in range(max_level, -1, -1):
-            scale = 2 ** (max_level - level)
-            new_w = math.ceil(w / scale)
-            new_h = math.ceil(h / scale)
-            resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-
-            level_dir = os.path.join(output_dir, f"level_{level}")
-            os.makedirs(level_dir, exist_ok=True)
-
-            for y in range(0, new_h, tile_size):
-                for x in range(0, new_w, tile_size):
-                    tile = resized[y:y+tile_size, x:x+tile_size]
-                    tile_name = f"{x}_{y}.jpg"
-                    cv2.imwrite(os.path.join(level_dir, tile_name), tile)
-    print("✅ OpenCV pyramid tiles created.")
+    def download_stage(link):
+        name = os.path.basename(link)
+        dest = os.path.join(raw_dir, name)
+        tif_path = os.path.join(processed_dir, name.replace(".IMG", ".tif")) if convert else dest
+        json_path = os.path.join(metadata_dir, name.replace(".IMG", ".json"))
+        if (cache and os.path.exists(tif_path) and os.path.exists(json_path)
+                and cache.is_fresh("tile", tif_path, tile_params(tile_size, tile_format))):
+            # Already tiled in an earlier run (the raw file may be gone with KEEP_RAW=False)
+            with open(json_path) as jf:
+                metadata_list.append(json.load(jf))
+            return None
+        if not (cache and os.path.exists(dest) and cache.is_fresh("download", dest, {"url": link})):
+            download_file(session, link, dest, (sizes or {}).get(name.upper()),
+                          (checksums or {}).get(name.upper()), limiter=limiter)
+            if cache:
+                cache.record("download", dest, {"url": link}, digest=False)
+        return dest
+
+    def label_stage(img_path):
+        metadata_list.append(extract_label_one(img_path, metadata_dir, cache))
+        return img_path
+
+    stages = [
+        Stage("download", download_stage, workers["download"], "thread", queue_size),
+        Stage("label", label_stage, workers["label"], "thread", queue_size),
+    ]
+    if convert:
+        stages.append(Stage("convert",
+                            partial(convert_and_cleanup, out_dir=processed_dir, keep_raw=keep_raw, cache=cache,
+                                    threads=gdal_threads(workers["convert"])),
+                            workers["convert"], "process", queue_size))
+    stages.append(Stage("tile", partial(tile_one, web_tiles_dir=web_tiles_dir, tile_size=tile_size, cache=cache,
+                                             tile_format=tile_format),
+                        workers["tile"], "process", queue_size))
+    img_links = [l for l in links if l.upper().endswith(".IMG")]
+    results, errors = run_pipeline(img_links, stages)
+
+    write_combined_metadata(metadata_list, metadata_dir)
+    print(f"✅ {len(results)} products fully processed, {len(errors)} failures.")
+    return results
 
 # ----------------------------
 # Main Workflow
 # ----------------------------
+def print_metrics():
+    report = METRICS.report()
+    if report:
+        print("\n📊 Stage metrics (this process):\n" + report)
+
+
 if __name__ == "__main__":
+    configure_metrics(METRICS_FILE, PROFILE_DIR if PROFILE_STAGES else None, PROFILE_STAGES)
+    if METRICS_PORT:
+        serve_metrics(METRICS_PORT)
+
     print("1️⃣ Getting file links...")
-    links = get_img_links(VOLUME_URL)
+    sizes = None
+    if CRAWL_DB:
+        links, sizes = crawl_volumes([VOLUME_URL], CRAWL_DB)
+    else:
+        links = get_img_links(VOLUME_URL)
     print(f"Found {len(links)} files.")
 
     if not links:
         print("No files found. Exiting.")
         exit()
+    checksums = fetch_checksums(VOLUME_URL, MD5_MANIFEST) if MD5_MANIFEST != "" else {}
+
+    cache = BuildCache(BUILD_CACHE) if BUILD_CACHE else None
+
+    if STREAMING:
+        print("2️⃣ Streaming download → label → convert → tile...")
+        if DOWNLOAD_LIMIT:
+            links = links[:DOWNLOAD_LIMIT]
+        run_streaming(links, RAW_DIR, PROCESSED_DIR, METADATA_DIR, WEB_TILES_DIR, TILE_SIZE,
+                      queue_size=STAGE_QUEUE_SIZE, keep_raw=KEEP_RAW, delay=DOWNLOAD_DELAY, cache=cache,
+                      convert=CONVERT_TO_TIF, tile_format=TILE_FORMAT, sizes=sizes,
+                      checksums=checksums)
+        if CATALOG_DB:
+            print(f"Indexed {build_catalog(RAW_DIR, CATALOG_DB, PROCESSED_DIR, METADATA_DIR)} products in {CATALOG_DB}")
+        print_metrics()
+        print("\n✅ Workflow complete!")
+        exit()
 
     print("2️⃣ Downloading files...")
-    download_files(links, RAW_DIR, limit=DOWNLOAD_LIMIT, delay=DOWNLOAD_DELAY)
+    download_files(links, RAW_DIR, limit=DOWNLOAD_LIMIT, delay=DOWNLOAD_DELAY, workers=DOWNLOAD_WORKERS,
+                   sizes=sizes, checksums=checksums, cache=cache)
 
-    print("3️⃣ Converting .IMG → .tif...")
-    converted = convert_img_to_tif(RAW_DIR, PROCESSED_DIR)
-    print(f"Converted {len(converted)} files.")
+    if CONVERT_TO_TIF:
+        print("3️⃣ Converting .IMG → .tif...")
+        converted = convert_img_to_tif(RAW_DIR, PROCESSED_DIR, cache, TIF_MODE, TIF_COMPRESS,
+                                       CONVERT_WORKERS)
+        print(f"Converted {len(converted)} files.")
 
     print("4️⃣ Extracting metadata from .IMG files...")
-    extract_lbl_from_img(RAW_DIR, METADATA_DIR)
+    extract_lbl_from_img(RAW_DIR, METADATA_DIR, cache)
+    if CATALOG_DB:
+        print(f"Indexed {build_catalog(RAW_DIR, CATALOG_DB, PROCESSED_DIR, METADATA_DIR)} products in {CATALOG_DB}")
+
+    if REPROJECT:
+        print("Projecting products onto the map grid...")
+        projected = reproject_dir(RAW_DIR, PROJECTED_DIR, PROCESSED_DIR, cache=cache)
+        print(f"Projected {len(projected)} products into {PROJECTED_DIR}.")
 
     print("5️⃣ Creating OpenCV pyramid tiles...")
-    create_opencv_tiles(PROCESSED_DIR, WEB_TILES_DIR, TILE_SIZE)
+    tile_source = PROCESSED_DIR if CONVERT_TO_TIF else RAW_DIR
+    create_opencv_tiles(tile_source, WEB_TILES_DIR, TILE_SIZE, TILE_WORKERS, cache, TILE_FORMAT)
 
+    print_metrics()
     print("\n✅ Workflow complete!")
@@ -1,19 +1,33 @@
-import pvl
-img_path = r"C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/raw/ctx/mrox_4122/N20_070273_1355_XI_44S280W.IMG"
+import os
+import argparse
+from config import load_config
+from pds_label import read_label, image_layout
 
 def extract_label(img_path):
     """
     Reads the embedded PDS label section from a .IMG file.
     """
-    with open(img_path, 'rb') as f:
-        label = pvl.load(f)
-    return label
+    return read_label(img_path)
 
 
 if __name__ == "__main__":
-    img_file = r"C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/raw/ctx/mrox_4122\N20_070273_1355_XI_44S280W.IMG"
+    parser = argparse.ArgumentParser(description="Print the PDS label and image layout of a .IMG")
+    parser.add_argument("img_file", nargs="?", help="default: the first .IMG in raw_dir")
+    parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+    args = parser.parse_args()
+    img_file = args.img_file
+    if img_file is None:
+        raw_dir = load_config(args.config)["raw_dir"]
+        names = sorted(f for f in os.listdir(raw_dir) if f.upper().endswith(".IMG")) if os.path.isdir(raw_dir) else []
+        if not names:
+            parser.error(f"no .IMG files in {raw_dir}")
+        img_file = os.path.join(raw_dir, names[0])
     label = extract_label(img_file)
 
     print("\n===== LABEL CONTENTS =====\n")
     for key, value in label.items():
         print(f"{key}: {value}")
+
+    print("\n===== IMAGE LAYOUT =====\n")
+    for key, value in image_layout(label).items():
+        print(f"{key}: {value}")
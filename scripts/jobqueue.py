@@ -0,0 +1,507 @@
+import os
+import json
+import time
+import random
+import socket
+import sqlite3
+import argparse
+import threading
+from urllib.parse import urlparse
+import traceback
+import multiprocessing as mp
+from metrics import METRICS, track
+from config import load_config
+
+# ----------------------------
+# Lease-based job queue
+# ----------------------------
+# Per-product tasks (download → label → convert → tile) live in one SQLite file
+# that any number of worker processes, on this host or on others sharing the
+# filesystem, claim from. A claim is a lease: the job belongs to its worker
+# until lease_expires, which a heartbeat thread keeps pushing forward while the
+# job runs. A worker that dies simply stops heartbeating and the job becomes
+# claimable again once the lease runs out. Failures are retried with
+# exponential backoff; a job that has been claimed max_attempts times is moved
+# to the dead_letters table (e.g. a corrupt .IMG) instead of blocking the queue.
+# Finishing a stage enqueues the product's next stage in the same transaction.
+# Download workers space their request starts per remote host through the
+# `hosts` table (download_delay apart), so the politeness delay holds for every
+# worker on every host, not per process.
+#
+# SQLite's WAL mode needs shared memory, so it is only used for local queues;
+# shared=True keeps the rollback journal, which works on network filesystems
+# with working POSIX locks.
+
+CONFIG = load_config()
+QUEUE_DB = CONFIG["queue_db"]
+LEASE_SECONDS = CONFIG["lease_seconds"]
+MAX_ATTEMPTS = CONFIG["max_attempts"]
+BACKOFF_BASE = 30.0  # seconds before the first retry, doubled per attempt
+BACKOFF_MAX = 3600.0
+POLL_INTERVAL = 0.5  # longest an idle worker waits before looking at the queue again
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    product TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    state TEXT NOT NULL DEFAULT 'ready',
+    priority INTEGER NOT NULL DEFAULT 0,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    run_after REAL NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    last_error TEXT,
+    updated REAL NOT NULL,
+    UNIQUE (product, stage)
+);
+CREATE INDEX IF NOT EXISTS jobs_claim ON jobs(state, run_after);
+CREATE TABLE IF NOT EXISTS dead_letters (
+    product TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    attempts INTEGER NOT NULL,
+    error TEXT,
+    failed_at REAL NOT NULL,
+    PRIMARY KEY (product, stage)
+);
+CREATE TABLE IF NOT EXISTS hosts (
+    host TEXT PRIMARY KEY,
+    next_start REAL NOT NULL
+);
+"""
+
+
+def stage_chain(convert=True):
+    return ["download", "label"] + (["convert"] if convert else []) + ["tile"]
+
+
+def backoff(attempts, base=BACKOFF_BASE, cap=BACKOFF_MAX):
+    """Delay before retry number `attempts` (1-based): exponential with +-25% jitter."""
+    delay = min(cap, base * 2 ** max(attempts - 1, 0))
+    return delay * random.uniform(0.75, 1.25)
+
+
+def worker_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+
+
+class Job:
+    def __init__(self, id, product, stage, payload, attempts, owner):
+        self.id = id
+        self.product = product
+        self.stage = stage
+        self.payload = payload
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self):
+        return f"Job({self.stage} {self.product}, attempt {self.attempts})"
+
+
+class JobQueue:
+    """SQLite-backed queue shared by threads and processes (each opens its own connection)."""
+
+    def __init__(self, db_path=QUEUE_DB, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS,
+                 shared=False, backoff_base=BACKOFF_BASE):
+        self.db_path = db_path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self.shared = shared
+        self.backoff_base = backoff_base
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self._conn().executescript(SCHEMA)
+
+    def __getstate__(self):
+        return {"db_path": self.db_path, "lease_seconds": self.lease_seconds,
+                "max_attempts": self.max_attempts, "shared": self.shared, "backoff_base": self.backoff_base}
+
+    def __setstate__(self, state):
+        self.__init__(**state)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=60, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=" + ("DELETE" if self.shared else "WAL"))
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _transaction(self):
+        """BEGIN IMMEDIATE takes the write lock up front, so two claimers never pick the same row."""
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        return conn
+
+    def enqueue(self, product, stage, payload=None, priority=0, conn=None):
+        """Add a job unless (product, stage) is already known. Returns True if it was added."""
+        own = conn is None
+        conn = conn or self._conn()
+        cur = conn.execute(
+            "INSERT OR IGNORE INTO jobs (product, stage, payload, priority, updated) VALUES (?, ?, ?, ?, ?)",
+            (product, stage, json.dumps(payload or {}), priority, time.time()))
+        if own:
+            METRICS.inc("queue_enqueued_total", cur.rowcount, stage=stage)
+        return cur.rowcount > 0
+
+    def enqueue_many(self, jobs, stage):
+        """jobs: iterable of (product, payload). One transaction; returns how many were new."""
+        conn = self._transaction()
+        try:
+            added = sum(self.enqueue(product, stage, payload, conn=conn) for product, payload in jobs)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        METRICS.inc("queue_enqueued_total", added, stage=stage)
+        return added
+
+    def claim(self, owner, stages=None):
+        """
+        Lease the next runnable job: ready and past its backoff, or leased to someone whose
+        lease has expired. Later pipeline stages go first so products finish before new ones
+        start. Returns a Job or None.
+        """
+        now = time.time()
+        sql = ("SELECT id, product, stage, payload, attempts FROM jobs "
+               "WHERE ((state = 'ready' AND run_after <= ?) OR (state = 'leased' AND lease_expires < ?))")
+        args = [now, now]
+        if stages:
+            sql += f" AND stage IN ({','.join('?' * len(stages))})"
+            args += list(stages)
+        sql += " ORDER BY priority DESC, id LIMIT 1"
+        conn = self._transaction()
+        try:
+            row = conn.execute(sql, args).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, product, stage, payload, attempts = row
+            if attempts >= self.max_attempts:
+                # Its last holder died mid-job as many times as we allow retries
+                self._bury(conn, job_id, "lease expired on the final attempt")
+                conn.execute("COMMIT")
+                return self.claim(owner, stages)
+            conn.execute("UPDATE jobs SET state = 'leased', lease_owner = ?, lease_expires = ?, "
+                         "attempts = attempts + 1, updated = ? WHERE id = ?",
+                         (owner, now + self.lease_seconds, now, job_id))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(job_id, product, stage, json.loads(payload), attempts + 1, owner)
+
+    def heartbeat(self, job):
+        """Extend the lease. False means the lease was lost (expired and taken by another worker)."""
+        cur = self._conn().execute(
+            "UPDATE jobs SET lease_expires = ?, updated = ? WHERE id = ? AND state = 'leased' AND lease_owner = ?",
+            (time.time() + self.lease_seconds, time.time(), job.id, job.owner))
+        return cur.rowcount == 1
+
+    def complete(self, job, next_stage=None, payload=None, priority=0):
+        """Mark the job done and, atomically, enqueue the product's next stage."""
+        conn = self._transaction()
+        try:
+            cur = conn.execute("UPDATE jobs SET state = 'done', lease_owner = NULL, last_error = NULL, "
+                               "updated = ? WHERE id = ? AND lease_owner = ?", (time.time(), job.id, job.owner))
+            if cur.rowcount and next_stage:
+                self.enqueue(job.product, next_stage, payload if payload is not None else job.payload,
+                             priority, conn=conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount == 1
+
+    def fail(self, job, error):
+        """Schedule a retry after a backoff, or dead-letter the job once its attempts are used up."""
+        conn = self._transaction()
+        try:
+            if job.attempts >= self.max_attempts:
+                self._bury(conn, job.id, error)
+                dead = True
+            else:
+                conn.execute("UPDATE jobs SET state = 'ready', lease_owner = NULL, run_after = ?, last_error = ?, "
+                             "updated = ? WHERE id = ? AND lease_owner = ?",
+                             (time.time() + backoff(job.attempts, self.backoff_base), error, time.time(), job.id, job.owner))
+                dead = False
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return dead
+
+    def _bury(self, conn, job_id, error):
+        conn.execute("INSERT OR REPLACE INTO dead_letters SELECT product, stage, payload, attempts, ?, ? "
+                     "FROM jobs WHERE id = ?", (error, time.time(), job_id))
+        conn.execute("UPDATE jobs SET state = 'dead', lease_owner = NULL, last_error = ?, updated = ? "
+                     "WHERE id = ?", (error, time.time(), job_id))
+
+    def retry_dead(self, stage=None):
+        """Put dead-lettered jobs back in the queue with fresh attempts. Returns how many."""
+        conn = self._transaction()
+        try:
+            where, args = ("AND stage = ?", [stage]) if stage else ("", [])
+            cur = conn.execute(f"UPDATE jobs SET state = 'ready', attempts = 0, run_after = 0, updated = ? "
+                               f"WHERE state = 'dead' {where}", [time.time()] + args)
+            conn.execute(f"DELETE FROM dead_letters WHERE 1 {where}", args)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return cur.rowcount
+
+    def counts(self):
+        """{stage: {state: n}}"""
+        out = {}
+        for stage, state, n in self._conn().execute("SELECT stage, state, COUNT(*) FROM jobs GROUP BY stage, state"):
+            out.setdefault(stage, {})[state] = n
+        return out
+
+    def dead_letters(self):
+        rows = self._conn().execute("SELECT product, stage, attempts, error, failed_at FROM dead_letters "
+                                    "ORDER BY failed_at")
+        return [dict(zip(("product", "stage", "attempts", "error", "failed_at"), r)) for r in rows]
+
+    def next_due(self):
+        """Seconds until the earliest backoff or lease ends (0 if something is runnable, None if idle)."""
+        due = self._conn().execute(
+            "SELECT MIN(CASE state WHEN 'ready' THEN run_after ELSE lease_expires END) FROM jobs "
+            "WHERE state IN ('ready', 'leased')").fetchone()[0]
+        return None if due is None else max(0.0, due - time.time())
+
+    def reserve_host(self, host, delay):
+        """
+        Book the next request start for `host`, at least `delay` seconds after the one booked
+        before it by any worker. Returns how long to sleep until then.
+        """
+        conn = self._transaction()
+        try:
+            now = time.time()
+            row = conn.execute("SELECT next_start FROM hosts WHERE host = ?", (host,)).fetchone()
+            start = max(now, row[0]) if row else now
+            conn.execute("INSERT OR REPLACE INTO hosts VALUES (?, ?)", (host, start + delay))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return start - now
+
+    def pending(self):
+        """Jobs that are not done or dead yet."""
+        return self._conn().execute("SELECT COUNT(*) FROM jobs WHERE state IN ('ready', 'leased')").fetchone()[0]
+
+
+# ----------------------------
+# Stage handlers
+# ----------------------------
+# Each takes (payload, cfg, state) and returns the payload for the next stage.
+# Backends are imported on first use so a worker only loads what its stages need;
+# `state` is a per-process dict for the HTTP session and build cache, and holds
+# the worker's queue under "queue".
+
+
+class QueueHostLimiter:
+    """downloader.HostLimiter stand-in whose per-host spacing is booked in the queue DB (all hosts share it)."""
+
+    def __init__(self, queue, delay):
+        self.queue = queue
+        self.delay = delay
+
+    def acquire(self, url):
+        host = urlparse(url).netloc
+        if self.delay:
+            wait = self.queue.reserve_host(host, self.delay)
+            if wait > 0:
+                time.sleep(wait)
+        return host
+
+    def release(self, host):
+        pass  # one download per worker process; the worker count bounds concurrency
+
+def _build_cache(cfg, state):
+    if "cache" not in state:
+        from build_cache import BuildCache, default_cache_path
+        state["cache"] = BuildCache(default_cache_path(cfg["processed_dir"])) if cfg["build_cache"] else None
+    return state["cache"]
+
+
+def run_download(payload, cfg, state):
+    from downloader import download_file, make_session
+    if "session" not in state:
+        state["session"] = make_session(pool_size=1)
+        state["limiter"] = QueueHostLimiter(state["queue"], cfg["download_delay"])
+    dest = os.path.join(cfg["raw_dir"], os.path.basename(payload["url"]))
+    os.makedirs(cfg["raw_dir"], exist_ok=True)
+    download_file(state["session"], payload["url"], dest, payload.get("size"), payload.get("md5"),
+                  limiter=state["limiter"])
+    return {**payload, "img": dest, "source": dest}
+
+
+def run_label(payload, cfg, state):
+    from labels import extract_label_one
+    os.makedirs(cfg["metadata_dir"], exist_ok=True)
+    extract_label_one(payload["img"], cfg["metadata_dir"], _build_cache(cfg, state))
+    return payload
+
+
+def run_convert(payload, cfg, state):
+    from tif_convert import convert_one, gdal_threads
+    os.makedirs(cfg["processed_dir"], exist_ok=True)
+    tif = convert_one(payload["img"], cfg["processed_dir"], _build_cache(cfg, state), cfg["tif_mode"],
+                      cfg["tif_compress"], gdal_threads(cfg["convert_workers"]))
+    if not cfg["keep_raw"]:
+        os.remove(payload["img"])
+    return {**payload, "source": tif}
+
+
+def run_tile(payload, cfg, state):
+    from pyramid_tiles import tile_one
+    os.makedirs(cfg["web_tiles_dir"], exist_ok=True)
+    out = tile_one(payload["source"], cfg["web_tiles_dir"], cfg["tile_size"], 1, _build_cache(cfg, state),
+                   cfg["tile_format"])
+    if out is None:
+        raise IOError(f"tiling {payload['source']} failed")
+    return {**payload, "tiles": out}
+
+
+HANDLERS = {"download": run_download, "label": run_label, "convert": run_convert, "tile": run_tile}
+
+
+# ----------------------------
+# Workers
+# ----------------------------
+def _heartbeat(queue, job, stop, lost):
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.heartbeat(job):
+            lost.set()
+            return
+
+
+def run_worker(queue, cfg, handlers=None, stages=None, chain=None, idle_exit=True, max_jobs=None):
+    """
+    Claim and run jobs until the queue has nothing left for this worker (idle_exit) or
+    max_jobs have run. Returns the number of jobs completed.
+    """
+    handlers = handlers or HANDLERS
+    chain = chain or stage_chain(cfg["convert_to_tif"])
+    owner = worker_id()
+    state = {"queue": queue}
+    done = 0
+    while max_jobs is None or done < max_jobs:
+        job = queue.claim(owner, stages or list(handlers))
+        if job is None:
+            due = queue.next_due()
+            if due is None and idle_exit:
+                break
+            # Other workers' jobs may enqueue follow-up stages at any time, so never sleep long
+            time.sleep(min(POLL_INTERVAL, due if due else POLL_INTERVAL) or 0.01)
+            continue
+        stop, lost = threading.Event(), threading.Event()
+        beat = threading.Thread(target=_heartbeat, args=(queue, job, stop, lost), daemon=True)
+        beat.start()
+        try:
+            with track("queue/" + job.stage, job.product, attempt=job.attempts):
+                result = handlers[job.stage](job.payload, cfg, state)
+        except Exception as e:
+            stop.set()
+            error = f"{type(e).__name__}: {e}"
+            if queue.fail(job, error):
+                print(f"💀 {job.stage} {job.product} dead-lettered after {job.attempts} attempts: {error}")
+            else:
+                print(f"{job.stage} {job.product} failed (attempt {job.attempts}), will retry: {error}")
+            if not isinstance(e, (IOError, ValueError)):
+                traceback.print_exc()
+            continue
+        finally:
+            stop.set()
+            beat.join()
+        if lost.is_set():
+            print(f"Lost the lease on {job}; another worker owns it now")
+            continue
+        index = chain.index(job.stage) if job.stage in chain else len(chain) - 1
+        next_stage = chain[index + 1] if index + 1 < len(chain) else None
+        queue.complete(job, next_stage, result, priority=index + 1)
+        done += 1
+    return done
+
+
+def _worker_main(queue, cfg, handlers, stages, chain, idle_exit, result):
+    result.put(run_worker(queue, cfg, handlers, stages, chain, idle_exit))
+
+
+def run_workers(queue, cfg, processes=2, handlers=None, stages=None, chain=None, idle_exit=True):
+    """Run `processes` local worker processes against the queue; returns total jobs completed."""
+    result = mp.Queue()
+    procs = [mp.Process(target=_worker_main, args=(queue, cfg, handlers, stages, chain, idle_exit, result))
+             for _ in range(processes)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    total = sum(result.get() for _ in procs)
+    for p in procs:
+        p.join()
+    elapsed = time.perf_counter() - start
+    print(f"{processes} workers completed {total} jobs in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.2f} jobs/s)")
+    return total
+
+
+def enqueue_volume(queue, links, sizes=None, checksums=None):
+    """Queue a download job per .IMG link (with its index size and md5 when known). Returns how many were new."""
+    sizes = sizes or {}
+    checksums = checksums or {}
+    jobs = []
+    for link in links:
+        name = os.path.basename(link)
+        if name.upper().endswith(".IMG"):
+            jobs.append((os.path.splitext(name)[0], {"url": link, "size": sizes.get(name.upper()),
+                                                     "md5": checksums.get(name.upper())}))
+    return queue.enqueue_many(jobs, "download")
+
+
+def print_status(queue):
+    counts = queue.counts()
+    for stage, states in counts.items():
+        print(f"{stage:10s} " + "  ".join(f"{state} {n}" for state, n in sorted(states.items())))
+    dead = queue.dead_letters()
+    for d in dead[-10:]:
+        print(f"dead: {d['stage']} {d['product']} ({d['attempts']} attempts): {d['error']}")
+    if not counts:
+        print("Queue is empty.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Shared per-product job queue for the ingest stages")
+    parser.add_argument("--db", default=QUEUE_DB)
+    parser.add_argument("--shared", action="store_true", help="queue lives on a network filesystem (no WAL)")
+    sub = parser.add_subparsers(dest="cmd", required=True)
+    e = sub.add_parser("enqueue", help="queue every product of the configured volume")
+    e.add_argument("volumes", nargs="*", help="volume URLs (default: the configured volume)")
+    w = sub.add_parser("work", help="run worker processes on this host")
+    w.add_argument("-p", "--processes", type=int, default=2)
+    w.add_argument("--stages", nargs="+", choices=list(HANDLERS), help="only claim these stages")
+    w.add_argument("--forever", action="store_true", help="keep polling when the queue is drained")
+    sub.add_parser("status")
+    r = sub.add_parser("retry-dead", help="give dead-lettered jobs another round of attempts")
+    r.add_argument("--stage")
+    args = parser.parse_args()
+
+    queue = JobQueue(args.db, shared=args.shared)
+    if args.cmd == "enqueue":
+        from crawler import crawl_volumes, CRAWL_DB
+        from downloader import fetch_checksums
+        links, sizes = crawl_volumes(args.volumes or [CONFIG["volume_url"]], CRAWL_DB)
+        checksums = {}
+        if CONFIG["md5_manifest"] != "":
+            for url in args.volumes or [CONFIG["volume_url"]]:
+                checksums.update(fetch_checksums(url, CONFIG["md5_manifest"]))
+        print(f"✅ {enqueue_volume(queue, links, sizes, checksums)} new products queued in {args.db}")
+    elif args.cmd == "work":
+        run_workers(queue, CONFIG, args.processes, stages=args.stages, idle_exit=not args.forever)
+    elif args.cmd == "retry-dead":
+        print(f"Requeued {queue.retry_dead(args.stage)} jobs")
+    else:
+        print_status(queue)
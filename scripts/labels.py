@@ -0,0 +1,70 @@
+import os
+import json
+from pds_label import read_label, find_key, image_offset, to_jsonable
+from catalog import footprint_from_label
+from metrics import track
+
+# ----------------------------
+# Label extraction
+# ----------------------------
+# Pure-Python (pds_label) metadata extraction: no raster backends are imported,
+# so the label stage and the `label` command start instantly.
+
+LABEL_KEYS = ["PRODUCT_ID", "IMAGE", "LINES", "LINE_SAMPLES", "SAMPLE_TYPE", "SAMPLE_BITS",
+              "START_TIME", "STOP_TIME", "SPACECRAFT_NAME", "INSTRUMENT_NAME",
+              "MISSION_PHASE_NAME", "TARGET_NAME"]
+
+
+def extract_label_one(img_path, metadata_dir, cache=None):
+    """Extract the embedded label of one .IMG, write its JSON and return the metadata dict."""
+    fname = os.path.basename(img_path)
+    json_path = os.path.join(metadata_dir, fname.replace(".IMG", ".json"))
+    params = {"keys": LABEL_KEYS, "parser": "pds_label", "footprint": True}
+    if cache and cache.is_fresh("label", img_path, params, [json_path]):
+        with open(json_path) as jf:
+            return json.load(jf)
+
+    with track("label", fname):
+        label = read_label(img_path)
+
+        metadata = {}
+        for key in LABEL_KEYS:
+            value = label.get("^IMAGE") if key == "IMAGE" else find_key(label, key)
+            if value is not None:
+                metadata[key] = to_jsonable(value)
+        if "^IMAGE" in label:
+            metadata["IMAGE_OFFSET"] = image_offset(label)[1]
+        metadata["FILE_NAME"] = fname
+        # Kept with the metadata so the catalog can be built after the raw file is deleted
+        footprint = footprint_from_label(label, fname)
+        if footprint:
+            metadata["FOOTPRINT"] = footprint
+
+        with open(json_path, "w") as jf:
+            json.dump(metadata, jf, indent=4)
+    if cache:
+        cache.record("label", img_path, params, [json_path], digest=False)
+    return metadata
+
+
+def write_combined_metadata(metadata_list, metadata_dir):
+    combined_path = os.path.join(metadata_dir, "combined_metadata.json")
+    with open(combined_path, "w") as cf:
+        json.dump(metadata_list, cf, indent=4)
+
+
+def extract_lbl_from_img(raw_dir, metadata_dir, cache=None):
+    os.makedirs(metadata_dir, exist_ok=True)
+    metadata_list = []
+
+    for fname in os.listdir(raw_dir):
+        if not fname.upper().endswith(".IMG"):
+            continue
+        try:
+            metadata_list.append(extract_label_one(os.path.join(raw_dir, fname), metadata_dir, cache))
+        except Exception as e:
+            print(f"Failed to extract metadata from {fname}: {e}")
+
+    write_combined_metadata(metadata_list, metadata_dir)
+    print(f"✅ Metadata extracted for {len(metadata_list)} images.")
+
@@ -1,18 +1,25 @@
 import os
 import json
-import numpy as np
 import rasterio
-from rasterio.merge import merge
-from rasterio.transform import from_origin
+from mosaic import footprints_for, mosaic_to_file, load_manifest, changed_bounds, update_mosaic, mark_tiled, \
+    tiles_current
+from pyramid_tiles import tile_pyramid, update_pyramid, shift_pyramid
+from catalog import Catalog
+from config import load_config
 
 # ----------------------------
 # User Config
 # ----------------------------
-PROCESSED_DIR = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\processed\ctx_mrox_3886"
-METADATA_DIR = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\metadata\ctx_mrox_3886"
-OUTPUT_PATH = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\merged\ctx_mrox_3886_basemap.tif"
-
-os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+CONFIG = load_config()
+PROCESSED_DIR = CONFIG["processed_dir"]
+PROJECTED_DIR = CONFIG["projected_dir"]  # map-projected products from reproject.py, used when present
+METADATA_DIR = CONFIG["metadata_dir"]
+OUTPUT_PATH = CONFIG["merged_path"]
+TILES_PATH = CONFIG["basemap_tiles"]  # tile pyramid of the basemap, "" = none
+TILE_SIZE = CONFIG["tile_size"]
+FULL_REBUILD = False  # True = ignore the previous basemap and merge/tile everything again
+CATALOG_DB = None  # footprint catalog from catalog.py; with BBOX, only covering products are merged
+BBOX = None  # (min_lon, min_lat, max_lon, max_lat), east-positive degrees
 
 # ----------------------------
 # Helper Functions
@@ -29,25 +36,62 @@ def load_metadata(metadata_dir):
             metadata[img_name] = data
     return metadata
 
+def needs_flip(src):
+    """
+    Unprojected rasters with a negative pixel height come out upside down and are mirrored
+    when merged. Map-projected rasters are north-up by construction and never flipped.
+    """
+    return src.crs is None and src.transform.e < 0
+
 def open_rasters(processed_dir, metadata):
-    """Open raster files and fix upside-down images"""
-    src_files = []
-    for fname in sorted(os.listdir(processed_dir)):
-        if fname.lower().endswith(".tif") and fname in metadata:
-            path = os.path.join(processed_dir, fname)
-            src = rasterio.open(path)
-            # Fix negative pixel height if needed
-            if src.transform.e < 0:  # upside down
-                print(f"[FIX] Flipping {fname}")
-                arr = src.read(1)[::-1, :]
-                profile = src.profile.copy()
-                profile['transform'] = from_origin(0, 0, 1, 1)  # dummy transform
-                fixed_path = os.path.join(processed_dir, fname.replace(".tif", "_fixed.tif"))
-                with rasterio.open(fixed_path, 'w', **profile) as dst:
-                    dst.write(arr, 1)
-                src = rasterio.open(fixed_path)
-            src_files.append(src)
-    return src_files
+    """
+    Paths of the rasters to merge. Nothing is opened here: the mosaic reads headers
+    one at a time and keeps a bounded number of files open while compositing, and
+    upside-down rasters are flipped per block instead of rewritten as _fixed.tif.
+    """
+    return [os.path.join(processed_dir, fname) for fname in sorted(os.listdir(processed_dir))
+            if fname.lower().endswith(".tif") and fname in metadata]
+
+def _grid(path):
+    with rasterio.open(path) as src:
+        return src.transform, src.width, src.height
+
+def update_basemap(footprints, crs, output_path, tiles_path=None, tile_size=256, full=False):
+    """
+    Bring the basemap and its tile pyramid up to date with `footprints`. Only the blocks and
+    tiles under products added, changed or removed since the last run are redone, also when
+    a product grows the mosaic grid (the pyramid is shifted, see shift_pyramid); everything
+    is rebuilt when there is no previous basemap, resolution or CRS changed or full=True.
+    """
+    manifest = None if full else load_manifest(output_path)
+    # A pyramid built from an older manifest generation missed earlier updates and cannot be patched
+    tiles_stale = bool(tiles_path) and manifest is not None and not tiles_current(output_path, tiles_path)
+    dirty = None
+    rebuild_below = None
+    if manifest is not None:
+        bounds = changed_bounds(footprints, manifest)
+        old_grid = _grid(output_path)
+        dirty = update_mosaic(footprints, output_path, bounds, crs=crs) if bounds else []
+        if dirty is None:
+            print("Mosaic resolution or CRS changed, merging everything again.")
+        elif not bounds:
+            print("Basemap already up to date.")
+        else:
+            new_grid = _grid(output_path)
+            if new_grid != old_grid and tiles_path and not tiles_stale:
+                (old_t, ow, oh), (new_t, nw, nh) = old_grid, new_grid
+                offset = (round((old_t.c - new_t.c) / new_t.a), round((new_t.f - old_t.f) / -new_t.e))
+                rebuild_below = shift_pyramid(tiles_path, (ow, oh), (nw, nh), offset, tile_size)
+                tiles_stale = rebuild_below is None
+    if dirty is None:
+        mosaic_to_file(footprints, output_path, crs=crs, compress="lzw")
+    if not tiles_path:
+        return
+    if dirty is None or tiles_stale:
+        tile_pyramid(output_path, tiles_path, tile_size)
+    elif dirty or rebuild_below is not None:
+        update_pyramid(output_path, tiles_path, dirty, tile_size, rebuild_below=rebuild_below)
+    mark_tiled(output_path, tiles_path)
 
 # ----------------------------
 # Main Workflow
@@ -57,44 +101,26 @@ if __name__ == "__main__":
     metadata = load_metadata(METADATA_DIR)
     print(f"Loaded metadata for {len(metadata)} images.")
 
-    print("2️⃣ Opening rasters...")
-    src_files_to_mosaic = open_rasters(PROCESSED_DIR, metadata)
-    print(f"✅ {len(src_files_to_mosaic)} TIFFs ready for merging.")
-
-    print("3️⃣ Merging rasters...")
-    try:
-        # We pass method='first' to handle overlaps
-        mosaic, out_trans = merge(src_files_to_mosaic, method='first')
-    except Exception as e:
-        print("⚠️ Merge failed:", e)
-        print("Attempting manual stacking for visualization...")
+    if CATALOG_DB and BBOX:
+        catalog = Catalog(CATALOG_DB)
+        wanted = {r["file_name"].replace(".IMG", ".tif") for r in catalog.query(BBOX) if r["file_name"]}
+        catalog.close()
+        metadata = {k: v for k, v in metadata.items() if k in wanted}
+        print(f"Catalog: {len(metadata)} images cover {BBOX}.")
 
-        # Manual stacking fallback: create canvas large enough for all images
-        # Approximate layout based on image order
-        widths = [src.width for src in src_files_to_mosaic]
-        heights = [src.height for src in src_files_to_mosaic]
-        total_width = sum(widths)
-        max_height = max(heights)
+    print("2️⃣ Collecting rasters...")
+    paths = open_rasters(PROJECTED_DIR, metadata) if os.path.isdir(PROJECTED_DIR) else []
+    if not paths:
+        paths = open_rasters(PROCESSED_DIR, metadata)
+    print(f"✅ {len(paths)} TIFFs ready for merging.")
 
-        mosaic = np.zeros((max_height, total_width), dtype=src_files_to_mosaic[0].read(1).dtype)
-        current_x = 0
-        for src in src_files_to_mosaic:
-            arr = src.read(1)
-            mosaic[0:arr.shape[0], current_x:current_x+arr.shape[1]] = arr
-            current_x += arr.shape[1]
-        out_trans = from_origin(0, 0, 1, 1)
+    print("3️⃣ Merging rasters block by block...")
+    # Real mosaic when every raster is georeferenced, side-by-side stacking otherwise
+    footprints, crs = footprints_for(paths, layout="auto", flip=needs_flip)
+    print(f"{sum(fp.flip for fp in footprints)} rasters flipped on the fly.")
 
     print(f"4️⃣ Writing merged basemap to {OUTPUT_PATH}...")
-    profile = src_files_to_mosaic[0].profile.copy()
-    profile.update({
-        "height": mosaic.shape[0],
-        "width": mosaic.shape[1],
-        "transform": out_trans,
-        "driver": "GTiff",
-        "compress": "lzw"
-    })
-
-    with rasterio.open(OUTPUT_PATH, 'w', **profile) as dst:
-        dst.write(mosaic, 1)
+    os.makedirs(os.path.dirname(os.path.abspath(OUTPUT_PATH)), exist_ok=True)
+    update_basemap(footprints, crs, OUTPUT_PATH, TILES_PATH, TILE_SIZE, full=FULL_REBUILD)
 
     print("✅ Basemap merge complete!")
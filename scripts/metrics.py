@@ -0,0 +1,181 @@
+import os
+import json
+import time
+import cProfile
+import itertools
+import threading
+from contextlib import contextmanager
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# ----------------------------
+# Stage instrumentation
+# ----------------------------
+# `track(stage, item)` times one unit of work (a download, a conversion, a
+# pyramid...) and records seconds, bytes in/out and any extra fields both in an
+# in-process registry and, when configured, as one JSON line per item. The
+# registry is exported in Prometheus text format (serve_metrics / /metrics).
+# Stages listed in CTX_PROFILE_STAGES are also run under cProfile, one .prof
+# file per item. Settings live in environment variables so that process-pool
+# workers pick them up; the Prometheus view only covers the serving process,
+# the JSON lines cover every worker.
+
+ENV_JSONL = "CTX_METRICS_FILE"
+ENV_PROFILE_DIR = "CTX_PROFILE_DIR"
+ENV_PROFILE_STAGES = "CTX_PROFILE_STAGES"
+PREFIX = "ctx"
+
+
+class Registry:
+    """Counters, gauges and (count, sum, max) summaries keyed by name and labels."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.summaries = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted(labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[self._key(name, labels)] = value
+
+    def observe(self, name, value, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            count, total, peak = self.summaries.get(key, (0, 0.0, 0.0))
+            self.summaries[key] = (count + 1, total + value, max(peak, value))
+
+    def prometheus(self):
+        def fmt(name, labels, value):
+            lbl = ",".join(f'{k}="{v}"' for k, v in labels)
+            return f"{PREFIX}_{name}{{{lbl}}} {value}" if lbl else f"{PREFIX}_{name} {value}"
+
+        lines = []
+        with self.lock:
+            for (name, labels), v in sorted(self.counters.items()):
+                lines.append(fmt(name, labels, v))
+            for (name, labels), v in sorted(self.gauges.items()):
+                lines.append(fmt(name, labels, v))
+            for (name, labels), (count, total, peak) in sorted(self.summaries.items()):
+                lines += [fmt(name + "_count", labels, count), fmt(name + "_sum", labels, f"{total:.6f}"),
+                          fmt(name + "_max", labels, f"{peak:.6f}")]
+        return "\n".join(lines) + "\n"
+
+    def report(self):
+        """Human-readable per-stage totals."""
+        rows = []
+        with self.lock:
+            for (name, labels), (count, total, peak) in sorted(self.summaries.items()):
+                if name != "stage_seconds":
+                    continue
+                stage = dict(labels)["stage"]
+                mb_in = self.counters.get(("stage_bytes_in_total", labels), 0) / 1e6
+                rows.append(f"{stage:20s} {count:6d} items {total:9.1f}s  mean {total / count:7.3f}s  "
+                            f"max {peak:7.2f}s  {mb_in:9.1f} MB in")
+            for (name, labels), v in sorted(self.counters.items()):
+                if name == "cache_lookups_total":
+                    rows.append(f"cache {dict(labels)['stage']:14s} {dict(labels)['result']:5s} {v}")
+        return "\n".join(rows)
+
+
+METRICS = Registry()
+_jsonl_lock = threading.Lock()
+_profile_seq = itertools.count(1)  # next() is atomic under the GIL
+
+
+def configure(jsonl_path=None, profile_dir=None, profile_stages=None):
+    """Set the JSON-lines file / cProfile output (inherited by worker processes through the environment)."""
+    if jsonl_path:
+        os.makedirs(os.path.dirname(os.path.abspath(jsonl_path)), exist_ok=True)
+        os.environ[ENV_JSONL] = jsonl_path
+    if profile_dir:
+        os.makedirs(profile_dir, exist_ok=True)
+        os.environ[ENV_PROFILE_DIR] = profile_dir
+    if profile_stages:
+        os.environ[ENV_PROFILE_STAGES] = ",".join(profile_stages)
+
+
+def emit(record):
+    """Append one record to the JSON-lines file, if configured."""
+    path = os.environ.get(ENV_JSONL)
+    if not path:
+        return
+    line = json.dumps(record, default=str) + "\n"
+    with _jsonl_lock:
+        with open(path, "a") as f:
+            f.write(line)
+
+
+def _profiling(stage):
+    stages = os.environ.get(ENV_PROFILE_STAGES, "")
+    return stage in stages.split(",") or stages == "*"
+
+
+@contextmanager
+def track(stage, item=None, bytes_in=None, **extra):
+    """
+    Time one unit of work. The yielded dict may be filled in by the caller
+    (bytes_out, tiles, read_s, ...) and ends up in the JSON line.
+    """
+    rec = {"stage": stage, "item": item, "bytes_in": bytes_in, **extra}
+    profiler = None
+    if _profiling(stage):
+        profiler = cProfile.Profile()
+        profiler.enable()
+    start = time.perf_counter()
+    ok = False
+    try:
+        yield rec
+        ok = True
+    finally:
+        seconds = time.perf_counter() - start
+        if profiler:
+            profiler.disable()
+            out_dir = os.environ.get(ENV_PROFILE_DIR) or "."
+            profiler.dump_stats(os.path.join(out_dir, f"{stage}-{os.getpid()}-{next(_profile_seq)}.prof"))
+        METRICS.observe("stage_seconds", seconds, stage=stage)
+        METRICS.inc("stage_items_total", stage=stage, status="ok" if ok else "error")
+        if rec.get("bytes_in"):
+            METRICS.inc("stage_bytes_in_total", rec["bytes_in"], stage=stage)
+        if rec.get("bytes_out"):
+            METRICS.inc("stage_bytes_out_total", rec["bytes_out"], stage=stage)
+        emit({"ts": time.time(), "pid": os.getpid(), "thread": threading.current_thread().name,
+              **rec, "seconds": round(seconds, 6), "ok": ok})
+
+
+def file_size(path):
+    try:
+        return os.path.getsize(path)
+    except OSError:
+        return None
+
+
+def serve_metrics(port, host="127.0.0.1"):
+    """Serve METRICS at http://host:port/metrics from a daemon thread. Returns the server."""
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body = METRICS.prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
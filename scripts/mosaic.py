@@ -0,0 +1,432 @@
+import os
+import json
+import math
+import time
+from collections import OrderedDict
+import numpy as np
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.transform import from_origin
+from rasterio.windows import Window, from_bounds, bounds as window_bounds
+from metrics import track, file_size
+
+# ----------------------------
+# Streaming mosaic engine
+# ----------------------------
+# The output GeoTIFF is written block by block. For each block only the sources
+# whose footprint overlaps it (looked up in a grid index) are opened and only the
+# overlapping window of each is read, so memory is one block plus one source
+# window and the number of open files is capped. Sources that must be
+# flipped vertically are flipped per window as they are read, never copied.
+#
+# Next to the output, <name>.sources.json records every source (size, mtime,
+# footprint). update_mosaic() diffs the current sources against it and
+# recomposites in place only the blocks under products that were added,
+# changed or removed, so adding one product costs about that product's area.
+#
+# The output grid is snapped outward to a lattice of GRID_SNAP pixels anchored
+# at the CRS origin, and blocks the sources never touch are left unwritten
+# (sparse). A product outside the current grid grows it on the same lattice,
+# by at least half its size on each side that overflows: the old raster is
+# copied block for block into the larger one and nothing is re-composited, so
+# a growing mosaic is copied a logarithmic number of times, and tile pyramids
+# built on it can be shifted by whole tiles instead of re-rendered.
+
+BLOCK_SIZE = 1024
+MAX_OPEN = 64
+GRID_SNAP = 4096  # pixels; a multiple of BLOCK_SIZE and of the tile size times a power of two
+
+
+class Footprint:
+    """
+    Where one source lands in the output: its path, transform, bounds and nodata.
+    flip=True places the source upside down (row 0 of the file is the bottom row of the footprint).
+    """
+
+    def __init__(self, path, transform, width, height, nodata=None, flip=False):
+        self.path = path
+        self.transform = transform
+        self.width = width
+        self.height = height
+        self.nodata = nodata
+        self.flip = flip
+        left, top = transform * (0, 0)
+        right, bottom = transform * (width, height)
+        self.bounds = (min(left, right), min(top, bottom), max(left, right), max(top, bottom))
+
+
+class FootprintIndex:
+    """Uniform grid of buckets over the mosaic extent; query returns footprints in insertion order."""
+
+    def __init__(self, footprints, cell_size):
+        self.footprints = list(footprints)
+        self.cell = cell_size
+        self.buckets = {}
+        for i, fp in enumerate(self.footprints):
+            for key in self._cells(fp.bounds):
+                self.buckets.setdefault(key, []).append(i)
+
+    def _cells(self, b):
+        x0, y0 = math.floor(b[0] / self.cell), math.floor(b[1] / self.cell)
+        x1, y1 = math.floor(b[2] / self.cell), math.floor(b[3] / self.cell)
+        for cx in range(x0, x1 + 1):
+            for cy in range(y0, y1 + 1):
+                yield cx, cy
+
+    def query(self, b):
+        hits = set()
+        for key in self._cells(b):
+            hits.update(self.buckets.get(key, ()))
+        return [self.footprints[i] for i in sorted(hits)
+                if self.footprints[i].bounds[0] < b[2] and self.footprints[i].bounds[2] > b[0]
+                and self.footprints[i].bounds[1] < b[3] and self.footprints[i].bounds[3] > b[1]]
+
+
+class DatasetCache:
+    """Keeps at most `max_open` rasters open, closing the least recently used."""
+
+    def __init__(self, max_open=MAX_OPEN):
+        self.max_open = max_open
+        self.open = OrderedDict()
+
+    def get(self, path):
+        if path in self.open:
+            self.open.move_to_end(path)
+            return self.open[path]
+        if len(self.open) >= self.max_open:
+            _, old = self.open.popitem(last=False)
+            old.close()
+        src = rasterio.open(path)
+        self.open[path] = src
+        return src
+
+    def close(self):
+        for src in self.open.values():
+            src.close()
+        self.open.clear()
+
+
+def _is_georeferenced(src):
+    return src.crs is not None and not src.transform.is_identity
+
+
+def footprints_for(paths, layout="auto", flip=None):
+    """
+    Read only the headers of `paths` and place them.
+    layout="geo" uses each raster's transform; "stack" lays them side by side in pixel space
+    (the old fallback for unprojected EDR rasters); "auto" picks geo when every raster has a CRS.
+    flip(src) -> bool marks rasters to be mirrored vertically while compositing.
+    Returns (footprints, crs).
+    """
+    headers, flips = [], []
+    for path in paths:
+        with rasterio.open(path) as src:
+            headers.append((path, src.transform, src.width, src.height, src.nodata,
+                            _is_georeferenced(src), src.crs))
+            flips.append(bool(flip and flip(src)))
+    if layout == "auto":
+        crs_set = {h[6].to_string() for h in headers if h[6] is not None}
+        layout = "geo" if all(h[5] for h in headers) and len(crs_set) == 1 else "stack"
+
+    footprints = []
+    if layout == "geo":
+        for (path, transform, w, h, nodata, _, _), flipped in zip(headers, flips):
+            footprints.append(Footprint(path, transform, w, h, nodata, flipped))
+        return footprints, headers[0][6]
+
+    x = 0
+    for (path, _, w, h, nodata, _, _), flipped in zip(headers, flips):
+        footprints.append(Footprint(path, from_origin(x, 0, 1, 1), w, h, nodata, flipped))
+        x += w
+    return footprints, None
+
+
+def on_lattice(transform, width, height, snap=GRID_SNAP):
+    """True if a grid's origin and size are whole multiples of `snap` pixels from the CRS origin."""
+    def whole(v):
+        return abs(v - round(v)) < 1e-6
+    return (whole(transform.c / (snap * transform.a)) and whole(transform.f / (snap * -transform.e))
+            and width % snap == 0 and height % snap == 0)
+
+
+def mosaic_grid(footprints, snap=GRID_SNAP, base=None):
+    """
+    (transform, width, height) of the output: the union of the footprints at the finest resolution,
+    snapped outward to the `snap`-pixel lattice (snap=0: exactly the union). `base` is an earlier
+    grid on the same lattice: it is kept while it covers the footprints, else grown past them.
+    """
+    res_x = min(abs(fp.transform.a) for fp in footprints)
+    res_y = min(abs(fp.transform.e) for fp in footprints)
+    left = min(fp.bounds[0] for fp in footprints)
+    bottom = min(fp.bounds[1] for fp in footprints)
+    right = max(fp.bounds[2] for fp in footprints)
+    top = max(fp.bounds[3] for fp in footprints)
+    if not snap:
+        width = int(math.ceil((right - left) / res_x))
+        height = int(math.ceil((top - bottom) / res_y))
+        return from_origin(left, top, res_x, res_y), width, height
+
+    sx, sy = snap * res_x, snap * res_y
+    eps = 1e-9
+    left, right = math.floor(left / sx + eps) * sx, math.ceil(right / sx - eps) * sx
+    bottom, top = math.floor(bottom / sy + eps) * sy, math.ceil(top / sy - eps) * sy
+    if base is not None:
+        b_transform, b_width, b_height = base
+        b_left, b_top = b_transform.c, b_transform.f
+        b_right, b_bottom = b_left + b_width * res_x, b_top - b_height * res_y
+        # Grow by at least half the old size per overflowing side (amortised copying)
+        grow_x = math.ceil(b_width / 2 / snap) * sx
+        grow_y = math.ceil(b_height / 2 / snap) * sy
+        left = min(left, b_left - grow_x) if left < b_left - eps * sx else b_left
+        right = max(right, b_right + grow_x) if right > b_right + eps * sx else b_right
+        bottom = min(bottom, b_bottom - grow_y) if bottom < b_bottom - eps * sy else b_bottom
+        top = max(top, b_top + grow_y) if top > b_top + eps * sy else b_top
+    width = int(round((right - left) / sx)) * snap
+    height = int(round((top - bottom) / sy)) * snap
+    return from_origin(left, top, res_x, res_y), width, height
+
+
+def mosaic_to_file(footprints, output_path, crs=None, block_size=BLOCK_SIZE, max_open=MAX_OPEN,
+                   nodata=None, compress="lzw", dtype=None, snap=GRID_SNAP):
+    """
+    Composite `footprints` (first source wins where they overlap) into a tiled GeoTIFF on the
+    `snap` lattice (see mosaic_grid), one output block at a time. Returns the output transform.
+    """
+    if not footprints:
+        raise ValueError("nothing to mosaic")
+    out_transform, width, height = mosaic_grid(footprints, snap)
+    res_x, res_y = out_transform.a, -out_transform.e
+
+    index = FootprintIndex(footprints, cell_size=block_size * max(res_x, res_y))
+    datasets = DatasetCache(max_open)
+    first = datasets.get(footprints[0].path)
+    dtype = dtype or first.dtypes[0]
+    if nodata is None:
+        nodata = first.nodata if first.nodata is not None else 0
+
+    profile = {
+        "driver": "GTiff", "height": height, "width": width, "count": 1, "dtype": dtype,
+        "crs": crs, "transform": out_transform, "nodata": nodata, "compress": compress,
+        "tiled": True, "blockxsize": block_size, "blockysize": block_size, "BIGTIFF": "IF_SAFER",
+        "sparse_ok": True,  # blocks no source covers are never written
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+    start = time.perf_counter()
+    blocks = 0
+    read_s = 0.0
+    try:
+        with track("merge", os.path.basename(output_path), sources=len(footprints)) as rec:
+            with rasterio.open(output_path, "w", **profile) as dst:
+                for row in range(0, height, block_size):
+                    for col in range(0, width, block_size):
+                        win = Window(col, row, min(block_size, width - col), min(block_size, height - row))
+                        t = time.perf_counter()
+                        block = composite_block(win, out_transform, index, datasets, dtype, nodata)
+                        read_s += time.perf_counter() - t
+                        if block is not None:
+                            dst.write(block, 1, window=win)
+                        blocks += 1
+            # read_s covers opening sources, reading and compositing; the rest is compression/writes
+            rec.update(blocks=blocks, read_s=round(read_s, 6), width=width, height=height,
+                       bytes_out=file_size(output_path))
+    finally:
+        datasets.close()
+    save_manifest(output_path, footprints)
+    print(f"Mosaicked {len(footprints)} rasters into {width}x{height} "
+          f"({blocks} blocks) in {time.perf_counter() - start:.1f}s")
+    return out_transform
+
+
+def composite_block(win, out_transform, index, datasets, dtype, nodata):
+    """Build one output block from the overlapping sources, or None if nothing covers it."""
+    bl, bb, br, bt = window_bounds(win, out_transform)
+    hits = index.query((bl, bb, br, bt))
+    if not hits:
+        return None
+    out = np.full((int(win.height), int(win.width)), nodata, dtype=dtype)
+    filled = np.zeros(out.shape, dtype=bool)
+    for fp in hits:
+        il, ib = max(bl, fp.bounds[0]), max(bb, fp.bounds[1])
+        ir, it = min(br, fp.bounds[2]), min(bt, fp.bounds[3])
+        # Output pixels covered by this source, snapped to the output grid
+        sub = from_bounds(il, ib, ir, it, out_transform)
+        c0 = max(int(round(sub.col_off)) - int(win.col_off), 0)
+        r0 = max(int(round(sub.row_off)) - int(win.row_off), 0)
+        c1 = min(int(round(sub.col_off + sub.width)) - int(win.col_off), out.shape[1])
+        r1 = min(int(round(sub.row_off + sub.height)) - int(win.row_off), out.shape[0])
+        if c1 <= c0 or r1 <= r0:
+            continue
+        target = Window(win.col_off + c0, win.row_off + r0, c1 - c0, r1 - r0)
+        src_win = from_bounds(*window_bounds(target, out_transform), fp.transform)
+        if fp.flip:
+            # Read the mirrored rows of the file and flip just this window
+            src_win = Window(src_win.col_off, fp.height - src_win.row_off - src_win.height,
+                             src_win.width, src_win.height)
+        src = datasets.get(fp.path)
+        data = src.read(1, window=src_win, out_shape=(r1 - r0, c1 - c0), resampling=Resampling.nearest)
+        if fp.flip:
+            data = data[::-1]
+        src_nodata = fp.nodata if fp.nodata is not None else nodata
+        take = ~filled[r0:r1, c0:c1] & (data != src_nodata)
+        out[r0:r1, c0:c1][take] = data[take]
+        filled[r0:r1, c0:c1] |= take
+        if filled.all():
+            break
+    return out
+
+
+# ----------------------------
+# Incremental updates
+# ----------------------------
+def manifest_path(output_path):
+    return os.path.splitext(output_path)[0] + ".sources.json"
+
+
+def _source_entry(fp):
+    st = os.stat(fp.path)
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "bounds": list(fp.bounds), "flip": fp.flip}
+
+
+def _read_manifest(output_path):
+    try:
+        with open(manifest_path(output_path)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_path, footprints):
+    """
+    Record the sources a mosaic was built from (in compositing order). Every save bumps the
+    manifest's generation; the generations tile pyramids were built from are kept (see mark_tiled).
+    """
+    record = _read_manifest(output_path)
+    sources = {os.path.abspath(fp.path): _source_entry(fp) for fp in footprints}
+    record.update(sources=sources, generation=record.get("generation", 0) + 1)
+    with open(manifest_path(output_path), "w") as f:
+        json.dump(record, f, indent=1)
+
+
+def load_manifest(output_path):
+    """Recorded sources of an existing mosaic, or None if there is no usable record."""
+    if not os.path.exists(output_path):
+        return None
+    return _read_manifest(output_path).get("sources")
+
+
+def mark_tiled(output_path, tiles_path):
+    """Record that tiles_path is now up to date with the mosaic's current manifest generation."""
+    record = _read_manifest(output_path)
+    record.setdefault("tiles", {})[os.path.abspath(tiles_path)] = record.get("generation", 0)
+    with open(manifest_path(output_path), "w") as f:
+        json.dump(record, f, indent=1)
+
+
+def tiles_current(output_path, tiles_path):
+    """True if tiles_path exists and was built from (or updated to) the mosaic's current generation."""
+    record = _read_manifest(output_path)
+    built = record.get("tiles", {}).get(os.path.abspath(tiles_path))
+    return os.path.exists(tiles_path) and built is not None and built == record.get("generation", 0)
+
+
+def changed_bounds(footprints, manifest):
+    """
+    Bounds of every source added, modified or moved since `manifest` was written (old and
+    new footprint for a modified one) and of every source that has been removed since.
+    """
+    dirty = []
+    seen = set()
+    for fp in footprints:
+        path = os.path.abspath(fp.path)
+        seen.add(path)
+        old = manifest.get(path)
+        entry = _source_entry(fp)
+        if old == entry:
+            continue
+        dirty.append(fp.bounds)
+        if old:
+            dirty.append(tuple(old["bounds"]))
+    dirty.extend(tuple(old["bounds"]) for path, old in manifest.items() if path not in seen)
+    return dirty
+
+
+def _pixel_rect(b, transform, width, height):
+    """Output pixels (col, row, w, h) touched by bounds `b`, one pixel of slack each side, clipped."""
+    win = from_bounds(*b, transform)
+    c0 = max(int(math.floor(win.col_off)) - 1, 0)
+    r0 = max(int(math.floor(win.row_off)) - 1, 0)
+    c1 = min(int(math.ceil(win.col_off + win.width)) + 1, width)
+    r1 = min(int(math.ceil(win.row_off + win.height)) + 1, height)
+    return (c0, r0, c1 - c0, r1 - r0) if c1 > c0 and r1 > r0 else None
+
+
+def _grow(output_path, transform, width, height):
+    """
+    Copy the mosaic into a larger grid on the same pixel lattice, block for block (all-nodata
+    blocks stay unwritten). Returns the (col, row) of the old raster in the new one.
+    """
+    tmp_path = output_path + ".part.tif"
+    start = time.perf_counter()
+    with rasterio.open(output_path) as src:
+        col0 = int(round((src.transform.c - transform.c) / transform.a))
+        row0 = int(round((transform.f - src.transform.f) / -transform.e))
+        nodata = src.nodata if src.nodata is not None else 0
+        profile = {**src.profile, "width": width, "height": height, "transform": transform,
+                   "BIGTIFF": "IF_SAFER", "sparse_ok": True}
+        with rasterio.open(tmp_path, "w", **profile) as dst:
+            for _, win in src.block_windows(1):
+                block = src.read(1, window=win)
+                if (block != nodata).any():
+                    dst.write(block, 1, window=Window(win.col_off + col0, win.row_off + row0,
+                                                      win.width, win.height))
+    os.replace(tmp_path, output_path)
+    print(f"Grew {os.path.basename(output_path)} to {width}x{height} (old raster at {col0},{row0}) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return col0, row0
+
+
+def update_mosaic(footprints, output_path, dirty_bounds, crs=None, max_open=MAX_OPEN, snap=GRID_SNAP):
+    """
+    Recomposite in place the blocks of an existing mosaic that intersect `dirty_bounds`
+    (see changed_bounds), with the same first-source-wins order as a full build. Sources
+    outside the grid grow it first (see _grow). Returns the changed pixel rectangles
+    [(col, row, w, h)] in the (possibly grown) grid, or None when the existing raster is not
+    on the lattice or resolution or CRS changed, and a full build is needed.
+    """
+    with rasterio.open(output_path) as src:
+        old = (src.transform, src.width, src.height)
+        same_crs = src.crs == crs or (src.crs is None and crs is None)
+    out_transform, width, height = mosaic_grid(footprints, snap, base=old)
+    if not same_crs or not snap or not on_lattice(*old, snap) or not (
+            math.isclose(out_transform.a, old[0].a) and math.isclose(out_transform.e, old[0].e)):
+        return None
+    if (width, height) != old[1:] or not out_transform.almost_equals(old[0]):
+        _grow(output_path, out_transform, width, height)
+
+    rects = [r for r in (_pixel_rect(b, out_transform, width, height) for b in dirty_bounds) if r]
+    res_x, res_y = out_transform.a, -out_transform.e
+    start = time.perf_counter()
+    datasets = DatasetCache(max_open)
+    try:
+        with track("merge_update", os.path.basename(output_path), sources=len(footprints)) as rec:
+            with rasterio.open(output_path, "r+") as dst:
+                bw, bh = dst.block_shapes[0][1], dst.block_shapes[0][0]
+                blocks = sorted({(bx, by) for c, r, w, h in rects
+                                 for by in range(r // bh, (r + h - 1) // bh + 1)
+                                 for bx in range(c // bw, (c + w - 1) // bw + 1)})
+                index = FootprintIndex(footprints, cell_size=max(bw, bh) * max(res_x, res_y))
+                dtype, nodata = dst.dtypes[0], dst.nodata if dst.nodata is not None else 0
+                for bx, by in blocks:
+                    win = Window(bx * bw, by * bh, min(bw, width - bx * bw), min(bh, height - by * bh))
+                    block = composite_block(win, out_transform, index, datasets, dtype, nodata)
+                    if block is None:
+                        # A removed product may have been the only one here
+                        block = np.full((int(win.height), int(win.width)), nodata, dtype=dtype)
+                    dst.write(block, 1, window=win)
+            rec.update(blocks=len(blocks), width=width, height=height, bytes_out=file_size(output_path))
+    finally:
+        datasets.close()
+    save_manifest(output_path, footprints)
+    print(f"Updated {len(blocks)} of {-(-width // bw) * -(-height // bh)} blocks of {output_path} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return rects
@@ -1,39 +1,26 @@
-import cv2
 import os
-import math
+import argparse
+from config import load_config
+from pyramid_tiles import tile_pyramid
 
-input_tif = r"C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/processed/ctx_mrox_4122/N20_070273_1355_XI_44S280W.tif"
-output_dir = r"C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/web_tiles/N20_070273_1355_XI_44S280W"
-tile_size = 256
-
-os.makedirs(output_dir, exist_ok=True)
-
-# Load image
-img = cv2.imread(input_tif, cv2.IMREAD_UNCHANGED)
-h, w = img.shape[:2]
+min_level = 0   # skip tiny base levels
 
-# Determine max pyramid level
-max_dim = max(h, w)
-max_level = math.ceil(math.log2(max_dim))
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate level_N/{x}_{y}.jpg pyramid tiles")
+    parser.add_argument("input_tif", help="a GeoTIFF or raw .IMG product")
+    parser.add_argument("output_dir", nargs="?", help="default: <web_tiles_dir>/<product> (.mbtiles = packed archive)")
+    parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+    parser.add_argument("--tile-size", type=int, help="default: tile_size setting")
+    parser.add_argument("--min-level", type=int, default=min_level)
+    parser.add_argument("--workers", type=int, help="processes encoding tiles (1 = encode in this process), "
+                                                    "default: tile_workers setting")
+    args = parser.parse_args()
+    cfg = load_config(args.config, tile_size=args.tile_size, tile_workers=args.workers)
+    output_dir = args.output_dir or os.path.join(cfg["web_tiles_dir"],
+                                                 os.path.splitext(os.path.basename(args.input_tif))[0])
 
-print(f"Image size: {w}x{h}, Pyramid levels: {max_level+1}")
+    # Stream the strip in row bands; each level is a 2x reduction of the one above
+    count = tile_pyramid(args.input_tif, output_dir, cfg["tile_size"],
+                         min_level=args.min_level, workers=cfg["tile_workers"])
 
-# Generate pyramid tiles
-min_level = 0   # skip tiny base levels
-for level in range(max_level, min_level - 1, -1):
-    scale = 2 ** (max_level - level)
-    new_w = math.ceil(w / scale)
-    new_h = math.ceil(h / scale)
-    
-    resized = cv2.resize(img, (new_w, new_h), interpolation=cv2.INTER_AREA)
-    
-    level_dir = os.path.join(output_dir, f"level_{level}")
-    os.makedirs(level_dir, exist_ok=True)
-    
-    for y in range(0, new_h, tile_size):
-        for x in range(0, new_w, tile_size):
-            tile = resized[y:y+tile_size, x:x+tile_size]
-            tile_name = f"{x}_{y}.jpg"
-            cv2.imwrite(os.path.join(level_dir, tile_name), tile)
-            
-print("✅ Pyramid tiles created.")
+    print(f"✅ Pyramid tiles created ({count} tiles).")
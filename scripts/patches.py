@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import argparse
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import rasterio
+from rasterio.crs import CRS
+from rasterio.warp import transform as warp_transform
+from pyramid_tiles import open_rows
+from pds_label import read_label
+from catalog import footprint_from_label, MARS_RADIUS_M
+from metrics import track, file_size
+from config import load_config
+
+# ----------------------------
+# ML training-patch export
+# ----------------------------
+# tile_tifs() writes one small GeoTIFF per tile, so a data loader pays a file
+# open and a header parse for every sample. Here fixed-size patches (with a
+# stride, so they may overlap) of every product go into one array store:
+#
+#   patches.npy   (N, size, size) array, opened with np.load(mmap_mode="r")
+#   index.npy     N records: product, col, row, lat, lon, valid (fraction)
+#   patches.json  patch size, stride, dtype and, per product, its name, source
+#                 dtype and the nodata value its valid fractions were counted with
+#
+# Patches with less than `min_valid` of their pixels valid are dropped. Each
+# product is read once, in row bands that slide down by the stride. A sample
+# is then a slice of a memory map: no open, no decode, no copy until the batch
+# is gathered, and every loader process shares the same page cache.
+#
+# lat/lon is the patch centre: from the raster's CRS for map-projected
+# products, else from the label corners (bilinear, like reproject.py).
+
+CONFIG = load_config()
+PATCHES_DIR = CONFIG["patches_dir"]
+PATCH_SIZE = CONFIG["patch_size"]
+MIN_VALID = CONFIG["patch_min_valid"]  # fraction of non-nodata pixels a patch needs to be kept
+NODATA = 0
+
+INDEX_DTYPE = np.dtype([("product", "<u4"), ("col", "<i4"), ("row", "<i4"),
+                        ("lat", "<f4"), ("lon", "<f4"), ("valid", "<f4")])
+_LONGLAT = f"+proj=longlat +R={MARS_RADIUS_M} +no_defs"
+
+
+def _label_for(path, label_dir):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    for ext in (".LBL", ".lbl", ".IMG", ".img"):
+        candidate = os.path.join(label_dir, stem + ext) if label_dir else None
+        if candidate and os.path.exists(candidate):
+            return candidate
+    return path if path.upper().endswith(".IMG") else None
+
+
+def _locator(path, width, height, label_dir=None):
+    """fn(cols, rows) -> (lats, lons) in degrees for pixel positions of `path`, or None if unknown."""
+    if not path.upper().endswith(".IMG"):
+        with rasterio.open(path) as src:
+            crs, transform = src.crs, src.transform
+        if crs is not None:
+            def locate(cols, rows):
+                xs, ys = transform * (np.asarray(cols, dtype=np.float64), np.asarray(rows, dtype=np.float64))
+                lons, lats = warp_transform(crs, CRS.from_proj4(_LONGLAT), xs, ys)
+                return np.asarray(lats), np.asarray(lons) % 360.0
+            return locate
+    label_path = _label_for(path, label_dir)
+    fp = footprint_from_label(read_label(label_path), os.path.basename(label_path)) if label_path else None
+    if fp is None:
+        return None
+    (lat00, lon00), (lat10, lon10), (lat11, lon11), (lat01, lon01) = fp["corners"]  # UL, UR, LR, LL
+    # Longitudes continuous around the first corner
+    lon10, lon11, lon01 = (lon00 + (lon - lon00 + 180.0) % 360.0 - 180.0 for lon in (lon10, lon11, lon01))
+
+    def locate(cols, rows):
+        u, v = np.asarray(cols) / width, np.asarray(rows) / height
+        lats = (lat00 * (1 - u) + lat10 * u) * (1 - v) + (lat01 * (1 - u) + lat11 * u) * v
+        lons = (lon00 * (1 - u) + lon10 * u) * (1 - v) + (lon01 * (1 - u) + lon11 * u) * v
+        return lats, lons % 360.0
+    return locate
+
+
+def _bands(read_rows, height, size, stride):
+    """Yield (row, band) for every patch row: size-row bands sliding down by `stride`, each source row read once."""
+    band = None
+    for row in range(0, height - size + 1, stride):
+        if band is None or stride >= size:
+            band = read_rows(row, size)
+        else:
+            band = np.concatenate([band[stride:], read_rows(row + size - stride, stride)])
+        yield row, band
+
+
+def _shrink_npy(path, count):
+    """Rewrite a .npy header for its first `count` entries and cut off the rest (the header keeps its length)."""
+    with open(path, "r+b") as f:
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else \
+            np.lib.format.read_array_header_2_0
+        shape, fortran, dtype = read_header(f)
+        offset = f.tell()
+        preamble = 8 + (2 if version == (1, 0) else 4)
+        header = repr({"descr": np.lib.format.dtype_to_descr(dtype), "fortran_order": fortran,
+                       "shape": (count,) + tuple(shape[1:])})
+        header = header.ljust(offset - preamble - 1) + "\n"
+        f.seek(preamble)
+        f.write(header.encode("latin1"))
+        f.truncate(offset + count * int(np.prod(shape[1:], dtype=np.int64)) * dtype.itemsize)
+
+
+def export_patches(paths, out_dir, size=PATCH_SIZE, stride=None, min_valid=MIN_VALID, nodata=NODATA,
+                   label_dir=None, dtype=None):
+    """
+    Write the size x size patches of `paths` (GeoTIFFs or raw .IMG) into out_dir/patches.npy with
+    their index (see above). stride defaults to size (no overlap). The source nodata is used
+    when it declares one. Products must share a sample type (byte order aside) unless `dtype`
+    is given, in which case every product is cast to it. Returns the number of patches written.
+    """
+    stride = stride or size
+    shapes, dtypes, fills = [], [], []
+    for path in paths:
+        with open_rows(path) as (w, h, read_rows, src_nodata):
+            shapes.append((w, h))
+            dtypes.append(read_rows(0, 1).dtype)
+            fills.append(src_nodata if src_nodata is not None else nodata)
+    if dtype is None:
+        kinds = sorted({d.newbyteorder("=").str for d in dtypes})
+        if len(kinds) > 1:
+            raise ValueError(f"products have different sample types {kinds}, pass dtype= to cast them to one")
+        dtype = kinds[0] if kinds else np.uint8
+    dtype = np.dtype(dtype)
+    os.makedirs(out_dir, exist_ok=True)
+    # Upper bound on the patch count; the unused tail is never written (sparse) and is cut off at the end
+    bound = sum(max((w - size) // stride + 1, 0) * max((h - size) // stride + 1, 0) for w, h in shapes)
+    patches_path = os.path.join(out_dir, "patches.npy")
+    index_path = os.path.join(out_dir, "index.npy")
+    patches = np.lib.format.open_memmap(patches_path, "w+", dtype, (max(bound, 1), size, size))
+    index = np.lib.format.open_memmap(index_path, "w+", INDEX_DTYPE, (max(bound, 1),))
+    count = 0
+    start = time.perf_counter()
+    with track("patches", os.path.basename(os.path.normpath(out_dir)),
+               sum(file_size(p) for p in paths), products=len(paths), size=size, stride=stride) as rec:
+        for pid, (path, (w, h), fill) in enumerate(zip(paths, shapes, fills)):
+            first = count
+            locate = _locator(path, w, h, label_dir)
+            cast = dtypes[pid] != dtype
+            with open_rows(path) as (_, _, read_rows, _):
+                cols = np.arange(0, w - size + 1, stride)
+                for row, band in _bands(read_rows, h, size, stride):
+                    if fill is None:
+                        valid = np.ones(len(cols))
+                    else:
+                        # Valid pixels per window from a running sum over the band's column counts
+                        sums = np.concatenate([[0], np.cumsum((band != fill).sum(axis=0))])
+                        valid = (sums[cols + size] - sums[cols]) / (size * size)
+                    keep = valid >= min_valid
+                    n = int(keep.sum())
+                    if not n:
+                        continue
+                    windows = sliding_window_view(band, size, axis=1)[:, cols[keep]]  # (size, n, size) view
+                    windows = windows.transpose(1, 0, 2)
+                    patches[count:count + n] = windows.astype(dtype) if cast else windows
+                    index["product"][count:count + n] = pid
+                    index["col"][count:count + n] = cols[keep]
+                    index["row"][count:count + n] = row
+                    index["valid"][count:count + n] = valid[keep]
+                    count += n
+            if locate is not None and count > first:
+                centre = size / 2
+                lats, lons = locate(index["col"][first:count] + centre, index["row"][first:count] + centre)
+                index["lat"][first:count], index["lon"][first:count] = lats, lons
+            else:
+                index["lat"][first:count] = index["lon"][first:count] = np.nan
+            print(f"{os.path.basename(path)}: {count - first} patches")
+        patches.flush()
+        index.flush()
+        del patches, index
+        _shrink_npy(patches_path, count)
+        _shrink_npy(index_path, count)
+        with open(os.path.join(out_dir, "patches.json"), "w") as f:
+            json.dump({"size": size, "stride": stride, "min_valid": min_valid, "dtype": dtype.str, "count": count,
+                       "products": [os.path.splitext(os.path.basename(p))[0] for p in paths],
+                       "source_dtypes": [d.str for d in dtypes], "nodata": fills}, f, indent=1)
+        rec.update(patches=count, bytes_out=file_size(patches_path))
+    print(f"✅ {count} patches of {size}x{size} (stride {stride}) in {out_dir} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return count
+
+
+# ----------------------------
+# Reader
+# ----------------------------
+class PatchDataset:
+    """
+    Random access to an export_patches() directory. ds[i] is a read-only view into the memory
+    map; ds.batch(indices) gathers a batch (into `out` when given). The maps are opened lazily
+    in each process, so the object can be handed to loader worker processes as is.
+    """
+
+    def __init__(self, out_dir):
+        self.out_dir = out_dir
+        with open(os.path.join(out_dir, "patches.json")) as f:
+            self.info = json.load(f)
+        self.products = self.info["products"]
+        self._patches = None
+        self._index = None
+
+    def __getstate__(self):
+        return {**self.__dict__, "_patches": None, "_index": None}  # never pickle the mapped data
+
+    @property
+    def patches(self):
+        if self._patches is None:
+            self._patches = np.load(os.path.join(self.out_dir, "patches.npy"), mmap_mode="r")
+        return self._patches
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = np.load(os.path.join(self.out_dir, "index.npy"), mmap_mode="r")
+        return self._index
+
+    def __len__(self):
+        return self.info["count"]
+
+    def __getitem__(self, i):
+        return self.patches[i]
+
+    def batch(self, indices, out=None):
+        """Patches at `indices` as one (len(indices), size, size) array."""
+        return np.take(self.patches, indices, axis=0, out=out)
+
+    def meta(self, i):
+        rec = self.index[i]
+        return {"product": self.products[rec["product"]], "col": int(rec["col"]), "row": int(rec["row"]),
+                "lat": float(rec["lat"]), "lon": float(rec["lon"]), "valid": float(rec["valid"])}
+
+
+def raster_paths(source):
+    """The .tif / .IMG rasters in a directory (sorted), or [source] for a single file."""
+    if not os.path.isdir(source):
+        return [source]
+    return [os.path.join(source, f) for f in sorted(os.listdir(source)) if f.lower().endswith((".tif", ".img"))]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export fixed-size training patches into a memory-mapped store")
+    parser.add_argument("source", nargs="?", default=CONFIG["processed_dir"], help="raster or directory")
+    parser.add_argument("-o", "--out", default=PATCHES_DIR)
+    parser.add_argument("--size", type=int, default=PATCH_SIZE)
+    parser.add_argument("--stride", type=int, default=CONFIG["patch_stride"] or None,
+                        help="default: --size (no overlap)")
+    parser.add_argument("--min-valid", type=float, default=MIN_VALID)
+    parser.add_argument("--labels", default=CONFIG["raw_dir"], help="PDS labels of unprojected products")
+    args = parser.parse_args()
+    export_patches(raster_paths(args.source), args.out, args.size, args.stride, args.min_valid,
+                   label_dir=args.labels)
@@ -0,0 +1,231 @@
+import re
+from collections import namedtuple
+
+# ----------------------------
+# PDS3 / ODL label reader
+# ----------------------------
+# Reads the attached label in one bulk read (LABEL_RECORDS * RECORD_BYTES) and
+# parses it with a single regex scan into nested dicts. Values come back typed:
+# int, float, str, list (sequences/sets) or Quantity(value, units) for "1.5 <KM>".
+
+Quantity = namedtuple("Quantity", ["value", "units"])
+
+HEAD_BYTES = 64 * 1024  # enough for RECORD_BYTES / LABEL_RECORDS and most CTX labels
+
+_TOKEN = re.compile(r"""
+    (?P<ws>\s+|/\*.*?\*/)
+  | (?P<string>"[^"]*")
+  | (?P<symbol>'[^']*')
+  | (?P<units><[^>]*>)
+  | (?P<punct>[=(){},])
+  | (?P<radix>[+-]?\d+\#[^#]*\#)
+  | (?P<word>[^\s=(){},"'<>]+)
+""", re.S | re.X)
+
+_INT = re.compile(r"[+-]?\d+$")
+_FLOAT = re.compile(r"[+-]?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?$")
+_HEAD_KEY = re.compile(rb"^\s*(RECORD_BYTES|LABEL_RECORDS)\s*=\s*(\d+)", re.M)
+
+_BLOCKS = {"OBJECT": "END_OBJECT", "GROUP": "END_GROUP"}
+
+
+class LabelError(ValueError):
+    pass
+
+
+def _tokens(text):
+    for m in _TOKEN.finditer(text):
+        kind = m.lastgroup
+        if kind != "ws":
+            yield kind, m.group()
+
+
+def _scalar(kind, tok):
+    if kind == "string":
+        return " ".join(tok[1:-1].split())
+    if kind == "symbol":
+        return tok[1:-1]
+    if kind == "radix":
+        sign = -1 if tok[0] == "-" else 1
+        base, digits = tok.lstrip("+-").split("#")[:2]
+        return sign * int(digits, int(base))
+    if _INT.match(tok):
+        return int(tok)
+    if _FLOAT.match(tok):
+        return float(tok)
+    return tok
+
+
+class _Parser:
+    def __init__(self, text):
+        self.toks = _tokens(text)
+        self.peeked = None
+
+    def next(self):
+        if self.peeked is not None:
+            tok, self.peeked = self.peeked, None
+            return tok
+        return next(self.toks, (None, None))
+
+    def peek(self):
+        if self.peeked is None:
+            self.peeked = next(self.toks, (None, None))
+        return self.peeked
+
+    def value(self):
+        kind, tok = self.next()
+        if tok in ("(", "{"):
+            close = ")" if tok == "(" else "}"
+            items = []
+            while True:
+                if self.peek()[1] == close:
+                    self.next()
+                    break
+                items.append(self.value())
+                if self.peek()[1] == ",":
+                    self.next()
+            val = items
+        elif kind is None or kind == "punct":
+            raise LabelError(f"unexpected token {tok!r}")
+        else:
+            val = _scalar(kind, tok)
+        if self.peek()[0] == "units":
+            val = Quantity(val, self.next()[1][1:-1].strip())
+        return val
+
+    def block(self, end_key=None):
+        node = {}
+        repeated = set()
+        while True:
+            kind, key = self.next()
+            if key is None:
+                if end_key:
+                    raise LabelError(f"missing {end_key}")
+                return node
+            if key == "END" and end_key is None:
+                return node
+            if key == end_key:
+                if self.peek()[1] == "=":
+                    self.next()
+                    self.next()
+                return node
+            if self.next()[1] != "=":
+                raise LabelError(f"expected '=' after {key}")
+            if key in _BLOCKS:
+                name = self.value()
+                val = self.block(_BLOCKS[key])
+                key = name
+            else:
+                val = self.value()
+            if key in node:
+                # Repeated keys/objects (e.g. several TABLE objects) collect into a list
+                if key not in repeated:
+                    node[key] = [node[key]]
+                    repeated.add(key)
+                node[key].append(val)
+            else:
+                node[key] = val
+
+
+def parse_label(text):
+    """Parse ODL label text into nested dicts (OBJECT/GROUP blocks become sub-dicts)."""
+    if isinstance(text, bytes):
+        text = text.decode("latin-1")
+    return _Parser(text).block()
+
+
+def read_label_bytes(path):
+    """Return the raw label bytes of an attached (.IMG) or detached (.LBL) label with at most two reads."""
+    with open(path, "rb") as f:
+        head = f.read(HEAD_BYTES)
+        keys = dict((k.decode(), int(v)) for k, v in _HEAD_KEY.findall(head[:8192]))
+        if "RECORD_BYTES" in keys and "LABEL_RECORDS" in keys:
+            size = keys["RECORD_BYTES"] * keys["LABEL_RECORDS"]
+            if size > len(head):
+                head += f.read(size - len(head))
+            return head[:size]
+        if path.upper().endswith(".LBL"):
+            return head + f.read()
+        return head
+
+
+def read_label(path):
+    """Read and parse the PDS3 label of `path`."""
+    return parse_label(read_label_bytes(path))
+
+
+# ----------------------------
+# Convenience accessors
+# ----------------------------
+def value_of(v):
+    """Drop units from a Quantity."""
+    return v.value if isinstance(v, Quantity) else v
+
+
+def image_object(label):
+    img = label.get("IMAGE")
+    if isinstance(img, list):
+        img = img[0]
+    if not isinstance(img, dict):
+        raise LabelError("label has no IMAGE object")
+    return img
+
+
+def image_offset(label):
+    """
+    Byte offset of the image data from the ^IMAGE pointer.
+    Returns (file name or None for attached data, offset).
+    """
+    ptr = label.get("^IMAGE")
+    if ptr is None:
+        raise LabelError("label has no ^IMAGE pointer")
+    fname = None
+    if isinstance(ptr, list):
+        fname, ptr = ptr[0], (ptr[1] if len(ptr) > 1 else 1)
+    elif isinstance(ptr, str):
+        return ptr, 0
+    if isinstance(ptr, Quantity):
+        if ptr.units.upper() == "BYTES":
+            return fname, ptr.value - 1
+        ptr = ptr.value
+    return fname, (ptr - 1) * value_of(label["RECORD_BYTES"])
+
+
+def find_key(label, key):
+    """First value of `key` at the top level, else in any nested OBJECT/GROUP."""
+    if key in label:
+        return label[key]
+    for v in label.values():
+        for node in (v if isinstance(v, list) else [v]):
+            if isinstance(node, dict):
+                found = find_key(node, key)
+                if found is not None:
+                    return found
+    return None
+
+
+def to_jsonable(v):
+    if isinstance(v, Quantity):
+        return {"value": to_jsonable(v.value), "units": v.units}
+    if isinstance(v, dict):
+        return {k: to_jsonable(x) for k, x in v.items()}
+    if isinstance(v, list):
+        return [to_jsonable(x) for x in v]
+    return v
+
+
+def image_layout(label):
+    """Everything needed to locate the pixels: offset, shape, sample type/bits, line prefix/suffix."""
+    img = image_object(label)
+    fname, offset = image_offset(label)
+    return {
+        "file": fname,
+        "offset": offset,
+        "lines": value_of(img["LINES"]),
+        "line_samples": value_of(img["LINE_SAMPLES"]),
+        "bands": value_of(img.get("BANDS", 1)),
+        "sample_type": img["SAMPLE_TYPE"],
+        "sample_bits": value_of(img["SAMPLE_BITS"]),
+        "line_prefix_bytes": value_of(img.get("LINE_PREFIX_BYTES", 0)),
+        "line_suffix_bytes": value_of(img.get("LINE_SUFFIX_BYTES", 0)),
+    }
@@ -0,0 +1,95 @@
+import queue
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from metrics import METRICS, track
+
+# Marks the end of a stage's input
+_DONE = object()
+
+
+class Stage:
+    """
+    One step of a streaming pipeline.
+    `fn(item)` returns the item handed to the next stage, or None to drop it.
+    kind="process" runs `fn` in a process pool (fn and items must be picklable).
+    """
+
+    def __init__(self, name, fn, workers=1, kind="thread", queue_size=None):
+        self.name = name
+        self.fn = fn
+        self.workers = max(1, workers)
+        self.kind = kind
+        self.queue_size = queue_size if queue_size is not None else self.workers * 2
+
+
+def _run_stage(stage, inbox, outbox, errors):
+    executor = ProcessPoolExecutor(max_workers=stage.workers) if stage.kind == "process" else None
+    remaining = [stage.workers]
+    lock = threading.Lock()
+
+    def worker():
+        while True:
+            item = inbox.get()
+            if item is _DONE:
+                inbox.put(_DONE)  # let sibling workers see it too
+                break
+            depth = inbox.qsize()
+            METRICS.set("queue_depth", depth, stage=stage.name)
+            try:
+                # Per-item latency as the pipeline sees it (includes process-pool hand-off)
+                with track("pipeline/" + stage.name, str(item), queue_depth=depth):
+                    if executor:
+                        result = executor.submit(stage.fn, item).result()
+                    else:
+                        result = stage.fn(item)
+            except Exception as e:
+                print(f"[{stage.name}] failed on {item}: {e}")
+                errors.append((stage.name, item, e))
+                continue
+            if result is not None:
+                outbox.put(result)
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            if executor:
+                executor.shutdown()
+            outbox.put(_DONE)
+
+    threads = [threading.Thread(target=worker, name=f"{stage.name}-{i}", daemon=True)
+               for i in range(stage.workers)]
+    for t in threads:
+        t.start()
+    return threads
+
+
+def run_pipeline(items, stages):
+    """
+    Stream `items` through `stages`, each with its own pool and a bounded input queue,
+    so a product enters stage N+1 as soon as stage N finishes with it.
+    Returns (results from the last stage, list of (stage, item, error)).
+    """
+    queues = [queue.Queue(maxsize=s.queue_size) for s in stages] + [queue.Queue()]
+    errors = []
+    threads = []
+    for i, stage in enumerate(stages):
+        threads += _run_stage(stage, queues[i], queues[i + 1], errors)
+
+    def feed():
+        for item in items:
+            queues[0].put(item)  # blocks when the first stage is saturated
+        queues[0].put(_DONE)
+
+    feeder = threading.Thread(target=feed, name="feeder", daemon=True)
+    feeder.start()
+
+    results = []
+    while True:
+        item = queues[-1].get()
+        if item is _DONE:
+            break
+        results.append(item)
+    feeder.join()
+    for t in threads:
+        t.join()
+    return results, errors
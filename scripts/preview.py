@@ -0,0 +1,100 @@
+import os
+import math
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+import rasterio
+from rasterio.enums import Resampling
+from raw_image import RawImage
+from stretch import compute_stats, load_stats, stretcher
+from config import load_config
+
+# ----------------------------
+# Quicklook previews
+# ----------------------------
+# A preview is read already decimated: GeoTIFF/COG reads use out_shape, so GDAL
+# serves them from the internal overviews when there are any; raw .IMG products
+# use a strided view of the memmap. Memory is one thumbnail per worker, whatever
+# the raster size. Output is an 8-bit PNG written with OpenCV (no matplotlib).
+
+MAX_SIZE = 1024  # longest side of a preview, pixels (preview_size setting on the command line)
+NODATA = 0  # used when a source declares no nodata value (CTX fill)
+
+
+def preview_array(path, max_size=MAX_SIZE):
+    """Return (array, nodata) with the longest side at most max_size, read decimated."""
+    if path.upper().endswith(".IMG"):
+        img = RawImage(path)
+        step = max(1, math.ceil(max(img.width, img.height) / max_size))
+        return np.ascontiguousarray(img.decimated(step), dtype=img.dtype.newbyteorder("=")), None
+    with rasterio.open(path) as src:
+        scale = max(src.width, src.height) / max_size
+        if scale <= 1:
+            return src.read(1), src.nodata
+        shape = (max(1, round(src.height / scale)), max(1, round(src.width / scale)))
+        return src.read(1, out_shape=shape, resampling=Resampling.average), src.nodata
+
+
+def to_8bit(path, arr, nodata):
+    """Map a preview to uint8 with the product's cached stretch, or one computed on the preview."""
+    fill = nodata if nodata is not None else NODATA
+    stats = load_stats(path)
+    if stats is None or stats["dtype"] != str(arr.dtype):
+        stats = compute_stats(lambda row, count: arr[row:row + count], arr.shape[0], fill)
+    return stretcher(stats, fill)(arr)
+
+
+def write_preview(path, out_path, max_size=MAX_SIZE):
+    """Write a PNG quicklook of `path` and return its (width, height)."""
+    arr, nodata = preview_array(path, max_size)
+    out = to_8bit(path, arr, nodata)
+    os.makedirs(os.path.dirname(os.path.abspath(out_path)), exist_ok=True)
+    cv2.imwrite(out_path, out)
+    return out.shape[1], out.shape[0]
+
+
+def _preview_one(args):
+    path, out_path, max_size = args
+    try:
+        write_preview(path, out_path, max_size)
+        return out_path
+    except Exception as e:
+        print(f"Failed to preview {path}: {e}")
+        return None
+
+
+def make_previews(input_dir, out_dir, max_size=MAX_SIZE, workers=None):
+    """Preview every .tif / .IMG in input_dir into out_dir/<name>.png in a process pool."""
+    jobs = [(os.path.join(input_dir, f), os.path.join(out_dir, os.path.splitext(f)[0] + ".png"), max_size)
+            for f in sorted(os.listdir(input_dir)) if f.lower().endswith((".tif", ".tiff", ".img"))]
+    os.makedirs(out_dir, exist_ok=True)
+    start = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        done = [p for p in pool.map(_preview_one, jobs) if p]
+    print(f"{len(done)} previews in {time.perf_counter() - start:.1f}s → {out_dir}")
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write PNG quicklooks from overviews / decimated reads")
+    parser.add_argument("input", nargs="?", help="a raster or a directory of them (default: processed_dir)")
+    parser.add_argument("-o", "--out", help="output PNG (single file) or directory (default: preview_dir)")
+    parser.add_argument("--size", type=int, help="longest side in pixels (default: preview_size)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+    args = parser.parse_args()
+    cfg = load_config(args.config, preview_size=args.size)
+    args.input = args.input or cfg["processed_dir"]
+    args.out = args.out or cfg["preview_dir"]
+    args.size = cfg["preview_size"]
+
+    if os.path.isdir(args.input):
+        make_previews(args.input, args.out, args.size, args.workers)
+    else:
+        out = args.out
+        if not out.lower().endswith(".png"):
+            out = os.path.join(out, os.path.splitext(os.path.basename(args.input))[0] + ".png")
+        w, h = write_preview(args.input, out, args.size)
+        print(f"✅ Preview saved to {out} ({w}x{h})")
@@ -0,0 +1,672 @@
+import os
+import math
+import time
+import shutil
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+import numpy as np
+import cv2
+import rasterio
+from rasterio.windows import Window
+from raw_image import RawImage
+from tile_archive import TileArchive
+from stretch import CLIP, compute_stats, load_stats, save_stats, stretcher
+from metrics import track, file_size
+
+# ----------------------------
+# Windowed pyramid tiler
+# ----------------------------
+# The source is read in row bands. Each band is tiled at full resolution,
+# then reduced 2x and pushed into the next level down, which keeps at most
+# one tile row (plus one unpaired line) per level. Peak memory is about
+# 2 * tile_size * width pixels, whatever the image height.
+#
+# Every emitted tile row is classified in one vectorised pass: tiles that are
+# all nodata are not written at all, constant tiles are encoded once and
+# hard-linked (or deduplicated in an archive), and tiles that are only partly
+# valid become PNGs with an alpha channel so the margins stay transparent.
+
+EMPTY, CONSTANT, PARTIAL, FULL = range(4)
+PARTIAL_EXT = ".png"
+TILE_FORMAT = "files"  # "files" = level_N/{x}_{y}.jpg, "mbtiles" = one packed <product>.mbtiles per product
+
+
+def downsample2x(rows):
+    """2x2 box reduction (same result as INTER_AREA at exactly half size). Needs an even row count."""
+    if rows.shape[1] % 2:
+        rows = np.concatenate([rows, rows[:, -1:]], axis=1)
+    acc = (rows[0::2, 0::2].astype(np.float32) + rows[1::2, 0::2] +
+           rows[0::2, 1::2] + rows[1::2, 1::2]) * 0.25
+    if np.issubdtype(rows.dtype, np.integer):
+        acc = np.rint(acc)
+    return acc.astype(rows.dtype)
+
+
+def classify_band(band, tile_size, nodata=None):
+    """
+    Kind (EMPTY, CONSTANT, PARTIAL or FULL) of every tile in a row band, using
+    reductions over the whole band instead of a Python loop per tile.
+    With nodata=None every tile is FULL.
+    """
+    h, w = band.shape[:2]
+    n = -(-w // tile_size)
+    if nodata is None:
+        return np.full(n, FULL, dtype=np.uint8)
+    pad = n * tile_size - w
+    if pad:
+        band = np.pad(band, ((0, 0), (0, pad)), mode="edge")
+    tiles = band.reshape(h, n, tile_size)
+    valid = (tiles != nodata)
+    if pad:
+        valid[:, -1, tile_size - pad:] = False
+    counts = valid.sum(axis=(0, 2))
+    sizes = np.full(n, h * tile_size)
+    sizes[-1] -= h * pad
+    constant = (tiles.min(axis=(0, 2)) == tiles.max(axis=(0, 2)))
+    kinds = np.full(n, FULL, dtype=np.uint8)
+    kinds[constant] = CONSTANT
+    kinds[counts < sizes] = PARTIAL
+    kinds[counts == 0] = EMPTY
+    return kinds
+
+
+def with_alpha(tile, nodata):
+    """BGRA copy of a single-band tile, transparent where it equals nodata."""
+    alpha = np.where(tile != nodata, np.iinfo(tile.dtype).max if tile.dtype.kind in "ui" else 255, 0)
+    return cv2.merge([tile, tile, tile, alpha.astype(tile.dtype)])
+
+
+class TileEncoder:
+    """Encodes tiles by kind; constant tiles are encoded once per (value, shape)."""
+
+    def __init__(self, ext=".jpg", nodata=None, params=None):
+        self.ext = ext
+        self.nodata = nodata
+        self.params = params or []
+        self.constant = {}
+
+    def encode(self, tile, kind=FULL):
+        """Return (ext, bytes) or None if the tile should not be stored."""
+        if kind == EMPTY:
+            return None
+        if kind == PARTIAL:
+            ok, buf = cv2.imencode(PARTIAL_EXT, with_alpha(tile, self.nodata))
+            return (PARTIAL_EXT, buf.tobytes()) if ok else None
+        key = (tile.flat[0].item(), tile.shape) if kind == CONSTANT else None
+        if key in self.constant:
+            return self.constant[key]
+        ok, buf = cv2.imencode(self.ext, tile, self.params)
+        encoded = (self.ext, buf.tobytes()) if ok else None
+        if key is not None:
+            self.constant[key] = encoded
+        return encoded
+
+    def write(self, stem, tile, kind=FULL):
+        """
+        Write stem + ext; repeated constant tiles become hard links to the first copy. A tile
+        already at stem (either extension) is unlinked first, so rewriting a hard-linked
+        constant tile never changes its other links, and an EMPTY tile leaves nothing behind.
+        """
+        for ext in {self.ext, PARTIAL_EXT}:
+            try:
+                os.remove(stem + ext)
+            except FileNotFoundError:
+                pass
+        if kind == CONSTANT:
+            key = ("path", tile.flat[0].item(), tile.shape)
+            first = self.constant.get(key)
+            if first:
+                try:
+                    os.link(first, stem + self.ext)
+                    return
+                except OSError:
+                    pass
+        encoded = self.encode(tile, kind)
+        if encoded is None:
+            return
+        with open(stem + encoded[0], "wb") as f:
+            f.write(encoded[1])
+        if kind == CONSTANT:
+            self.constant.setdefault(key, stem + encoded[0])
+
+
+def jpeg_writer(output_dir, ext=".jpg", nodata=None):
+    """Tile sink writing level_N/{x}_{y}.jpg like create_opencv_tiles (partial tiles as .png)."""
+    made = set()
+    encoder = TileEncoder(ext, nodata)
+
+    def write(level, x, y, tile, kind=FULL):
+        level_dir = os.path.join(output_dir, f"level_{level}")
+        if level not in made:
+            os.makedirs(level_dir, exist_ok=True)
+            made.add(level)
+        encoder.write(os.path.join(level_dir, f"{x}_{y}"), tile, kind)
+
+    return write
+
+
+def archive_writer(archive, tile_size, ext=".jpg", nodata=None):
+    """
+    Tile sink storing encoded tiles in a TileArchive at (level, x // ts, y // ts).
+    Partly valid tiles are stored as PNG with alpha; readers tell the two apart by their magic bytes.
+    """
+    encoder = TileEncoder(ext, nodata)
+
+    def write(level, x, y, tile, kind=FULL):
+        encoded = encoder.encode(tile, kind)
+        if encoded is not None:
+            archive.put(level, x // tile_size, y // tile_size, encoded[1])
+
+    return write
+
+
+def _encode_band(shm_name, shape, dtype, level, y, output_dir, tile_size, ext, kinds, nodata):
+    """
+    Process-pool worker: attach to a shared band buffer and write its tiles.
+    With output_dir=None the encoded tiles are returned as [(x, bytes)] for an archive.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    encoder = TileEncoder(ext, nodata)
+    encoded = []
+    try:
+        band = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+        for i, x in enumerate(range(0, shape[1], tile_size)):
+            tile = band[:, x:x + tile_size]
+            if output_dir is None:
+                data = encoder.encode(tile, kinds[i])
+                if data is not None:
+                    encoded.append((x, data[1]))
+            else:
+                encoder.write(os.path.join(output_dir, f"level_{level}", f"{x}_{y}"), tile, kinds[i])
+        del band
+    finally:
+        shm.close()
+    return encoded
+
+
+class ParallelBandWriter:
+    """
+    Encodes whole tile rows in a process pool. Each band is copied once into shared
+    memory so workers read the pixels without pickling them; at most `max_pending`
+    bands are in flight, which keeps memory bounded.
+    """
+
+    def __init__(self, output_dir, tile_size=256, workers=None, ext=".jpg", max_pending=None, archive=None,
+                 nodata=None):
+        self.output_dir = None if archive is not None else output_dir
+        self.archive = archive
+        self.tile_size = tile_size
+        self.ext = ext
+        self.nodata = nodata
+        workers = workers or os.cpu_count() or 1
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending or 2 * workers
+        self.pending = {}
+        self.made = set()
+
+    def _reap(self, done):
+        """Release the shared band of every finished future, then store results (the first error re-raises)."""
+        finished = []
+        for fut in done:
+            shm, level, y = self.pending.pop(fut)
+            try:
+                shm.close()
+            finally:
+                shm.unlink()
+            finished.append((fut, level, y))
+        for fut, level, y in finished:
+            for x, data in fut.result():
+                self.archive.put(level, x // self.tile_size, y // self.tile_size, data)
+
+    def _drop(self, level, y, xs):
+        """Remove whatever an earlier build stored at the EMPTY tiles xs of this row."""
+        if self.archive is not None:
+            if self.archive.mode != "w":  # a freshly written archive holds nothing to drop
+                self.archive.delete_many((level, x // self.tile_size, y // self.tile_size) for x in xs)
+            return
+        for x in xs:
+            for ext in {self.ext, PARTIAL_EXT}:
+                try:
+                    os.remove(os.path.join(self.output_dir, f"level_{level}", f"{x}_{y}{ext}"))
+                except FileNotFoundError:
+                    pass
+
+    def __call__(self, level, y, band, kinds):
+        empty = [x for x, kind in zip(range(0, band.shape[1], self.tile_size), kinds) if kind == EMPTY]
+        # Workers unlink EMPTY files themselves but return only the tiles to store for an archive;
+        # a row of nothing but nodata is not shipped to a worker at all
+        if empty and (self.archive is not None or len(empty) == len(kinds)):
+            self._drop(level, y, empty)
+        if len(empty) == len(kinds):
+            return
+        if self.output_dir is not None and level not in self.made:
+            os.makedirs(os.path.join(self.output_dir, f"level_{level}"), exist_ok=True)
+            self.made.add(level)
+        if len(self.pending) >= self.max_pending:
+            done, _ = wait(self.pending, return_when=FIRST_COMPLETED)
+            self._reap(done)
+        band = np.ascontiguousarray(band)
+        shm = shared_memory.SharedMemory(create=True, size=max(band.nbytes, 1))
+        np.ndarray(band.shape, dtype=band.dtype, buffer=shm.buf)[:] = band
+        fut = self.pool.submit(_encode_band, shm.name, band.shape, band.dtype.str, level, y,
+                               self.output_dir, self.tile_size, self.ext, kinds.tolist(), self.nodata)
+        self.pending[fut] = (shm, level, y)
+
+    def close(self):
+        try:
+            self._reap(wait(self.pending).done)
+        finally:
+            self.pool.shutdown()
+
+
+class _Level:
+    def __init__(self, level, width, tile_size):
+        self.level = level
+        self.width = width
+        self.tile_size = tile_size
+        self.rows = []  # lines waiting to fill a tile row
+        self.nrows = 0
+        self.y = 0
+        self.pending = None  # unpaired line waiting for the 2x reduction
+
+
+class PyramidTiler:
+    """
+    Streams row bands of the full-resolution image into every pyramid level. write_tile gets
+    EMPTY tiles too, so a sink can drop whatever an earlier build stored at that position.
+    """
+
+    def __init__(self, width, height, write_tile=None, tile_size=256, min_level=0, write_band=None,
+                 nodata=None):
+        self.tile_size = tile_size
+        self.nodata = nodata
+        self.write_tile = write_tile
+        self.write_band = write_band or self._write_band
+        self.max_level = math.ceil(math.log2(max(width, height, 2)))
+        self.min_level = min_level
+        self.levels = {}
+        w = width
+        for level in range(self.max_level, min_level - 1, -1):
+            self.levels[level] = _Level(level, w, tile_size)
+            w = math.ceil(w / 2)
+        self.tiles_written = 0
+        self.skipped = 0
+        self.constant = 0
+        self.partial = 0
+
+    def _emit(self, lvl, force=False):
+        ts = self.tile_size
+        while lvl.nrows >= ts or (force and lvl.nrows):
+            buf = np.concatenate(lvl.rows, axis=0) if len(lvl.rows) > 1 else lvl.rows[0]
+            band, rest = buf[:ts], buf[ts:]
+            kinds = classify_band(band, ts, self.nodata)
+            self.write_band(lvl.level, lvl.y, band, kinds)
+            counts = np.bincount(kinds, minlength=4)
+            self.skipped += int(counts[EMPTY])
+            self.constant += int(counts[CONSTANT])
+            self.partial += int(counts[PARTIAL])
+            self.tiles_written += len(kinds) - int(counts[EMPTY])
+            lvl.y += ts
+            lvl.rows = [rest] if len(rest) else []
+            lvl.nrows = len(rest)
+
+    def _write_band(self, level, y, band, kinds):
+        for i, x in enumerate(range(0, band.shape[1], self.tile_size)):
+            self.write_tile(level, x, y, band[:, x:x + self.tile_size], kinds[i])
+
+    def push(self, level, rows):
+        lvl = self.levels[level]
+        lvl.rows.append(rows)
+        lvl.nrows += len(rows)
+        self._emit(lvl)
+
+        if level == self.min_level:
+            return
+        if lvl.pending is not None:
+            rows = np.concatenate([lvl.pending, rows], axis=0)
+            lvl.pending = None
+        if len(rows) % 2:
+            lvl.pending = rows[-1:].copy()
+            rows = rows[:-1]
+        if len(rows):
+            self.push(level - 1, downsample2x(rows))
+
+    def finish(self):
+        for level in range(self.max_level, self.min_level - 1, -1):
+            lvl = self.levels[level]
+            self._emit(lvl, force=True)
+            if lvl.pending is not None and level > self.min_level:
+                self.push(level - 1, downsample2x(np.concatenate([lvl.pending, lvl.pending])))
+                lvl.pending = None
+
+
+@contextmanager
+def open_rows(path):
+    """
+    Yield (width, height, read_rows(row, count), nodata) for a GeoTIFF or a raw PDS .IMG.
+    nodata is None when the source does not declare one.
+    """
+    if path.upper().endswith(".IMG"):
+        img = RawImage(path)
+        yield img.width, img.height, img.rows, None
+        return
+    with rasterio.open(path) as src:
+        w, h = src.width, src.height
+        yield w, h, lambda row, count: src.read(1, window=Window(0, row, w, min(count, h - row))), src.nodata
+
+
+def product_stats(path, nodata=0, clip=CLIP, band_rows=1024):
+    """Stretch statistics for a product: cached in stretch_dir, else one chunked pass (then cached)."""
+    stats = load_stats(path, clip)
+    if stats is None:
+        start = time.perf_counter()
+        with open_rows(path) as (w, h, read_rows, src_nodata):
+            fill = src_nodata if src_nodata is not None else nodata
+            stats = save_stats(path, compute_stats(read_rows, h, fill, band_rows, clip))
+        print(f"Stretch for {os.path.basename(path)}: {stats['low']}..{stats['high']} "
+              f"in {time.perf_counter() - start:.1f}s")
+    return stats
+
+
+def tile_pyramid(input_tif, output_dir, tile_size=256, write_tile=None, band_rows=None, min_level=0,
+                 workers=1, nodata=0, skip_blank=True, stretch="auto"):
+    """
+    Build the level_N/{x}_{y}.jpg pyramid for `input_tif` (GeoTIFF or raw .IMG) with windowed reads.
+    If output_dir ends in .mbtiles all tiles go into one TileArchive instead of loose files.
+    workers > 1 encodes tile rows in a process pool (ignored when a custom write_tile is given).
+    With skip_blank, tiles that are entirely the source nodata (or `nodata` when the source
+    declares none, 0 = CTX fill) are not written and partly valid tiles get an alpha channel.
+    stretch="auto" maps anything that is not already 8-bit to uint8 with the product's global
+    percentile clip (see stretch.py); "always" does so for 8-bit data too, None never.
+    Returns the number of tiles written.
+    """
+    archive = None
+    if output_dir.lower().endswith(".mbtiles"):
+        archive = TileArchive(output_dir, "w")
+    else:
+        os.makedirs(output_dir, exist_ok=True)
+    band_rows = band_rows or tile_size
+    band_writer = None
+    start = time.perf_counter()
+    read_s = 0.0
+    packed = None
+    try:
+        with track("tile", os.path.basename(input_tif), file_size(input_tif)) as rec, \
+                open_rows(input_tif) as (w, h, read_rows, src_nodata):
+            if src_nodata is not None:
+                nodata = src_nodata
+            to_8bit = None
+            if stretch == "always" or (stretch == "auto" and read_rows(0, 1).dtype != np.uint8):
+                to_8bit = stretcher(product_stats(input_tif, nodata), nodata)
+                nodata = 0  # the stretch maps nodata to 0
+            if not skip_blank:
+                nodata = None
+            if write_tile is None and workers != 1:
+                band_writer = ParallelBandWriter(output_dir, tile_size, workers, archive=archive, nodata=nodata)
+            elif write_tile is None:
+                write_tile = (archive_writer(archive, tile_size, nodata=nodata) if archive
+                              else jpeg_writer(output_dir, nodata=nodata))
+            tiler = PyramidTiler(w, h, write_tile, tile_size, min_level, write_band=band_writer, nodata=nodata)
+            print(f"Creating tiles for {os.path.basename(input_tif)}: {w}x{h}, "
+                  f"Pyramid levels {tiler.max_level + 1}")
+            for row in range(0, h, band_rows):
+                t = time.perf_counter()
+                rows = read_rows(row, min(band_rows, h - row))
+                read_s += time.perf_counter() - t
+                if to_8bit is not None:
+                    rows = to_8bit(rows)
+                tiler.push(tiler.max_level, rows)
+            tiler.finish()
+            if archive:
+                archive.set_metadata(name=os.path.splitext(os.path.basename(input_tif))[0], format="jpg",
+                                     scheme="xyz", tile_size=tile_size, width=w, height=h,
+                                     minzoom=min_level, maxzoom=tiler.max_level)
+            if band_writer:
+                band_writer.close()  # waits for the encoders, so it belongs in the timing
+                band_writer = None
+            if archive:
+                archive.close()
+                packed, archive = archive, None
+            # read_s is source I/O; the rest of the time is downsampling, encoding and writes
+            rec.update(tiles=tiler.tiles_written, skipped=tiler.skipped, read_s=round(read_s, 6),
+                       bytes_out=file_size(output_dir) if output_dir.lower().endswith(".mbtiles") else None)
+    finally:
+        if band_writer:
+            band_writer.close()
+        if archive:
+            archive.close()
+    elapsed = time.perf_counter() - start
+    if packed:
+        print(f"{packed.tiles} tiles packed into {output_dir} ({packed.unique} unique)")
+    print(f"{tiler.tiles_written} tiles in {elapsed:.1f}s ({tiler.tiles_written / max(elapsed, 1e-9):.0f} tiles/s), "
+          f"{tiler.skipped} blank tiles skipped, {tiler.constant} constant, {tiler.partial} partial")
+    return tiler.tiles_written
+
+
+# ----------------------------
+# Incremental re-tiling
+# ----------------------------
+# When only part of the source changed (a basemap after update_mosaic), the
+# full-resolution tiles over the changed pixels are re-read and re-encoded and
+# each level above is rebuilt from the 2x2 children of its changed tiles: the
+# children just rebuilt come from memory, their unchanged siblings are decoded
+# from the pyramid. The work per level halves on the way up to the root.
+#
+# When the source grew (update_mosaic on a larger grid, the old raster offset by
+# whole lattice steps), shift_pyramid() first relabels the stored tiles: every
+# level at which the offset is a whole number of tiles keeps its tiles under new
+# indices, and only the few coarser levels above them are rebuilt from children.
+
+def _read_tile(archive, output_dir, level, x, y, tile_size, shape, fill):
+    """Decode a stored tile back to single-band uint8 (alpha 0 → fill); a missing tile is all fill."""
+    data = None
+    if archive is not None:
+        data = archive.get(level, x, y)
+        img = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED) if data else None
+    else:
+        stem = os.path.join(output_dir, f"level_{level}", f"{x * tile_size}_{y * tile_size}")
+        img = next((cv2.imread(stem + ext, cv2.IMREAD_UNCHANGED) for ext in (".jpg", PARTIAL_EXT)
+                    if os.path.exists(stem + ext)), None)
+    if img is None:
+        return np.full(shape, fill, dtype=np.uint8)
+    if img.ndim == 3:
+        gray = img[:, :, 0].copy()
+        if img.shape[2] == 4:
+            gray[img[:, :, 3] == 0] = fill
+        img = gray
+    return img
+
+
+def _max_level(width, height):
+    return math.ceil(math.log2(max(width, height, 2)))
+
+
+def shift_pyramid(output_dir, old_size, new_size, offset, tile_size=256):
+    """
+    Move a pyramid built for an old_size (w, h) source onto a new_size source that contains
+    the old one at pixel `offset` (col, row). Levels at which the offset and the old size are
+    whole tiles are relabelled (no decoding); coarser levels are dropped. Returns the level
+    below which update_pyramid(rebuild_below=...) must re-render every tile, or None if no
+    level could be kept (re-tile in full).
+    """
+    (ow, oh), (nw, nh), (dx, dy) = old_size, new_size, offset
+    old_max, new_max = _max_level(ow, oh), _max_level(nw, nh)
+    keep = -1
+    while keep < old_max and all(v % (tile_size << (keep + 1)) == 0 for v in (dx, dy, ow, oh)):
+        keep += 1  # downsampling steps whose tiles line up in both grids
+    if keep < 0:
+        return None
+    moves = {old_max - k: (new_max - k, (dx >> k) // tile_size, (dy >> k) // tile_size) for k in range(keep + 1)}
+    if output_dir.lower().endswith(".mbtiles"):
+        with TileArchive(output_dir, "a") as archive:
+            archive.move_levels(moves)
+            archive.set_metadata(width=nw, height=nh, maxzoom=new_max)
+    else:
+        parked = os.path.join(output_dir, ".shift")
+        shutil.rmtree(parked, ignore_errors=True)
+        os.makedirs(parked)
+        for name in os.listdir(output_dir):
+            if name.startswith("level_"):
+                os.rename(os.path.join(output_dir, name), os.path.join(parked, name))
+        for old, (new, tx, ty) in moves.items():
+            src_dir, dst_dir = os.path.join(parked, f"level_{old}"), os.path.join(output_dir, f"level_{new}")
+            if not os.path.isdir(src_dir):
+                continue
+            os.makedirs(dst_dir)
+            for name in os.listdir(src_dir):
+                px, py = os.path.splitext(name)[0].split("_")
+                ext = os.path.splitext(name)[1]
+                os.rename(os.path.join(src_dir, name),
+                          os.path.join(dst_dir, f"{int(px) + tx * tile_size}_{int(py) + ty * tile_size}{ext}"))
+        shutil.rmtree(parked)
+    print(f"Shifted {keep + 1} pyramid levels of {output_dir} by ({dx}, {dy}) px")
+    return new_max - keep
+
+
+def update_pyramid(input_tif, output_dir, dirty, tile_size=256, min_level=0, nodata=0, skip_blank=True,
+                   stretch="auto", rebuild_below=None):
+    """
+    Re-render the tiles of an existing tile_pyramid() output (same tile_size, nodata, skip_blank
+    and stretch) that cover the pixel rectangles `dirty` [(col, row, w, h)] of input_tif, and
+    every ancestor of them up to min_level; every tile of the levels below `rebuild_below` is
+    rebuilt (see shift_pyramid). The stretch the pyramid was built with is kept.
+    Returns the number of tiles rewritten.
+    """
+    archive = TileArchive(output_dir, "a") if output_dir.lower().endswith(".mbtiles") else None
+    start = time.perf_counter()
+    rewritten = removed = 0
+    try:
+        with track("tile_update", os.path.basename(input_tif), file_size(input_tif)) as rec, \
+                rasterio.open(input_tif) as src:
+            w, h = src.width, src.height
+            if archive is not None:
+                meta = archive.metadata()
+                if (meta.get("width"), meta.get("height"), meta.get("tile_size")) != (str(w), str(h), str(tile_size)):
+                    raise ValueError(f"{output_dir} was built for another grid, re-tile it in full")
+            if src.nodata is not None:
+                nodata = src.nodata
+            to_8bit = None
+            if stretch == "always" or (stretch == "auto" and src.dtypes[0] != "uint8"):
+                stats = load_stats(input_tif, CLIP, check_source=False) or product_stats(input_tif, nodata)
+                to_8bit = stretcher(stats, nodata)
+                nodata = 0
+                save_stats(input_tif, stats)  # on-demand rendering of the new version keeps the same curve
+            fill = 0 if nodata is None else nodata
+            if not skip_blank:
+                nodata = None
+            encoder = TileEncoder(".jpg", nodata)
+
+            max_level = _max_level(w, h)
+            sizes = {max_level: (w, h)}
+            for level in range(max_level - 1, min_level - 1, -1):
+                lw, lh = sizes[level + 1]
+                sizes[level] = (math.ceil(lw / 2), math.ceil(lh / 2))
+
+            def store(level, x, y, tile):
+                nonlocal rewritten, removed
+                kind = classify_band(tile, tile_size, nodata)[0]
+                if archive is not None:
+                    encoded = encoder.encode(tile, kind)
+                    if encoded is None:
+                        archive.delete(level, x, y)
+                    else:
+                        archive.put(level, x, y, encoded[1])
+                else:
+                    stem = os.path.join(output_dir, f"level_{level}", f"{x * tile_size}_{y * tile_size}")
+                    os.makedirs(os.path.dirname(stem), exist_ok=True)
+                    encoder.write(stem, tile, kind)
+                if kind == EMPTY:
+                    removed += 1
+                else:
+                    rewritten += 1
+
+            keys = {(x, y) for c, r, cw, rh in dirty
+                    for y in range(r // tile_size, (r + rh - 1) // tile_size + 1)
+                    for x in range(c // tile_size, (c + cw - 1) // tile_size + 1)}
+            current = {}
+            for x, y in sorted(keys, key=lambda k: (k[1], k[0])):
+                px, py = x * tile_size, y * tile_size
+                tile = src.read(1, window=Window(px, py, min(tile_size, w - px), min(tile_size, h - py)))
+                if to_8bit is not None:
+                    tile = to_8bit(tile)
+                current[(x, y)] = tile
+                store(max_level, x, y, tile)
+
+            for level in range(max_level - 1, min_level - 1, -1):
+                cw, ch = sizes[level + 1]
+                children, current = current, {}
+                parents = {(x // 2, y // 2) for x, y in children}
+                if rebuild_below is not None and level < rebuild_below:
+                    parents.update((x, y) for y in range(-(-sizes[level][1] // tile_size))
+                                   for x in range(-(-sizes[level][0] // tile_size)))
+                for x, y in sorted(parents, key=lambda k: (k[1], k[0])):
+                    x0, y0 = 2 * x * tile_size, 2 * y * tile_size
+                    rows = np.full((min(2 * tile_size, ch - y0), min(2 * tile_size, cw - x0)), fill, dtype=np.uint8)
+                    for cy in (2 * y, 2 * y + 1):
+                        for cx in (2 * x, 2 * x + 1):
+                            ox, oy = cx * tile_size - x0, cy * tile_size - y0
+                            if ox >= rows.shape[1] or oy >= rows.shape[0]:
+                                continue
+                            shape = (min(tile_size, rows.shape[0] - oy), min(tile_size, rows.shape[1] - ox))
+                            child = children.get((cx, cy))
+                            if child is None:
+                                child = _read_tile(archive, output_dir, level + 1, cx, cy, tile_size, shape, fill)
+                            rows[oy:oy + shape[0], ox:ox + shape[1]] = child[:shape[0], :shape[1]]
+                    if len(rows) % 2:
+                        rows = np.concatenate([rows, rows[-1:]])  # like PyramidTiler.finish
+                    tile = downsample2x(rows)
+                    current[(x, y)] = tile
+                    store(level, x, y, tile)
+            rec.update(tiles=rewritten, removed=removed,
+                       bytes_out=file_size(output_dir) if archive is not None else None)
+    finally:
+        if archive:
+            archive.close()
+    print(f"Re-tiled {rewritten} tiles ({removed} now blank) of {output_dir} "
+          f"in {time.perf_counter() - start:.1f}s")
+    return rewritten
+
+
+# ----------------------------
+# Directory driver
+# ----------------------------
+def tile_params(tile_size, tile_format=TILE_FORMAT):
+    """Build-cache parameters of a product pyramid: a change in any of them re-tiles it."""
+    return {"tile_size": tile_size, "format": ".jpg", "layout": tile_format, "blank": "skip", "partial": ".png",
+            "stretch": "auto", "clip": list(CLIP)}
+
+
+def tile_one(input_tif, web_tiles_dir, tile_size=256, workers=1, cache=None, tile_format=TILE_FORMAT):
+    """
+    Generate the pyramid for a single .tif or raw .IMG, either as web_tiles_dir/<name>.mbtiles
+    or as loose files under web_tiles_dir/<name>/level_N.
+    """
+    tif_file = os.path.basename(input_tif)
+    output_dir = os.path.join(web_tiles_dir, os.path.splitext(tif_file)[0])
+    if tile_format == "mbtiles":
+        output_dir += ".mbtiles"
+    params = tile_params(tile_size, tile_format)
+    if cache and cache.is_fresh("tile", input_tif, params, [output_dir]):
+        print(f"Up to date: {output_dir}")
+        return output_dir
+    try:
+        tile_pyramid(input_tif, output_dir, tile_size, workers=workers)
+    except Exception as e:
+        print(f"Failed to read {input_tif}: {e}")
+        return None
+    if cache:
+        cache.record("tile", input_tif, params, [output_dir])
+    return output_dir
+
+
+def create_opencv_tiles(processed_dir, web_tiles_dir, tile_size=256, workers=1, cache=None,
+                        tile_format=TILE_FORMAT):
+    """Generate pyramid tiles for web display (windowed reads, bounded memory).
+    processed_dir may also be the raw dir: .IMG products are tiled straight from a memmap."""
+    os.makedirs(web_tiles_dir, exist_ok=True)
+    for tif_file in os.listdir(processed_dir):
+        if not tif_file.lower().endswith((".tif", ".img")):
+            continue
+        tile_one(os.path.join(processed_dir, tif_file), web_tiles_dir, tile_size, workers, cache, tile_format)
+    print("✅ OpenCV pyramid tiles created.")
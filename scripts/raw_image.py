@@ -0,0 +1,83 @@
+import os
+import numpy as np
+from pds_label import read_label, image_layout, LabelError
+
+# ----------------------------
+# Zero-copy reader for raw PDS3 .IMG products
+# ----------------------------
+# The label gives the byte offset of the image and its record layout, so the
+# pixels can be exposed as a numpy.memmap view without converting to GeoTIFF.
+
+_SAMPLE_KINDS = {
+    "UNSIGNED_INTEGER": ">u", "MSB_UNSIGNED_INTEGER": ">u", "SUN_UNSIGNED_INTEGER": ">u",
+    "LSB_UNSIGNED_INTEGER": "<u", "PC_UNSIGNED_INTEGER": "<u", "VAX_UNSIGNED_INTEGER": "<u",
+    "INTEGER": ">i", "MSB_INTEGER": ">i", "SUN_INTEGER": ">i",
+    "LSB_INTEGER": "<i", "PC_INTEGER": "<i", "VAX_INTEGER": "<i",
+    "IEEE_REAL": ">f", "FLOAT": ">f", "REAL": ">f", "SUN_REAL": ">f",
+    "PC_REAL": "<f",
+}
+
+
+def sample_dtype(sample_type, sample_bits):
+    """numpy dtype for a PDS SAMPLE_TYPE / SAMPLE_BITS pair."""
+    kind = _SAMPLE_KINDS.get(str(sample_type).upper().replace(" ", "_"))
+    if kind is None or sample_bits % 8:
+        raise LabelError(f"unsupported SAMPLE_TYPE {sample_type} / SAMPLE_BITS {sample_bits}")
+    return np.dtype(f"{kind}{sample_bits // 8}")
+
+
+class RawImage:
+    """
+    Memory-mapped view of the first band of a PDS3 image.
+    `array` is an ndarray view (lines, line_samples); slicing it reads only the touched pages.
+    """
+
+    def __init__(self, path, label=None):
+        self.path = path
+        self.label = label if label is not None else read_label(path)
+        layout = image_layout(self.label)
+        self.layout = layout
+        data_path = path
+        if layout["file"]:
+            # Detached label: ^IMAGE = ("NAME.IMG", n) is relative to the label
+            data_path = os.path.join(os.path.dirname(path), layout["file"])
+        self.data_path = data_path
+        self.dtype = sample_dtype(layout["sample_type"], layout["sample_bits"])
+
+        lines, samples = layout["lines"], layout["line_samples"]
+        prefix, suffix = layout["line_prefix_bytes"], layout["line_suffix_bytes"]
+        line_bytes = prefix + samples * self.dtype.itemsize + suffix
+        if prefix == 0 and suffix == 0:
+            self.array = np.memmap(data_path, dtype=self.dtype, mode="r",
+                                   offset=layout["offset"], shape=(lines, samples))
+        else:
+            # Map whole records and take a strided view that skips prefix/suffix bytes
+            raw = np.memmap(data_path, dtype=np.uint8, mode="r",
+                            offset=layout["offset"], shape=(lines, line_bytes))
+            self.array = np.ndarray((lines, samples), dtype=self.dtype, buffer=raw,
+                                    offset=prefix, strides=(line_bytes, self.dtype.itemsize))
+
+    @property
+    def height(self):
+        return self.array.shape[0]
+
+    @property
+    def width(self):
+        return self.array.shape[1]
+
+    @property
+    def shape(self):
+        return self.array.shape
+
+    def read_window(self, row, col, height, width):
+        """View of a window, clipped to the image."""
+        return self.array[row:row + height, col:col + width]
+
+    def decimated(self, step, window=None):
+        """Every `step`-th line and sample (of `window`=(row, col, h, w) if given), as a view."""
+        arr = self.read_window(*window) if window else self.array
+        return arr[::step, ::step]
+
+    def rows(self, row, count):
+        """Native-endian copy of `count` full lines, for consumers that need contiguous data."""
+        return np.ascontiguousarray(self.array[row:row + count], dtype=self.dtype.newbyteorder("="))
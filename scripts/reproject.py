@@ -0,0 +1,333 @@
+import os
+import json
+import math
+import time
+import hashlib
+import argparse
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import cv2
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+from rasterio.windows import Window
+from pds_label import read_label
+from catalog import footprint_from_label, MARS_RADIUS_M
+from pyramid_tiles import open_rows
+from config import load_config
+from metrics import track, file_size
+
+# ----------------------------
+# Map projection stage
+# ----------------------------
+# Each product is warped onto a shared map grid so the mosaic can composite
+# real footprints instead of stacking strips side by side. The image geometry
+# comes from the label (corner / center lat-lon via catalog.footprint_from_label):
+# the four image corners are projected and the image is modelled as a bilinear
+# patch between them in map space. All products of a run use one projection
+# (equirectangular, or polar stereographic when every product is poleward of
+# POLAR_LAT) and one resolution, with origins snapped to multiples of it, so
+# their pixels line up exactly in the mosaic. Only labels that give the image
+# corners or its map bounds are warped: a box guessed around the center point or
+# from the product name is good enough to index, not to place pixels, so those
+# products are skipped.
+#
+# For every output pixel the warp needs the source (col, row). That is solved
+# (inverse bilinear, Newton) only on a coarse grid every GRID_STEP pixels and
+# interpolated in between; the coarse grid is small and cached per product in
+# <out_dir>/warp_grids, keyed by geometry, so re-runs skip it. The output is
+# warped in CHUNK_ROWS row chunks across a process pool (each worker reads only
+# the source rows its chunk needs) and written as a tiled, compressed GeoTIFF.
+
+CONFIG = load_config()
+RAW_DIR = CONFIG["raw_dir"]
+PROCESSED_DIR = CONFIG["processed_dir"]
+PROJECTED_DIR = CONFIG["projected_dir"]
+RESOLUTION = CONFIG["map_resolution"]  # metres per output pixel, shared by every product
+PROJECTION = CONFIG["map_projection"]  # "auto", "eqc", "polar"
+
+POLAR_LAT = 65.0  # "auto" uses polar stereographic when every product is poleward of this
+GRID_STEP = 32  # output pixels between exactly solved warp grid points
+CHUNK_ROWS = 1024
+BLOCK_SIZE = 512
+NODATA = 0
+WARPABLE = ("corners", "map_projection")  # footprint sources precise enough to warp from
+
+_PROJ = {
+    "eqc": f"+proj=eqc +lat_ts=0 +lat_0=0 +lon_0=0 +x_0=0 +y_0=0 +R={MARS_RADIUS_M} +units=m +no_defs",
+    "north": f"+proj=stere +lat_0=90 +lon_0=0 +k=1 +x_0=0 +y_0=0 +R={MARS_RADIUS_M} +units=m +no_defs",
+    "south": f"+proj=stere +lat_0=-90 +lon_0=0 +k=1 +x_0=0 +y_0=0 +R={MARS_RADIUS_M} +units=m +no_defs",
+}
+
+
+def choose_projection(center_lats, projection=PROJECTION):
+    """'eqc', 'north' or 'south' for a set of products."""
+    if projection == "eqc":
+        return "eqc"
+    if projection == "polar" or (center_lats and all(abs(lat) >= POLAR_LAT for lat in center_lats)):
+        south = sum(lat < 0 for lat in center_lats) > len(center_lats) / 2
+        return "south" if south else "north"
+    return "eqc"
+
+
+def project(kind, lat, lon):
+    """Degrees → map metres on the Mars sphere (same formulas as the PROJ strings above)."""
+    lat, lon = np.radians(np.asarray(lat, dtype=np.float64)), np.radians(np.asarray(lon, dtype=np.float64))
+    if kind == "eqc":
+        return MARS_RADIUS_M * lon, MARS_RADIUS_M * lat
+    if kind == "north":
+        k = 2 * MARS_RADIUS_M * np.tan(np.pi / 4 - lat / 2)
+        return k * np.sin(lon), -k * np.cos(lon)
+    k = 2 * MARS_RADIUS_M * np.tan(np.pi / 4 + lat / 2)
+    return k * np.sin(lon), k * np.cos(lon)
+
+
+def _unwrap(lons):
+    """Longitudes continuous around the first one and within (-180, 180] where possible."""
+    first = (lons[0] + 180.0) % 360.0 - 180.0
+    return [first + ((lon - first + 180.0) % 360.0 - 180.0) for lon in lons]
+
+
+def plan_product(label_path, kind, resolution=RESOLUTION, source=None):
+    """
+    Output geometry for one product: map corners (UL, UR, LR, LL of the image), snapped
+    bounds, size and a key identifying it. `source` is the raster to warp (default: label_path).
+    """
+    label = read_label(label_path)
+    fp = footprint_from_label(label, os.path.basename(label_path))
+    if fp is None:
+        raise ValueError(f"no footprint in the label of {label_path}")
+    if fp["source"] not in WARPABLE:
+        raise ValueError(f"{os.path.basename(label_path)}: the label has no corner or map coordinates, only an "
+                         f"approximate footprint from its {fp['source'].replace('_', ' ')}; not warping it")
+    source = source or label_path
+    with open_rows(source) as (w, h, _, _):
+        width, height = w, h
+    lats = [c[0] for c in fp["corners"]]
+    lons = _unwrap([c[1] for c in fp["corners"]])
+    xs, ys = project(kind, lats, lons)
+    left = math.floor(xs.min() / resolution) * resolution
+    top = math.ceil(ys.max() / resolution) * resolution
+    out_w = int(math.ceil((xs.max() - left) / resolution))
+    out_h = int(math.ceil((top - ys.min()) / resolution))
+    plan = {
+        "source": source, "kind": kind, "resolution": resolution, "footprint_source": fp["source"],
+        "center_lat": fp["center_lat"], "corners": [[float(x), float(y)] for x, y in zip(xs, ys)],
+        "src_width": width, "src_height": height,
+        "left": left, "top": top, "width": out_w, "height": out_h,
+    }
+    plan["key"] = hashlib.sha1(json.dumps({k: v for k, v in plan.items() if k != "source"},
+                                          sort_keys=True).encode()).hexdigest()
+    return plan
+
+
+def _inverse_bilinear(corners, x, y, iterations=8):
+    """(u, v) in [0, 1] image space for map points, inverting the bilinear corner patch."""
+    (x00, y00), (x10, y10), (x11, y11), (x01, y01) = corners
+    u = np.full(x.shape, 0.5)
+    v = np.full(x.shape, 0.5)
+    for _ in range(iterations):
+        px = (1 - u) * (1 - v) * x00 + u * (1 - v) * x10 + u * v * x11 + (1 - u) * v * x01 - x
+        py = (1 - u) * (1 - v) * y00 + u * (1 - v) * y10 + u * v * y11 + (1 - u) * v * y01 - y
+        dxu = (1 - v) * (x10 - x00) + v * (x11 - x01)
+        dyu = (1 - v) * (y10 - y00) + v * (y11 - y01)
+        dxv = (1 - u) * (x01 - x00) + u * (x11 - x10)
+        dyv = (1 - u) * (y01 - y00) + u * (y11 - y10)
+        det = dxu * dyv - dxv * dyu
+        det = np.where(np.abs(det) < 1e-12, 1e-12, det)
+        u -= (px * dyv - py * dxv) / det
+        v -= (py * dxu - px * dyu) / det
+    return u, v
+
+
+def warp_grid(plan, step=GRID_STEP):
+    """float32 (2, gh, gw) source (col, row) of every step-th output pixel centre; NaN outside the image."""
+    res = plan["resolution"]
+    gx = np.arange(0, plan["width"] + step, step, dtype=np.float64)
+    gy = np.arange(0, plan["height"] + step, step, dtype=np.float64)
+    x = plan["left"] + (gx[None, :] + 0.5) * res
+    y = plan["top"] - (gy[:, None] + 0.5) * res
+    x, y = np.broadcast_arrays(x, y)
+    with np.errstate(all="ignore"):
+        u, v = _inverse_bilinear(plan["corners"], x, y)
+    col = u * plan["src_width"] - 0.5
+    row = v * plan["src_height"] - 0.5
+    # Keep a margin of two grid cells so interpolation near the image edges stays defined
+    pad_u = 2 * step * res / (math.dist(*plan["corners"][:2]) or 1.0)
+    pad_v = 2 * step * res / (math.dist(plan["corners"][0], plan["corners"][3]) or 1.0)
+    outside = ~((u >= -pad_u) & (u <= 1 + pad_u) & (v >= -pad_v) & (v <= 1 + pad_v))
+    col[outside] = np.nan
+    row[outside] = np.nan
+    return np.stack([col, row]).astype(np.float32)
+
+
+def cached_grid(plan, grid_dir, step=GRID_STEP):
+    """warp_grid(plan) from <grid_dir>/<name>.npz when the geometry key matches, else computed and saved."""
+    path = os.path.join(grid_dir, os.path.splitext(os.path.basename(plan["source"]))[0] + ".npz")
+    try:
+        with np.load(path) as cached:
+            if str(cached["key"]) == plan["key"] and int(cached["step"]) == step:
+                return cached["grid"]
+    except (OSError, KeyError, ValueError):
+        pass
+    grid = warp_grid(plan, step)
+    os.makedirs(grid_dir, exist_ok=True)
+    tmp = path + ".tmp.npz"
+    np.savez(tmp, grid=grid, key=plan["key"], step=step)
+    os.replace(tmp, path)
+    return grid
+
+
+def _expand(grid, row0, rows, width, step):
+    """Bilinear interpolation of the coarse grid to per-pixel maps for output rows row0..row0+rows."""
+    r = np.arange(row0, row0 + rows)
+    iy, fy = r // step, ((r % step) / step)[:, None]
+    c = np.arange(width)
+    ix, fx = c // step, (c % step) / step
+    out = []
+    for g in grid:
+        band = g[iy] * (1 - fy) + g[iy + 1] * fy
+        out.append((band[:, ix] * (1 - fx) + band[:, ix + 1] * fx).astype(np.float32))
+    return out
+
+
+def _warp_chunk(args):
+    """Worker: warp `rows` output rows starting `row0` rows into `grid`. Returns the block or None."""
+    source, grid, row0, rows, width, step, nodata, interpolation = args
+    map_x, map_y = _expand(grid, row0, rows, width, step)
+    valid = np.isfinite(map_x) & np.isfinite(map_y)
+    if not valid.any():
+        return None
+    with open_rows(source) as (w, h, read_rows, src_nodata):
+        fill = src_nodata if src_nodata is not None else nodata
+        r0 = max(int(math.floor(map_y[valid].min())) - 1, 0)
+        r1 = min(int(math.ceil(map_y[valid].max())) + 2, h)
+        if r1 <= r0:
+            return None
+        data = np.asarray(read_rows(r0, r1 - r0))
+    dtype = data.dtype.newbyteorder("=")
+    data = data.astype(dtype, copy=False)
+    work = data if dtype in (np.uint8, np.uint16, np.int16, np.float32) else data.astype(np.float32)
+    map_x[~valid] = -1
+    map_y[~valid] = -1
+    map_y -= r0
+    src_valid = (data != fill).view(np.uint8)
+    out = cv2.remap(work, map_x, map_y, cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=fill)
+    if interpolation != cv2.INTER_NEAREST:
+        # Interpolate only where every contributing source pixel is valid; keep the
+        # nearest value along the image edges and fill margins instead of blending in fill
+        smooth = cv2.remap(work, map_x, map_y, interpolation, borderMode=cv2.BORDER_CONSTANT, borderValue=fill)
+        weight = cv2.remap(src_valid.astype(np.float32), map_x, map_y, interpolation,
+                           borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+        clean = weight >= 0.999
+        out[clean] = smooth[clean]
+    # Valid where the nearest source pixel is inside the image and not fill
+    inside = cv2.remap(src_valid, map_x, map_y, cv2.INTER_NEAREST, borderMode=cv2.BORDER_CONSTANT, borderValue=0)
+    out = out.astype(dtype, copy=False)
+    out[inside == 0] = nodata
+    return out
+
+
+def reproject_one(label_path, out_dir, kind, source=None, resolution=RESOLUTION, workers=None, cache=None,
+                  grid_dir=None, interpolation=cv2.INTER_LINEAR, nodata=NODATA):
+    """Warp one product (label from label_path, pixels from source) into out_dir/<name>.tif."""
+    source = source or label_path
+    name = os.path.splitext(os.path.basename(label_path))[0]
+    dst_path = os.path.join(out_dir, name + ".tif")
+    grid_dir = grid_dir or os.path.join(out_dir, "warp_grids")
+    params = {"kind": kind, "resolution": resolution, "step": GRID_STEP, "source": os.path.basename(source),
+              "interpolation": int(interpolation), "nodata": nodata}
+    if cache and cache.is_fresh("project", label_path, params, [dst_path]):
+        print(f"Up to date: {dst_path}")
+        return dst_path
+
+    start = time.perf_counter()
+    with track("project", name, file_size(source), kind=kind) as rec:
+        plan = plan_product(label_path, kind, resolution, source)
+        grid = cached_grid(plan, grid_dir)
+        with open_rows(source) as (_, _, read_rows, _):
+            dtype = read_rows(0, 1).dtype.newbyteorder("=")
+        profile = {
+            "driver": "GTiff", "width": plan["width"], "height": plan["height"], "count": 1,
+            "dtype": dtype.name, "crs": CRS.from_proj4(_PROJ[kind]), "nodata": nodata,
+            "transform": from_origin(plan["left"], plan["top"], resolution, resolution),
+            "tiled": True, "blockxsize": BLOCK_SIZE, "blockysize": BLOCK_SIZE,
+            "compress": "deflate", "predictor": 2 if dtype.kind in "ui" else 3, "BIGTIFF": "IF_SAFER",
+        }
+        os.makedirs(out_dir, exist_ok=True)
+        tmp_path = dst_path + ".part.tif"
+        jobs = [(source, grid[:, r // GRID_STEP:(r + CHUNK_ROWS) // GRID_STEP + 2], r % GRID_STEP,
+                 min(CHUNK_ROWS, plan["height"] - r), plan["width"], GRID_STEP, nodata, interpolation)
+                for r in range(0, plan["height"], CHUNK_ROWS)]
+        workers = workers or os.cpu_count()
+        with rasterio.open(tmp_path, "w", **profile) as dst, ProcessPoolExecutor(max_workers=workers) as pool:
+            # At most 2 chunks per worker in flight; written in order as they come back
+            pending = deque()
+            for job, row in zip(jobs, range(0, plan["height"], CHUNK_ROWS)):
+                pending.append((row, pool.submit(_warp_chunk, job)))
+                if len(pending) >= 2 * workers:
+                    _write_chunk(dst, *pending.popleft())
+            while pending:
+                _write_chunk(dst, *pending.popleft())
+        os.replace(tmp_path, dst_path)
+        rec.update(width=plan["width"], height=plan["height"], chunks=len(jobs), bytes_out=file_size(dst_path))
+    print(f"Projected {name} ({plan['footprint_source']}) → {plan['width']}x{plan['height']} {kind} "
+          f"in {time.perf_counter() - start:.1f}s")
+    if cache:
+        cache.record("project", label_path, params, [dst_path], digest=False)
+    return dst_path
+
+
+def _write_chunk(dst, row, fut):
+    data = fut.result()
+    if data is not None:
+        dst.write(data, 1, window=Window(0, row, data.shape[1], data.shape[0]))
+
+
+def reproject_dir(raw_dir, out_dir, processed_dir=None, projection=PROJECTION, resolution=RESOLUTION,
+                  workers=None, cache=None):
+    """
+    Project every labelled .IMG in raw_dir (pixels from processed_dir/<name>.tif when it exists)
+    onto one grid; products whose label only gives an approximate footprint are skipped.
+    Returns the output paths.
+    """
+    labels, lats = [], []
+    for fname in sorted(f for f in os.listdir(raw_dir) if f.upper().endswith(".IMG")):
+        try:
+            fp = footprint_from_label(read_label(os.path.join(raw_dir, fname)), fname)
+        except Exception:
+            fp = None
+        if fp is None or fp["source"] not in WARPABLE:
+            how = f"only an approximate footprint ({fp['source']})" if fp else "no footprint"
+            print(f"⚠️ Skipping {fname}: {how} in its label, it cannot be placed on the map grid")
+            continue
+        labels.append(fname)
+        lats.append(fp["center_lat"])
+    kind = choose_projection(lats, projection)
+    print(f"Projecting {len(labels)} products to {kind} at {resolution} m/pixel")
+
+    done = []
+    for fname in labels:
+        label_path = os.path.join(raw_dir, fname)
+        tif = os.path.join(processed_dir, os.path.splitext(fname)[0] + ".tif") if processed_dir else None
+        source = tif if tif and os.path.exists(tif) else label_path
+        try:
+            done.append(reproject_one(label_path, out_dir, kind, source, resolution, workers, cache))
+        except Exception as e:
+            print(f"Failed to project {fname}: {e}")
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Warp products onto a common equirectangular/polar grid")
+    parser.add_argument("raw_dir", nargs="?", default=RAW_DIR, help="directory of labelled .IMG products")
+    parser.add_argument("-o", "--out", default=PROJECTED_DIR)
+    parser.add_argument("--processed-dir", default=PROCESSED_DIR, help="read pixels from <name>.tif here if present")
+    parser.add_argument("--projection", choices=["auto", "eqc", "polar"], default=PROJECTION)
+    parser.add_argument("--resolution", type=float, default=RESOLUTION)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    out = reproject_dir(args.raw_dir, args.out, args.processed_dir, args.projection, args.resolution, args.workers)
+    print(f"✅ {len(out)} products projected into {args.out}")
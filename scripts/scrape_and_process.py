@@ -1,88 +1,42 @@
 import os
-import time
-import requests
-from bs4 import BeautifulSoup
-from tqdm import tqdm
-from osgeo import gdal
+import argparse
+from config import load_config
+from downloader import download_files, get_img_links, fetch_checksums
 import rasterio
+from rasterio.io import MemoryFile
 from rasterio.windows import Window
+from tile_archive import TileArchive
 
 # ----------------------------
 # User Config
 # ----------------------------
-VOLUME_URL = "https://planetarydata.jpl.nasa.gov/img/data/mro/ctx/mrox_4122/"
-RAW_DIR = "C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/raw/ctx/mrox_4122"
-PROCESSED_DIR = "C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/processed/ctx_mrox_4122"
-TILE_DIR = "C:/Users/himan/Desktop/Spaceapps/spaceapps_challenge/data/tiles/ctx_mrox_4122"
+# Volume, directories and download settings come from config.py (ctx.json / CTX_* variables);
+# GeoTIFF tiles go to <data_dir>/tiles/<volume> unless --tile-dir says otherwise.
 TILE_SIZE = 512
-DOWNLOAD_LIMIT = 5  # Set None to download all files
-DOWNLOAD_DELAY = 1  # seconds between downloads
-
-# Enable GDAL exceptions
-gdal.UseExceptions()
+TILE_FORMAT = "files"  # "files" = <product>_tile_{x}_{y}.tif, "mbtiles" = one packed <product>.mbtiles per product
 
 # ----------------------------
 # Helper Functions
 # ----------------------------
 
-def get_img_links(volume_url):
-    if not volume_url.endswith('/'):
-        volume_url += '/'
-    data_url = volume_url + "data/"
-    headers = {"User-Agent": "Mozilla/5.0"}
-    try:
-        resp = requests.get(data_url, headers=headers, timeout=30)
-        resp.raise_for_status()
-    except Exception as e:
-        print(f"Error accessing {data_url}: {e}")
-        return []
-    soup = BeautifulSoup(resp.text, 'html.parser')
-    links = [data_url + a['href'] for a in soup.find_all('a', href=True)
-             if a['href'].upper().endswith(('.IMG', '.LBL'))]
-    return links
-
-def download_files(links, dest_folder, limit=None, delay=1):
-    os.makedirs(dest_folder, exist_ok=True)
-    if limit:
-        links = links[:limit]
-    for link in tqdm(links, desc="Downloading files"):
-        fname = os.path.join(dest_folder, os.path.basename(link))
-        if os.path.exists(fname):
-            continue
-        try:
-            headers = {"User-Agent": "Mozilla/5.0"}
-            resp = requests.get(link, stream=True, headers=headers, timeout=30)
-            with open(fname, 'wb') as f:
-                for chunk in resp.iter_content(1024):
-                    if chunk:
-                        f.write(chunk)
-            time.sleep(delay)
-        except Exception as e:
-            print(f"Error downloading {link}: {e}")
-
-def convert_img_to_tif(raw_dir, out_dir):
-    os.makedirs(out_dir, exist_ok=True)
-    for fname in os.listdir(raw_dir):
-        if fname.upper().endswith(".IMG"):
-            src_path = os.path.join(raw_dir, fname)
-            dst_path = os.path.join(out_dir, fname.replace(".IMG", ".tif"))
-            print(f"Converting {fname} → {dst_path}")
-            try:
-                gdal.Translate(
-                    dst_path,
-                    src_path,
-                    options=gdal.TranslateOptions(format='GTiff', creationOptions=['BIGTIFF=YES'])
-                )
-            except Exception as e:
-                print(f"Failed to convert {fname}: {e}")
-
-def tile_tifs(processed_dir, tile_dir, tile_size=512):
+def tile_tifs(processed_dir, tile_dir, tile_size=512, nodata=0, tile_format=TILE_FORMAT):
+    """
+    Cut each .tif into georeferenced tile_size GeoTIFFs, skipping tiles that are all nodata.
+    With tile_format="mbtiles" the tiles of a product go into tile_dir/<product>.mbtiles
+    (zoom 0, column/row = tile index) instead of one file each; every tile body is still a
+    complete GeoTIFF, so it keeps its own transform.
+    """
     os.makedirs(tile_dir, exist_ok=True)
+    written = skipped = 0
     for fname in os.listdir(processed_dir):
         if fname.lower().endswith(".tif"):
             path = os.path.join(processed_dir, fname)
+            archive = None
             try:
                 with rasterio.open(path) as src:
+                    if tile_format == "mbtiles":
+                        archive = TileArchive(os.path.join(tile_dir, fname[:-4] + ".mbtiles"), "w")
+                    fill = src.nodata if src.nodata is not None else nodata
                     for i in range(0, src.width, tile_size):
                         for j in range(0, src.height, tile_size):
                             w = min(tile_size, src.width - i)
@@ -90,21 +44,52 @@ def tile_tifs(processed_dir, tile_dir, tile_size=512):
                             window = Window(i, j, w, h)
                             transform = src.window_transform(window)
                             tile = src.read(1, window=window)
+                            if not (tile != fill).any():
+                                skipped += 1
+                                continue
                             profile = src.profile
                             profile.update({"width": w, "height": h, "transform": transform})
-                            out_name = f"{fname[:-4]}_tile_{i}_{j}.tif"
-                            out_path = os.path.join(tile_dir, out_name)
-                            with rasterio.open(out_path, "w", **profile) as dst:
-                                dst.write(tile, 1)
+                            if archive:
+                                with MemoryFile() as mem:
+                                    with mem.open(**profile) as dst:
+                                        dst.write(tile, 1)
+                                    archive.put(0, i // tile_size, j // tile_size, mem.read())
+                            else:
+                                out_name = f"{fname[:-4]}_tile_{i}_{j}.tif"
+                                out_path = os.path.join(tile_dir, out_name)
+                                with rasterio.open(out_path, "w", **profile) as dst:
+                                    dst.write(tile, 1)
+                            written += 1
+                    if archive:
+                        archive.set_metadata(name=fname[:-4], format="tif", scheme="xyz", tile_size=tile_size,
+                                             width=src.width, height=src.height, minzoom=0, maxzoom=0)
             except Exception as e:
                 print(f"Failed to tile {fname}: {e}")
+            finally:
+                if archive:
+                    archive.close()
+    print(f"Wrote {written} tiles, skipped {skipped} blank tiles")
 
 # ----------------------------
 # Main Workflow
 # ----------------------------
 if __name__ == "__main__":
+    from tif_convert import convert_img_to_tif  # GDAL is only needed for the full workflow, not tile_tifs
+
+    parser = argparse.ArgumentParser(description="Download, convert and cut a volume into GeoTIFF tiles")
+    parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+    parser.add_argument("--volume", help="volume name, e.g. mrox_4122")
+    parser.add_argument("--limit", type=int, help="number of files to download (0 = all)")
+    parser.add_argument("--tile-dir", help="default: <data_dir>/tiles/<volume>")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--tile-format", choices=["files", "mbtiles"], help="default: tile_format setting")
+    args = parser.parse_args()
+    cfg = load_config(args.config, volume=args.volume, download_limit=args.limit, tile_format=args.tile_format)
+    volume_url, raw_dir, processed_dir = cfg["volume_url"], cfg["raw_dir"], cfg["processed_dir"]
+    tile_dir = args.tile_dir or os.path.join(cfg["data_dir"], "tiles", cfg["volume"])
+
     print("1️⃣ Getting file links...")
-    links = get_img_links(VOLUME_URL)
+    links = get_img_links(volume_url)
     print(f"Found {len(links)} files.")
 
     if not links:
@@ -112,12 +97,14 @@ if __name__ == "__main__":
         exit()
 
     print("2️⃣ Downloading files...")
-    download_files(links, RAW_DIR, limit=DOWNLOAD_LIMIT, delay=DOWNLOAD_DELAY)
+    checksums = fetch_checksums(volume_url, cfg["md5_manifest"]) if cfg["md5_manifest"] != "" else {}
+    download_files(links, raw_dir, limit=cfg["download_limit"] or None, delay=cfg["download_delay"],
+                   workers=cfg["download_workers"], checksums=checksums)
 
     print("3️⃣ Converting .IMG → .tif...")
-    convert_img_to_tif(RAW_DIR, PROCESSED_DIR)
+    convert_img_to_tif(raw_dir, processed_dir, None, cfg["tif_mode"], cfg["tif_compress"], cfg["convert_workers"])
 
     print("4️⃣ Tiling .tif images...")
-    tile_tifs(PROCESSED_DIR, TILE_DIR, TILE_SIZE)
+    tile_tifs(processed_dir, tile_dir, args.tile_size, tile_format=cfg["tile_format"])
 
     print("\n✅ Workflow complete!")
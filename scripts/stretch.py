@@ -0,0 +1,179 @@
+import os
+import json
+import hashlib
+import tempfile
+import numpy as np
+from config import load_config
+
+# ----------------------------
+# Global 8-bit stretch
+# ----------------------------
+# One chunked pass over a product builds a histogram of its valid pixels, from
+# which a percentile clip (low, high) is taken. The result is cached in
+# stretch_dir (metadata, so read-only source directories work) so every tile of
+# the product (pre-rendered or rendered on demand) is mapped with the same curve
+# and there are no seams. The cache file is replaced atomically: concurrent
+# writers only ever race to store the same stats.
+# Integer data is mapped through a lookup table, floats with one affine pass.
+# Output value 0 is reserved for nodata; valid pixels map to 1..255.
+
+STATS_DIR = None  # None = the stretch_dir setting, looked up when a stats file is needed
+CLIP = (0.5, 99.5)  # percentiles
+BINS = 4096
+
+
+class StreamingHistogram:
+    """
+    Fixed number of bins whose range grows (by powers of two) as new data arrives,
+    so it needs a single pass. Integer data starts with unit-width bins and stays
+    exact until the value span exceeds `bins`.
+    """
+
+    def __init__(self, bins=BINS):
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.lo = None
+        self.width = None
+        self.min = None
+        self.max = None
+        self.integer = False
+
+    def _grow(self, lo, hi):
+        """Double the bin width until [lo, hi] fits, merging the existing counts."""
+        lo = min(lo, self.lo)
+        width = self.width
+        while True:
+            width *= 2
+            new_lo = np.floor(lo / width) * width
+            if hi < new_lo + self.bins * width:
+                break
+        nz = np.nonzero(self.counts)[0]
+        centers = self.lo + (nz + 0.5) * self.width
+        counts = np.zeros(self.bins, dtype=np.int64)
+        np.add.at(counts, ((centers - new_lo) // width).astype(np.int64), self.counts[nz])
+        self.counts, self.lo, self.width = counts, new_lo, width
+
+    def update(self, data, nodata=None):
+        values = np.asarray(data).ravel()
+        if nodata is not None:
+            values = values[values != nodata]
+        if values.dtype.kind == "f":
+            values = values[np.isfinite(values)]
+        if not values.size:
+            return
+        lo, hi = values.min().item(), values.max().item()
+        if self.lo is None:
+            self.integer = values.dtype.kind in "ui"
+            if self.integer:
+                self.lo, self.width = float(lo), 1.0
+            else:
+                self.lo, self.width = float(lo), max((hi - lo) / self.bins, 1e-12)
+        if hi >= self.lo + self.bins * self.width or lo < self.lo:
+            self._grow(lo, hi)
+        idx = ((values - self.lo) // self.width).astype(np.int64)
+        self.counts += np.bincount(np.clip(idx, 0, self.bins - 1), minlength=self.bins)
+        self.min = lo if self.min is None else min(self.min, lo)
+        self.max = hi if self.max is None else max(self.max, hi)
+
+    def percentile(self, p):
+        total = self.counts.sum()
+        if not total:
+            return None
+        i = int(np.searchsorted(np.cumsum(self.counts), total * p / 100.0))
+        value = self.lo + (min(i, self.bins - 1) + 0.5) * self.width
+        if self.integer:
+            value = np.floor(value)
+        return float(min(max(value, self.min), self.max))
+
+
+def compute_stats(read_rows, height, nodata=None, band_rows=1024, clip=CLIP):
+    """Single pass over read_rows(row, count); returns the stretch parameters as a dict."""
+    hist = StreamingHistogram()
+    dtype = None
+    for row in range(0, height, band_rows):
+        rows = read_rows(row, min(band_rows, height - row))
+        dtype = rows.dtype
+        hist.update(rows, nodata)
+    low, high = hist.percentile(clip[0]), hist.percentile(clip[1])
+    return {
+        "dtype": str(dtype), "nodata": nodata, "clip": list(clip),
+        "min": hist.min, "max": hist.max, "low": low, "high": high,
+        "valid_pixels": int(hist.counts.sum()),
+    }
+
+
+def stats_path(source, stats_dir=None):
+    """<stats_dir>/<name>.<hash of the source path>.stretch.json (same-named sources in other dirs don't clash)."""
+    name = os.path.splitext(os.path.basename(source))[0]
+    digest = hashlib.blake2b(os.path.abspath(source).encode(), digest_size=6).hexdigest()
+    stats_dir = stats_dir or STATS_DIR or load_config()["stretch_dir"]
+    return os.path.join(stats_dir, f"{name}.{digest}.stretch.json")
+
+
+def load_stats(source, clip=CLIP, check_source=True):
+    """
+    Cached stats for `source`, or None if missing or stale (source changed or other clip).
+    check_source=False accepts stats of an earlier version of the source, which is what an
+    incremental re-tile wants: the untouched tiles were mapped with that curve.
+    """
+    try:
+        with open(stats_path(source)) as f:
+            stats = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stats.get("clip") != list(clip):
+        return None
+    st = os.stat(source)
+    if check_source and (stats.get("source_size"), stats.get("source_mtime_ns")) != (st.st_size, st.st_mtime_ns):
+        return None
+    return stats
+
+
+def save_stats(source, stats):
+    st = os.stat(source)
+    stats = {**stats, "source_size": st.st_size, "source_mtime_ns": st.st_mtime_ns}
+    path = stats_path(source)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(stats, f, indent=2)
+        os.replace(tmp, path)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    return stats
+
+
+def stretcher(stats, nodata=None):
+    """
+    Return fn(rows) -> uint8 rows mapping [low, high] to 1..255 and nodata to 0.
+    Integers of up to 16 bits go through a lookup table.
+    """
+    low, high = stats["low"], stats["high"]
+    if low is None:
+        return lambda rows: np.zeros(rows.shape, dtype=np.uint8)
+    scale = 254.0 / max(high - low, 1e-12)
+    dtype = np.dtype(stats["dtype"])
+
+    if dtype.kind in "ui" and dtype.itemsize <= 2:
+        offset = int(np.iinfo(dtype).min)
+        values = np.arange(offset, int(np.iinfo(dtype).max) + 1, dtype=np.float64)
+        lut = (np.clip((values - low) * scale, 0, 254) + 1).round().astype(np.uint8)
+        if nodata is not None and np.iinfo(dtype).min <= nodata <= np.iinfo(dtype).max:
+            lut[int(nodata) - offset] = 0
+
+        def apply(rows):
+            return lut[rows.astype(np.int32) - offset] if offset else lut[rows]
+        return apply
+
+    def apply(rows):
+        out = np.clip((rows - low) * scale, 0, 254)
+        out += 1
+        out = out.round().astype(np.uint8)
+        invalid = ~np.isfinite(rows) if rows.dtype.kind == "f" else np.zeros(rows.shape, dtype=bool)
+        if nodata is not None:
+            invalid |= rows == nodata
+        out[invalid] = 0
+        return out
+    return apply
@@ -0,0 +1,63 @@
+import pytest
+from crawler import crawl_volumes, product_links
+from mirror import MirrorServer
+
+
+def _label(columns):
+    """Index .LBL describing fixed-width `columns` [(name, start byte, bytes)]."""
+    lines = ["PDS_VERSION_ID = PDS3", "OBJECT = INDEX_TABLE", "  INTERCHANGE_FORMAT = ASCII"]
+    for name, start, size in columns:
+        lines += ["  OBJECT = COLUMN", f"    NAME = {name}", f"    START_BYTE = {start}", f"    BYTES = {size}",
+                  "  END_OBJECT = COLUMN"]
+    return ("\n".join(lines + ["END_OBJECT = INDEX_TABLE", "END"]) + "\n").encode()
+
+
+def _row(*fields):
+    return (",".join(f'"{f}"' for f in fields) + "\r\n").encode()
+
+
+# "MROX_0004","DATA/D01.IMG","D01" -> VOLUME_ID at byte 2 (9), file at 14 (12), product id at 29 (3)
+CUMINDEX_LBL = _label([("VOLUME_ID", 2, 9), ("FILE_SPECIFICATION_NAME", 14, 12), ("PRODUCT_ID", 29, 3)])
+CUMINDEX = _row("MROX_0001", "DATA/A01.IMG", "A01") + _row("MROX_0004", "DATA/D01.IMG", "D01")
+# A per-volume index without a VOLUME_ID column
+INDEX_LBL = _label([("FILE_SPECIFICATION_NAME", 2, 12), ("PRODUCT_ID", 17, 3)])
+INDEX = _row("DATA/C01.IMG", "C01") + _row("DATA/C02.IMG", "C02")
+
+
+@pytest.fixture
+def mirror():
+    files = {
+        "/ctx/": b'<a href="mrox_0001/">mrox_0001/</a> <a href="mrox_0002/">mrox_0002/</a> '
+                 b'<a href="mrox_0003/">mrox_0003/</a> <a href="mrox_0004/">mrox_0004/</a>',
+        "/ctx/mrox_0004/index/cumindex.tab": CUMINDEX,
+        "/ctx/mrox_0004/index/cumindex.lbl": CUMINDEX_LBL,
+        "/ctx/mrox_0003/index/index.tab": INDEX,
+        "/ctx/mrox_0003/index/index.lbl": INDEX_LBL,
+        "/ctx/mrox_0002/data/": b'<a href="B01.IMG">B01.IMG</a> <a href="B01.LBL">B01.LBL</a>',
+    }
+    for path, size in (("mrox_0001/data/A01.IMG", 10), ("mrox_0002/data/B01.IMG", 20),
+                       ("mrox_0003/data/C01.IMG", 30), ("mrox_0003/data/C02.IMG", 31),
+                       ("mrox_0004/data/D01.IMG", 40)):
+        files["/ctx/" + path] = b"\0" * size
+    with MirrorServer(files) as server:
+        yield server
+
+
+def test_crawl_uses_cumulative_index_then_volume_index_then_html(mirror, tmp_path):
+    db = str(tmp_path / "crawl.sqlite")
+    links, sizes = crawl_volumes(None, db, root_url=mirror.url + "/ctx/", concurrency=2)
+    assert sorted(links) == sorted(mirror.url + "/ctx/" + p for p in (
+        "mrox_0001/data/A01.IMG", "mrox_0002/data/B01.IMG", "mrox_0003/data/C01.IMG",
+        "mrox_0003/data/C02.IMG", "mrox_0004/data/D01.IMG"))
+    assert sizes == {"A01.IMG": 10, "B01.IMG": 20, "C01.IMG": 30, "C02.IMG": 31, "D01.IMG": 40}
+    # mrox_0001 came from the newest volume's cumulative index: its own index and listing were never fetched
+    assert not [r for r in mirror.requests if r[0] == "GET" and r[1].startswith("/ctx/mrox_0001/")]
+    assert product_links(db, ["mrox_0003"])[0] == [mirror.url + "/ctx/mrox_0003/data/C01.IMG",
+                                                   mirror.url + "/ctx/mrox_0003/data/C02.IMG"]
+
+
+def test_recrawl_reuses_catalog(mirror, tmp_path):
+    db = str(tmp_path / "crawl.sqlite")
+    first = crawl_volumes([mirror.url + "/ctx/mrox_0003"], db, sizes=False)
+    assert first == ([mirror.url + "/ctx/mrox_0003/data/C01.IMG", mirror.url + "/ctx/mrox_0003/data/C02.IMG"], {})
+    assert crawl_volumes([mirror.url + "/ctx/mrox_0003"], db, sizes=False) == first
@@ -0,0 +1,73 @@
+import os
+import hashlib
+import pytest
+from downloader import download_file, download_files, fetch_checksums, make_session, PART_SUFFIX
+from mirror import MirrorServer
+
+DATA = os.urandom(3 * 1024 * 1024 + 17)
+MD5 = hashlib.md5(DATA).hexdigest()
+
+
+@pytest.fixture
+def mirror():
+    with MirrorServer({"/vol/data/P01.IMG": DATA,
+                       "/vol/md5sums.txt": f"{MD5}  data/P01.IMG\n".encode()}) as server:
+        yield server
+
+
+def test_resumes_partial_file_with_range(mirror, tmp_path):
+    dest = str(tmp_path / "P01.IMG")
+    with open(dest + PART_SUFFIX, "wb") as f:
+        f.write(DATA[:1000])
+    n = download_file(make_session(), mirror.url + "/vol/data/P01.IMG", dest, len(DATA), MD5)
+    assert n == len(DATA) - 1000
+    assert ("GET", "/vol/data/P01.IMG", "bytes=1000-") in mirror.requests
+    with open(dest, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(dest + PART_SUFFIX)
+
+
+def test_complete_part_file_is_finished_on_416(mirror, tmp_path):
+    dest = str(tmp_path / "P01.IMG")
+    with open(dest + PART_SUFFIX, "wb") as f:
+        f.write(DATA)
+    assert download_file(make_session(), mirror.url + "/vol/data/P01.IMG", dest, len(DATA)) == 0
+    assert os.path.getsize(dest) == len(DATA)
+
+
+@pytest.mark.parametrize("expected_size", [None, len(DATA)])
+def test_oversized_part_file_restarts_from_zero(mirror, tmp_path, expected_size):
+    dest = str(tmp_path / "P01.IMG")
+    with open(dest + PART_SUFFIX, "wb") as f:
+        f.write(DATA + b"stale tail")  # e.g. left over from an older, longer version of the file
+    n = download_file(make_session(), mirror.url + "/vol/data/P01.IMG", dest, expected_size, MD5)
+    assert n == len(DATA)
+    with open(dest, "rb") as f:
+        assert f.read() == DATA
+    assert not os.path.exists(dest + PART_SUFFIX)
+
+
+def test_size_mismatch_is_not_renamed_into_place(mirror, tmp_path):
+    dest = str(tmp_path / "P01.IMG")
+    with pytest.raises(IOError, match="does not match index size"):
+        download_file(make_session(), mirror.url + "/vol/data/P01.IMG", dest, len(DATA) + 1)
+    assert not os.path.exists(dest)
+
+
+def test_md5_mismatch_discards_the_download(mirror, tmp_path):
+    dest = str(tmp_path / "P01.IMG")
+    with pytest.raises(IOError, match="md5 mismatch"):
+        download_file(make_session(), mirror.url + "/vol/data/P01.IMG", dest, len(DATA), "0" * 32)
+    assert not os.path.exists(dest)
+    assert not os.path.exists(dest + PART_SUFFIX)
+
+
+def test_download_files_checks_the_volume_manifest(mirror, tmp_path):
+    checksums = fetch_checksums(mirror.url + "/vol")
+    assert checksums == {"P01.IMG": MD5}
+    done = download_files([mirror.url + "/vol/data/P01.IMG"], str(tmp_path), checksums=checksums)
+    assert done == [str(tmp_path / "P01.IMG")]
+
+    mirror.files["/vol/data/P01.IMG"] = DATA[:-1] + b"x"  # corrupted on the mirror
+    os.remove(done[0])
+    assert download_files([mirror.url + "/vol/data/P01.IMG"], str(tmp_path), checksums=checksums) == []
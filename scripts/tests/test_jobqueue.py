@@ -0,0 +1,34 @@
+import os
+import time
+import hashlib
+from jobqueue import JobQueue, enqueue_volume, run_worker
+from mirror import MirrorServer
+
+DATA = os.urandom(64 * 1024)
+
+
+def test_host_spacing_is_shared_through_the_db(tmp_path):
+    db = str(tmp_path / "queue.sqlite")
+    a, b = JobQueue(db), JobQueue(db)  # two workers with their own connections
+    waits = [q.reserve_host("pds.example", 10.0) for q in (a, b, a)]
+    assert waits[0] <= 0.0
+    assert 9.0 < waits[1] <= 10.0 and 19.0 < waits[2] <= 20.0
+    assert a.reserve_host("other.example", 10.0) <= 0.0
+
+
+def test_download_jobs_are_spaced_and_md5_checked(tmp_path):
+    files = {f"/vol/data/P0{i}.IMG": DATA for i in range(3)}
+    with MirrorServer(files) as mirror:
+        queue = JobQueue(str(tmp_path / "queue.sqlite"), max_attempts=1)
+        links = [mirror.url + path for path in sorted(files)]
+        md5 = hashlib.md5(DATA).hexdigest()
+        checksums = {"P00.IMG": md5, "P01.IMG": md5, "P02.IMG": "0" * 32}
+        assert enqueue_volume(queue, links, {"P00.IMG": len(DATA)}, checksums) == 3
+        cfg = {"raw_dir": str(tmp_path / "raw"), "download_delay": 0.2, "convert_to_tif": False}
+        start = time.perf_counter()
+        done = run_worker(queue, cfg, stages=["download"], chain=["download"], max_jobs=3)
+        assert time.perf_counter() - start >= 0.4  # 3 requests, 0.2 s apart
+    assert done == 2
+    assert sorted(os.listdir(tmp_path / "raw")) == ["P00.IMG", "P01.IMG"]
+    assert queue.counts()["download"] == {"done": 2, "dead": 1}
+    assert "md5 mismatch" in queue.dead_letters()[0]["error"]
@@ -0,0 +1,40 @@
+import os
+import numpy as np
+import rasterio
+from rasterio.crs import CRS
+from rasterio.transform import from_origin
+import merge_ctx_basemap
+from mosaic import footprints_for
+
+
+def _product(path, x0, y0, value, size=300):
+    with rasterio.open(path, "w", driver="GTiff", width=size, height=size, count=1, dtype="uint8", nodata=0,
+                       crs=CRS.from_epsg(32633), transform=from_origin(x0, y0, 6, 6)) as dst:
+        dst.write(np.full((size, size), value, np.uint8), 1)
+    return path
+
+
+def _tiles(root):
+    found = {}
+    for d, _, names in os.walk(root):
+        for name in names:
+            with open(os.path.join(d, name), "rb") as f:
+                found[os.path.relpath(os.path.join(d, name), root)] = f.read()
+    return found
+
+
+def test_loose_tile_pyramid_is_patched_on_every_update(tmp_path, monkeypatch):
+    full = []
+    tile_pyramid = merge_ctx_basemap.tile_pyramid
+    monkeypatch.setattr(merge_ctx_basemap, "tile_pyramid", lambda *a, **k: full.append(a) or tile_pyramid(*a, **k))
+    out, tiles = str(tmp_path / "basemap.tif"), str(tmp_path / "tiles")
+    paths = [_product(str(tmp_path / "A.tif"), 0, 0, 50)]
+    for value in (80, 110, 140):
+        footprints, crs = footprints_for(paths, layout="auto")
+        merge_ctx_basemap.update_basemap(footprints, crs, out, tiles, 256)
+        paths.append(_product(str(tmp_path / f"P{value}.tif"), 600 * len(paths), -300, value))
+    assert len(full) == 1  # only the first build tiles everything; the directory's mtime plays no part
+    ref = str(tmp_path / "ref")
+    tile_pyramid(out, ref, 256)
+    assert _tiles(tiles) == _tiles(ref)
+
@@ -0,0 +1,30 @@
+import json
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from patches import PatchDataset, export_patches
+
+
+def _raster(path, dtype, nodata, value):
+    data = np.full((64, 64), value, dtype)
+    data[:, :32] = nodata  # the left half is nodata
+    with rasterio.open(path, "w", driver="GTiff", width=64, height=64, count=1, dtype=dtype, nodata=nodata,
+                       transform=from_origin(0, 0, 6, 6)) as dst:
+        dst.write(data, 1)
+    return path
+
+
+def test_mixed_sample_types_need_an_explicit_dtype(tmp_path):
+    paths = [_raster(str(tmp_path / "A.tif"), "uint8", 0, 7), _raster(str(tmp_path / "B.tif"), "uint16", 9, 300)]
+    with pytest.raises(ValueError, match="different sample types"):
+        export_patches(paths, str(tmp_path / "out"), 32)
+
+    out = str(tmp_path / "cast")
+    assert export_patches(paths, out, 32, min_valid=0.5, dtype="uint16") == 4
+    with open(f"{out}/patches.json") as f:
+        info = json.load(f)
+    assert info["dtype"] == "<u2" and info["source_dtypes"] == ["|u1", "<u2"]
+    assert info["nodata"] == [0, 9]  # each product's own nodata, not the default argument
+    ds = PatchDataset(out)
+    assert [int(ds[i].max()) for i in range(len(ds))] == [7, 7, 300, 300]
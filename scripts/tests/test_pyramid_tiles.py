@@ -0,0 +1,51 @@
+import os
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+from pyramid_tiles import ParallelBandWriter, PyramidTiler, tile_pyramid
+from tile_archive import TileArchive
+
+W, H, TS = 300, 1100, 64
+
+
+def _write(path, blank_from=None):
+    data = (np.arange(W * H).reshape(H, W) % 200 + 20).astype(np.uint8)
+    if blank_from is not None:
+        data[blank_from:] = 0
+    with rasterio.open(path, "w", driver="GTiff", width=W, height=H, count=1, dtype="uint8",
+                       transform=from_origin(0, 0, 6, 6)) as dst:
+        dst.write(data, 1)
+    return data
+
+
+def _files(root):
+    return sorted(os.path.relpath(os.path.join(d, f), root) for d, _, names in os.walk(root) for f in names)
+
+
+def test_parallel_rebuild_drops_tiles_that_became_blank(tmp_path):
+    src, out, ref = str(tmp_path / "P.tif"), str(tmp_path / "tiles"), str(tmp_path / "ref")
+    _write(src)
+    tile_pyramid(src, out, TS, workers=2)
+    _write(src, blank_from=512)  # tile rows 8.. of the finest level are now nodata only
+    tile_pyramid(src, out, TS, workers=2)
+    tile_pyramid(src, ref, TS, workers=2)
+    assert _files(out) == _files(ref)
+    assert not [f for f in _files(out) if f.startswith("level_11") and int(f.split("_")[-1][:-4]) >= 512]
+
+
+def test_parallel_writer_deletes_blank_tiles_from_an_existing_archive(tmp_path):
+    path = str(tmp_path / "P.mbtiles")
+    full = _write(str(tmp_path / "P.tif"))
+    blank = full.copy()
+    blank[512:] = 0
+    blank[:, :TS] = 0  # also an EMPTY tile in rows that still have data
+    for mode, data in (("w", full), ("a", blank)):
+        with TileArchive(path, mode) as archive:
+            writer = ParallelBandWriter(None, TS, 2, archive=archive, nodata=0)
+            tiler = PyramidTiler(W, H, tile_size=TS, write_band=writer, nodata=0)
+            tiler.push(tiler.max_level, data)
+            tiler.finish()
+            writer.close()
+    with TileArchive(path) as archive:
+        finest = archive.conn.execute("SELECT tile_column, tile_row FROM map WHERE zoom_level = 11").fetchall()
+    assert sorted(finest) == [(x, y) for x in range(1, 5) for y in range(8)]
@@ -0,0 +1,87 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import gdal
+from metrics import track, file_size
+
+# ----------------------------
+# .IMG → GeoTIFF / COG conversion
+# ----------------------------
+OUTPUT_MODE = "gtiff"  # "gtiff" = legacy striped BIGTIFF; "cog" = tiled, compressed, with overviews
+COMPRESS = "DEFLATE"  # DEFLATE, ZSTD, LZW or NONE
+BLOCK_SIZE = 512
+
+# Enable GDAL exceptions
+gdal.UseExceptions()
+
+
+def gdal_threads(workers=1):
+    """GDAL compression / overview threads per file when `workers` files are converted at once."""
+    return max(1, (os.cpu_count() or 1) // max(1, workers))
+
+
+def creation_options(mode=OUTPUT_MODE, compress=COMPRESS, threads=None):
+    """Return (driver, creation options) for an output mode."""
+    if mode == "gtiff":
+        return "GTiff", ["BIGTIFF=YES"]
+    if mode != "cog":
+        raise ValueError(f"unknown output mode {mode!r}")
+    options = [
+        f"BLOCKSIZE={BLOCK_SIZE}",
+        f"COMPRESS={compress}",
+        "OVERVIEWS=AUTO",
+        "OVERVIEW_RESAMPLING=AVERAGE",
+        "BIGTIFF=IF_SAFER",
+        f"NUM_THREADS={threads or gdal_threads()}",
+    ]
+    if compress != "NONE":
+        # Horizontal differencing for integers, floating point predictor for reals
+        options.append("PREDICTOR=YES")
+    if compress == "ZSTD":
+        options.append("LEVEL=9")
+    return "COG", options
+
+
+def convert_one(src_path, out_dir, cache=None, mode=OUTPUT_MODE, compress=COMPRESS, threads=None):
+    """
+    Convert a single .IMG to a GeoTIFF/COG in out_dir and return the output path.
+    threads = GDAL threads for this file; pass gdal_threads(n) when n files convert at once.
+    """
+    fname = os.path.basename(src_path)
+    dst_path = os.path.join(out_dir, fname.replace(".IMG", ".tif"))
+    driver, options = creation_options(mode, compress, threads)
+    params = {"format": driver, "creationOptions": [o for o in options if not o.startswith("NUM_THREADS")]}
+    if cache and cache.is_fresh("convert", src_path, params, [dst_path]):
+        print(f"Up to date: {dst_path}")
+        return dst_path
+    print(f"Converting {fname} → {dst_path}")
+    with track("convert", fname, file_size(src_path), mode=mode, compress=compress) as rec:
+        gdal.Translate(
+            dst_path,
+            src_path,
+            options=gdal.TranslateOptions(format=driver, creationOptions=options)
+        )
+        rec["bytes_out"] = file_size(dst_path)
+    if cache:
+        cache.record("convert", src_path, params, [dst_path])
+    return dst_path
+
+
+def convert_img_to_tif(raw_dir, out_dir, cache=None, mode=OUTPUT_MODE, compress=COMPRESS, workers=2):
+    """
+    Convert every .IMG in raw_dir. GDAL releases the GIL, so a small thread pool overlaps
+    I/O across files while NUM_THREADS parallelises compression within each file; the
+    cores are split between the two so `workers` files never start more threads than cores.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    names = [f for f in os.listdir(raw_dir) if f.upper().endswith(".IMG")]
+    threads = gdal_threads(workers)
+
+    def run(fname):
+        try:
+            return convert_one(os.path.join(raw_dir, fname), out_dir, cache, mode, compress, threads)
+        except Exception as e:
+            print(f"Failed to convert {fname}: {e}")
+            return None
+
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as pool:
+        return [p for p in pool.map(run, names) if p]
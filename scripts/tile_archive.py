@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import hashlib
+import threading
+
+# ----------------------------
+# Packed tile archive (MBTiles-style SQLite)
+# ----------------------------
+# All tiles of a product live in one file: `images` holds each distinct tile body once
+# (keyed by content hash, so blank/nodata tiles are stored a single time) and `map`
+# points (zoom, column, row) at it. The `tiles` view gives the usual MBTiles interface.
+# Column/row are tile indices with row 0 at the top (metadata scheme = "xyz"), matching
+# the level_N/{x}_{y} pixel-offset layout divided by the tile size.
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS images (tile_id TEXT PRIMARY KEY, tile_data BLOB);
+CREATE TABLE IF NOT EXISTS map (
+    zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_id TEXT,
+    PRIMARY KEY (zoom_level, tile_column, tile_row)
+) WITHOUT ROWID;
+CREATE VIEW IF NOT EXISTS tiles AS
+    SELECT map.zoom_level AS zoom_level, map.tile_column AS tile_column, map.tile_row AS tile_row,
+           images.tile_data AS tile_data
+    FROM map JOIN images ON images.tile_id = map.tile_id;
+"""
+
+BATCH_SIZE = 2000
+
+
+class TileArchive:
+    """Single-file tile store with batched transactional inserts and content dedup."""
+
+    def __init__(self, path, mode="r"):
+        self.path = path
+        self.mode = mode
+        self._lock = threading.Lock()
+        if mode == "r":
+            self.conn = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            if mode == "w" and os.path.exists(path):
+                os.remove(path)
+            self.conn = sqlite3.connect(path, check_same_thread=False)
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=OFF")
+            self.conn.executescript(SCHEMA)
+        self._map = []
+        self._images = {}
+        self.tiles = 0
+        self.unique = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def set_metadata(self, **values):
+        with self._lock:
+            self.conn.executemany("INSERT OR REPLACE INTO metadata VALUES (?, ?)",
+                                  [(k, str(v)) for k, v in values.items()])
+            self.conn.commit()
+
+    def metadata(self):
+        return dict(self.conn.execute("SELECT name, value FROM metadata"))
+
+    def put(self, z, x, y, data):
+        """Queue one encoded tile; flushed in batches of BATCH_SIZE."""
+        tile_id = hashlib.blake2b(data, digest_size=16).hexdigest()
+        with self._lock:
+            self._images.setdefault(tile_id, data)
+            self._map.append((z, x, y, tile_id))
+            self.tiles += 1
+            if len(self._map) >= BATCH_SIZE:
+                self._flush()
+
+    def _flush(self):
+        if not self._map:
+            return
+        with self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany("INSERT OR IGNORE INTO images VALUES (?, ?)", self._images.items())
+            self.unique += self.conn.total_changes - before
+            self.conn.executemany("INSERT OR REPLACE INTO map VALUES (?, ?, ?, ?)", self._map)
+        self._map = []
+        self._images = {}
+
+    def get(self, z, x, y):
+        """Encoded tile bytes or None (one indexed lookup)."""
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT images.tile_data FROM map JOIN images ON images.tile_id = map.tile_id "
+                "WHERE zoom_level=? AND tile_column=? AND tile_row=?", (z, x, y)).fetchone()
+        return row[0] if row else None
+
+    def delete(self, z, x, y):
+        """Drop one tile from the map (its body stays in `images`, where other tiles may share it)."""
+        with self._lock:
+            self._flush()
+            self.conn.execute("DELETE FROM map WHERE zoom_level=? AND tile_column=? AND tile_row=?", (z, x, y))
+
+    def delete_many(self, keys):
+        """delete() for an iterable of (zoom, column, row) in one transaction."""
+        with self._lock:
+            self._flush()
+            with self.conn:
+                self.conn.executemany("DELETE FROM map WHERE zoom_level=? AND tile_column=? AND tile_row=?", keys)
+
+    def move_levels(self, moves):
+        """
+        Relabel whole zoom levels in place: moves = {old zoom: (new zoom, column shift, row shift)}.
+        Levels not in `moves` are dropped. Tile bodies are untouched.
+        """
+        with self._lock:
+            self._flush()
+            with self.conn:
+                # Parked at negative zooms first, so no move collides with a level not moved yet
+                for old, (new, dx, dy) in moves.items():
+                    self.conn.execute("UPDATE map SET zoom_level = ?, tile_column = tile_column + ?, "
+                                      "tile_row = tile_row + ? WHERE zoom_level = ?", (-1 - new, dx, dy, old))
+                self.conn.execute("DELETE FROM map WHERE zoom_level >= 0")
+                self.conn.execute("UPDATE map SET zoom_level = -1 - zoom_level")
+
+    def close(self):
+        with self._lock:
+            if self.mode != "r":
+                self._flush()
+                self.conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            self.conn.close()
+
@@ -0,0 +1,143 @@
+import os
+import math
+import time
+import random
+import asyncio
+import argparse
+from urllib.parse import urlparse
+
+# Load test for tile_server.py: N keep-alive connections issue random tile requests
+# for a duration and report throughput and p50/p99 latency. The request set is drawn
+# from the tiles the product really has at each level (from its .mbtiles metadata or
+# its source raster), and 404s are counted apart from the latencies of served tiles.
+
+
+async def _get(reader, writer, host, path):
+    writer.write(f"GET {path} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+    await writer.drain()
+    status = (await reader.readline()).split()[1]
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b""):
+            break
+        if line.lower().startswith(b"content-length:"):
+            length = int(line.split(b":")[1])
+    if length:
+        await reader.readexactly(length)
+    return int(status)
+
+
+async def client(base, paths, deadline, latencies, statuses, seed):
+    url = urlparse(base)
+    reader, writer = await asyncio.open_connection(url.hostname, url.port or 80)
+    rng = random.Random(seed)
+    try:
+        while time.perf_counter() < deadline:
+            path = url.path.rstrip("/") + rng.choice(paths)
+            start = time.perf_counter()
+            status = await _get(reader, writer, url.netloc, path)
+            if status != 404:
+                latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+
+def product_size(product, web_tiles_dir, processed_dir=None, raw_dir=None):
+    """Full-resolution (width, height) of `product`: archive metadata, else its .tif or raw .IMG."""
+    archive = os.path.join(web_tiles_dir, product + ".mbtiles")
+    if os.path.exists(archive):
+        from tile_archive import TileArchive
+        with TileArchive(archive) as a:
+            meta = a.metadata()
+        if "width" in meta:
+            return int(meta["width"]), int(meta["height"])
+    tif = os.path.join(processed_dir or "", product + ".tif")
+    if os.path.exists(tif):
+        import rasterio
+        with rasterio.open(tif) as src:
+            return src.width, src.height
+    img = os.path.join(raw_dir or "", product + ".IMG")
+    if os.path.exists(img):
+        from raw_image import RawImage
+        src = RawImage(img)
+        return src.width, src.height
+    raise FileNotFoundError(f"no archive or source raster for {product}")
+
+
+def tile_paths(product, size, tile_size=256, levels=None, tiles_per_level=256, seed=0):
+    """
+    Tile URLs that exist in the product's pyramid: at each level (default: the five finest)
+    the grid is ceil(level size / tile_size), and levels with more than tiles_per_level
+    tiles are sampled.
+    """
+    w, h = size
+    max_level = math.ceil(math.log2(max(w, h, 2)))
+    if levels is None:
+        levels = range(max(max_level - 4, 0), max_level + 1)
+    rng = random.Random(seed)
+    paths = []
+    for z in levels:
+        if not 0 <= z <= max_level:
+            continue
+        scale = 2 ** (max_level - z)
+        nx = math.ceil(math.ceil(w / scale) / tile_size)
+        ny = math.ceil(math.ceil(h / scale) / tile_size)
+        cells = range(nx * ny)
+        if len(cells) > tiles_per_level:
+            cells = rng.sample(cells, tiles_per_level)
+        paths += [f"/tiles/{product}/{z}/{i % nx}/{i // nx}" for i in cells]
+    return paths
+
+
+def percentile(sorted_values, q):
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+async def run(base, paths, connections, duration):
+    """Throughput over all requests; latency percentiles over served tiles only (404s are counted apart)."""
+    latencies, statuses = [], {}
+    deadline = time.perf_counter() + duration
+    start = time.perf_counter()
+    await asyncio.gather(*(client(base, paths, deadline, latencies, statuses, i) for i in range(connections)))
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    if not latencies:
+        latencies.append(float("nan"))
+    return {
+        "requests": sum(statuses.values()),
+        "rps": sum(statuses.values()) / elapsed,
+        "not_found": statuses.get(404, 0),
+        "p50_ms": percentile(latencies, 0.50) * 1e3,
+        "p99_ms": percentile(latencies, 0.99) * 1e3,
+        "max_ms": latencies[-1] * 1e3,
+        "statuses": statuses,
+    }
+
+
+if __name__ == "__main__":
+    from config import load_config
+    cfg = load_config()
+    parser = argparse.ArgumentParser(description="Load-test the tile server")
+    parser.add_argument("product")
+    parser.add_argument("--base", default="http://127.0.0.1:8080")
+    parser.add_argument("--levels", type=int, nargs="+", default=None, help="default: the five finest levels")
+    parser.add_argument("--tiles-per-level", type=int, default=256, help="sample size for larger levels")
+    parser.add_argument("--size", type=int, nargs=2, metavar=("W", "H"),
+                        help="product size, default: read from its archive or source raster")
+    parser.add_argument("--web-tiles-dir", default=cfg["web_tiles_dir"])
+    parser.add_argument("--processed-dir", default=cfg["processed_dir"])
+    parser.add_argument("--raw-dir", default=cfg["raw_dir"])
+    parser.add_argument("--tile-size", type=int, default=cfg["tile_size"])
+    parser.add_argument("-c", "--connections", type=int, default=32)
+    parser.add_argument("-d", "--duration", type=float, default=10.0)
+    args = parser.parse_args()
+
+    size = args.size or product_size(args.product, args.web_tiles_dir, args.processed_dir, args.raw_dir)
+    paths = tile_paths(args.product, size, args.tile_size, args.levels, args.tiles_per_level)
+    print(f"{args.product}: {size[0]}x{size[1]}, {len(paths)} distinct tiles")
+    result = asyncio.run(run(args.base, paths, args.connections, args.duration))
+    print(f"{result['requests']} requests, {result['rps']:.0f} req/s, {result['not_found']} not found")
+    print(f"served tiles: p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, max {result['max_ms']:.2f} ms")
+    print(f"statuses: {result['statuses']}")
@@ -0,0 +1,363 @@
+import os
+import re
+import math
+import asyncio
+import hashlib
+import argparse
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from email.utils import formatdate
+import numpy as np
+import cv2
+import rasterio
+from rasterio.enums import Resampling
+from rasterio.windows import Window
+from raw_image import RawImage
+from pyramid_tiles import TileEncoder, classify_band, downsample2x, open_rows, product_stats, EMPTY
+from stretch import stretcher
+from tile_archive import TileArchive
+from metrics import METRICS
+from config import load_config
+
+# ----------------------------
+# Local tile server
+# ----------------------------
+# GET /tiles/{product}/{z}/{x}/{y} returns the pre-rendered tile from web_tiles/<product>.mbtiles
+# or web_tiles/<product>/level_z/{x*ts}_{y*ts}.jpg when it exists, and otherwise renders it from the product's GeoTIFF/COG (or raw .IMG)
+# with a windowed read in a process pool, reduced by the same 2x2 box averaging as the
+# pre-rendered pyramid. Responses go through a byte-bounded LRU cache, carry an ETag
+# (304 on If-None-Match) and concurrent misses for the same tile share a single render.
+
+CONFIG = load_config()
+WEB_TILES_DIR = CONFIG["web_tiles_dir"]
+PROCESSED_DIR = CONFIG["processed_dir"]
+RAW_DIR = CONFIG["raw_dir"]
+HOST = "127.0.0.1"
+PORT = 8080
+TILE_SIZE = CONFIG["tile_size"]
+CACHE_BYTES = 256 * 1024 * 1024
+RENDER_WORKERS = os.cpu_count()
+EXACT_SCALE = 16  # up to this zoom-out factor renders match the pyramid exactly; beyond, the read is pre-averaged
+
+# Product names are plain file stems: no separators, no leading dot (so no "..")
+_ROUTE = re.compile(r"^/tiles/([A-Za-z0-9_-][A-Za-z0-9_.-]*)/(\d+)/(\d+)/(\d+)(?:\.jpg|\.png)?$")
+_PNG_MAGIC = b"\x89PNG"
+NODATA = 0  # used when a source declares no nodata value (CTX fill)
+
+
+class LRUBytesCache:
+    """LRU of (etag, body) limited by the total size of the bodies."""
+
+    def __init__(self, max_bytes=CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.items = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        item = self.items.get(key)
+        if item is None:
+            self.misses += 1
+            return None
+        self.items.move_to_end(key)
+        self.hits += 1
+        return item
+
+    def put(self, key, etag, body):
+        if len(body) > self.max_bytes:
+            return
+        old = self.items.pop(key, None)
+        if old:
+            self.bytes -= len(old[1])
+        self.items[key] = (etag, body)
+        self.bytes += len(body)
+        while self.bytes > self.max_bytes:
+            _, (_, evicted) = self.items.popitem(last=False)
+            self.bytes -= len(evicted)
+
+    def drop(self, product):
+        """Forget every cached tile of `product` (its archive was rewritten)."""
+        for key in [k for k in self.items if k[0] == product]:
+            self.bytes -= len(self.items.pop(key)[1])
+
+
+# ----------------------------
+# Rendering (runs in worker processes)
+# ----------------------------
+_sources = {}
+_stretchers = {}
+
+
+def _open_source(path):
+    src = _sources.get(path)
+    if src is None:
+        if path.upper().endswith(".IMG"):
+            src = RawImage(path)
+        else:
+            src = rasterio.open(path)
+        _sources[path] = src
+    return src
+
+
+def _box_reduce(block, scale):
+    """Halve `block` with downsample2x until `scale` is 1, like PyramidTiler (odd rows repeat the last)."""
+    while scale > 1:
+        if len(block) % 2:
+            block = np.concatenate([block, block[-1:]])
+        block = downsample2x(block)
+        scale //= 2
+    return block
+
+
+def source_stats(path):
+    """Stretch stats of a source that is not 8-bit (None for uint8 data)."""
+    with open_rows(path) as (_, _, read_rows, nodata):
+        if read_rows(0, 1).dtype == np.uint8:
+            return None
+    return product_stats(path, NODATA if nodata is None else nodata)
+
+
+def render_tile(path, z, x, y, tile_size=TILE_SIZE, quality=90, stats=None):
+    """
+    Render tile (z, x, y) of the level_N pyramid layout. Returns JPEG bytes, PNG-with-alpha
+    bytes for a partly valid tile, or None if the tile is outside the image or all nodata.
+    `stats` (from source_stats) saves the worker a pass over the product for non-8-bit data.
+    """
+    src = _open_source(path)
+    w, h = src.width, src.height
+    max_level = math.ceil(math.log2(max(w, h, 2)))
+    if z > max_level:
+        return None
+    scale = 2 ** (max_level - z)
+    level_w, level_h = math.ceil(w / scale), math.ceil(h / scale)
+    px, py = x * tile_size, y * tile_size
+    if px >= level_w or py >= level_h:
+        return None
+    tw, th = min(tile_size, level_w - px), min(tile_size, level_h - py)
+    col, row = px * scale, py * scale
+    cw, rh = min(tw * scale, w - col), min(th * scale, h - row)
+
+    # Full resolution up to EXACT_SCALE; further out an averaged read (GDAL overviews when present)
+    # stands in for the finer levels, so only those coarse tiles can differ slightly from stored ones
+    pre = max(scale // EXACT_SCALE, 1)
+    shape = (math.ceil(rh / pre), math.ceil(cw / pre))
+    if isinstance(src, RawImage):
+        block = src.read_window(row, col, rh, cw)
+        if pre > 1:
+            block = cv2.resize(np.ascontiguousarray(block), shape[::-1], interpolation=cv2.INTER_AREA)
+    else:
+        block = src.read(1, window=Window(col, row, cw, rh), out_shape=shape, resampling=Resampling.average)
+    nodata = getattr(src, "nodata", None)
+    nodata = NODATA if nodata is None else nodata
+    if block.dtype != np.uint8:
+        # Same global stretch as the pre-rendered pyramid, applied before reducing as the tiler does
+        key = (path, stats["low"], stats["high"]) if stats else path
+        if key not in _stretchers:
+            _stretchers[key] = stretcher(stats or product_stats(path, nodata), nodata)
+        block = _stretchers[key](block)
+        nodata = 0
+    tile = _box_reduce(np.ascontiguousarray(block), scale // pre)
+    kind = classify_band(tile, max(tw, 1), nodata)[0]
+    if kind == EMPTY:
+        return None
+    encoded = TileEncoder(".jpg", nodata, [cv2.IMWRITE_JPEG_QUALITY, quality]).encode(tile, kind)
+    return encoded[1] if encoded else None
+
+
+# ----------------------------
+# Server
+# ----------------------------
+class TileServer:
+    def __init__(self, web_tiles_dir=WEB_TILES_DIR, processed_dir=PROCESSED_DIR, raw_dir=RAW_DIR,
+                 tile_size=TILE_SIZE, cache_bytes=CACHE_BYTES, workers=RENDER_WORKERS):
+        self.web_tiles_dir = web_tiles_dir
+        self.processed_dir = processed_dir
+        self.raw_dir = raw_dir
+        self.tile_size = tile_size
+        self.cache = LRUBytesCache(cache_bytes)
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.inflight = {}
+        self.archives = {}
+        self.stats = {}  # source -> (mtime_ns, stretch stats)
+        self.stats_locks = {}
+        self.rendered = 0
+
+    def source_for(self, product):
+        for path in (os.path.join(self.processed_dir or "", product + ".tif"),
+                     os.path.join(self.raw_dir or "", product + ".IMG")):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def archive_for(self, product):
+        """The product's open TileArchive, or None. Only hits are kept, and a rewritten file is reopened."""
+        path = os.path.join(self.web_tiles_dir, product + ".mbtiles")
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            self.archives.pop(product, None)
+            return None
+        stamp = (st.st_ino, st.st_mtime_ns)
+        cached = self.archives.get(product)
+        if cached is None or cached[0] != stamp:
+            if cached is not None:
+                self.cache.drop(product)
+            # A replaced connection is not closed here: a lookup in flight may still hold it
+            cached = self.archives[product] = (stamp, TileArchive(path))
+        return cached[1]
+
+    async def stats_for(self, source):
+        """
+        Stretch stats of `source`, computed (or read from stretch_dir) once in this process under
+        a per-source lock, so concurrent renders neither repeat the pass nor race on the cache file.
+        """
+        lock = self.stats_locks.setdefault(source, asyncio.Lock())
+        async with lock:
+            mtime = os.stat(source).st_mtime_ns
+            cached = self.stats.get(source)
+            if cached is None or cached[0] != mtime:
+                stats = await asyncio.get_running_loop().run_in_executor(None, source_stats, source)
+                cached = self.stats[source] = (mtime, stats)
+            return cached[1]
+
+    def _load(self, product, z, x, y, archive):
+        if archive is not None:
+            return archive.get(z, x, y)
+        stem = os.path.join(self.web_tiles_dir, product, f"level_{z}", f"{x * self.tile_size}_{y * self.tile_size}")
+        for ext in (".jpg", ".png"):
+            try:
+                with open(stem + ext, "rb") as f:
+                    return f.read()
+            except FileNotFoundError:
+                pass
+        return None
+
+    async def get_tile(self, product, z, x, y):
+        """Return (etag, body) or None. Renders at most once per key at a time."""
+        key = (product, z, x, y)
+        cached = self.cache.get(key)
+        if cached:
+            return cached
+        task = self.inflight.get(key)
+        if task is None:
+            # The load runs as its own task: a cancelled requester does not strand the others
+            task = asyncio.ensure_future(self._fetch(key))
+            task.add_done_callback(lambda t: t.cancelled() or t.exception())  # retrieved even if nobody waits
+            self.inflight[key] = task
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key):
+        product, z, x, y = key
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        try:
+            archive = self.archive_for(product)
+            body = await loop.run_in_executor(None, self._load, product, z, x, y, archive)
+            origin = "stored"
+            if body is None and archive is None:
+                # A packed archive is complete: a missing tile there is a skipped blank one
+                source = self.source_for(product)
+                if source is not None:
+                    stats = await self.stats_for(source)
+                    body = await loop.run_in_executor(self.pool, render_tile, source, z, x, y, self.tile_size,
+                                                      90, stats)
+                    self.rendered += 1
+                    origin = "rendered"
+            METRICS.observe("tile_load_seconds", loop.time() - start, origin=origin)
+            result = None
+            if body is not None:
+                result = ('"' + hashlib.blake2b(body, digest_size=12).hexdigest() + '"', body)
+                self.cache.put(key, *result)
+            return result
+        finally:
+            del self.inflight[key]
+
+    async def handle(self, reader, writer):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = line.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                parts = request_line.decode("latin-1").split()
+                method, target = (parts[0], parts[1]) if len(parts) >= 2 else ("", "")
+                status, extra, body = await self.respond(method, target.split("?")[0], headers)
+                keep_alive = headers.get("connection", "").lower() != "close"
+                head = [f"HTTP/1.1 {status}", f"Date: {formatdate(usegmt=True)}",
+                        f"Content-Length: {len(body)}",
+                        "Connection: " + ("keep-alive" if keep_alive else "close")] + extra
+                writer.write(("\r\n".join(head) + "\r\n\r\n").encode("latin-1"))
+                if method != "HEAD":
+                    writer.write(body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionResetError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def respond(self, method, path, headers):
+        if method not in ("GET", "HEAD"):
+            return "405 Method Not Allowed", [], b""
+        if path == "/stats":
+            text = (f"cache_bytes {self.cache.bytes}\ncache_items {len(self.cache.items)}\n"
+                    f"cache_hits {self.cache.hits}\ncache_misses {self.cache.misses}\n"
+                    f"rendered {self.rendered}\n")
+            return "200 OK", ["Content-Type: text/plain"], text.encode()
+        if path == "/metrics":
+            METRICS.set("tile_cache_bytes", self.cache.bytes)
+            METRICS.set("tile_cache_items", len(self.cache.items))
+            METRICS.set("tile_cache_hits", self.cache.hits)
+            METRICS.set("tile_cache_misses", self.cache.misses)
+            return "200 OK", ["Content-Type: text/plain; version=0.0.4"], METRICS.prometheus().encode()
+        m = _ROUTE.match(path)
+        if not m:
+            return "404 Not Found", [], b""
+        product, z, x, y = m.group(1), int(m.group(2)), int(m.group(3)), int(m.group(4))
+        try:
+            tile = await self.get_tile(product, z, x, y)
+        except Exception as e:
+            print(f"Render failed for {path}: {e}")
+            return "500 Internal Server Error", [], b""
+        if tile is None:
+            return "404 Not Found", [], b""
+        etag, body = tile
+        common = [f"ETag: {etag}", "Cache-Control: public, max-age=86400"]
+        if etag in [t.strip() for t in headers.get("if-none-match", "").split(",")]:
+            return "304 Not Modified", common, b""
+        content_type = "image/png" if body.startswith(_PNG_MAGIC) else "image/jpeg"
+        return "200 OK", [f"Content-Type: {content_type}"] + common, body
+
+    async def serve(self, host=HOST, port=PORT):
+        server = await asyncio.start_server(self.handle, host, port)
+        print(f"Serving tiles on http://{host}:{server.sockets[0].getsockname()[1]}/tiles/{{product}}/{{z}}/{{x}}/{{y}}")
+        async with server:
+            await server.serve_forever()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve pyramid tiles, rendering missing ones on demand")
+    parser.add_argument("--web-tiles-dir", default=WEB_TILES_DIR)
+    parser.add_argument("--processed-dir", default=PROCESSED_DIR)
+    parser.add_argument("--raw-dir", default=RAW_DIR)
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE)
+    parser.add_argument("--cache-mb", type=int, default=CACHE_BYTES // (1024 * 1024))
+    parser.add_argument("--workers", type=int, default=RENDER_WORKERS)
+    args = parser.parse_args()
+
+    server = TileServer(args.web_tiles_dir, args.processed_dir, args.raw_dir, args.tile_size,
+                        args.cache_mb * 1024 * 1024, args.workers)
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
@@ -1,20 +1,17 @@
-import rasterio
-import matplotlib
-matplotlib.use('Agg')  # Non-GUI backend
-import matplotlib.pyplot as plt
+import argparse
+from config import load_config
+from preview import write_preview
 
-# Path to a converted .tif
-tif_path = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\merged\ctx_mrox_3886_basemap.tif"
+parser = argparse.ArgumentParser(description="PNG preview of a raster (default: the merged basemap)")
+parser.add_argument("input", nargs="?", help="a converted .tif (default: merged_path)")
+parser.add_argument("-o", "--output", default="preview.png")
+parser.add_argument("--max-size", type=int, default=4096)
+parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+args = parser.parse_args()
 
-with rasterio.open(tif_path) as src:
-    img = src.read(1)  # read first band
-    height, width = img.shape
-    dpi = 100  # dots per inch
-    figsize = (width / dpi, height / dpi)
-    plt.figure(figsize=figsize)
-    plt.imshow(img, cmap='gray')
-    plt.title("Preview of CTX .tif")
-    plt.axis('off')
-    plt.savefig("preview.png", dpi=300, bbox_inches='tight')
-    print("Preview saved to preview.png")
+# Path to a converted .tif
+tif_path = args.input or load_config(args.config)["merged_path"]
 
+# Decimated read (overviews when present) instead of loading the whole basemap
+w, h = write_preview(tif_path, args.output, max_size=args.max_size)
+print(f"Preview saved to {args.output} ({w}x{h})")
@@ -1,25 +1,19 @@
 import os
-from osgeo import gdal
-import matplotlib.pyplot as plt
+import argparse
+from config import load_config
+from preview import write_preview
 
-input_tif = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\data\merged\ctx_mrox_3886_basemap.tif"
+parser = argparse.ArgumentParser(description="Downsampled PNG of the merged basemap into preview_dir")
+parser.add_argument("input", nargs="?", help="default: merged_path")
+parser.add_argument("--config", help="JSON settings file (default: $CTX_CONFIG or ./ctx.json)")
+args = parser.parse_args()
+cfg = load_config(args.config)
 
-ds = gdal.Open(input_tif)
+input_tif = args.input or cfg["merged_path"]
 
-# Read into a small downsampled array (max 2000x2000 for preview)
-w, h = ds.RasterXSize, ds.RasterYSize
-scale = max(w, h) / 2000  # adjust max dimension to 2000 pixels
-read_w = int(w / scale)
-read_h = int(h / scale)
-
-band = ds.GetRasterBand(1)
-preview = band.ReadAsArray(buf_xsize=read_w, buf_ysize=read_h)
-
-plt.imshow(preview, cmap='gray')
-plt.axis('off')
-output_folder = r"C:\Users\himan\Desktop\Spaceapps\spaceapps_challenge\previews"
-os.makedirs(output_folder, exist_ok=True)  # create folder if it doesn't exist
+output_folder = cfg["preview_dir"]
 output_file = os.path.join(output_folder, "preview_downsampled.png")
-plt.savefig(output_file, dpi=150, bbox_inches='tight')
-plt.close()
-print("✅ Preview saved as preview_downsampled.png")
+
+# Max 2000 pixels on the longest side, read from overviews / decimated
+write_preview(input_tif, output_file, max_size=2000)
+print(f"✅ Preview saved as {output_file}")